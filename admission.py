@@ -0,0 +1,218 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from auth import sessions
+
+# Requests handled at once per route class; 0 means no limit
+READ_CONCURRENCY = int(os.environ.get("LIBRARY_READ_CONCURRENCY", "32"))
+WRITE_CONCURRENCY = int(os.environ.get("LIBRARY_WRITE_CONCURRENCY", "16"))
+ADMIN_CONCURRENCY = int(os.environ.get("LIBRARY_ADMIN_CONCURRENCY", "4"))
+# Requests that may wait for a slot, per slot; more are refused at once with 503
+QUEUE_PER_SLOT = 4
+# Longest a request waits for a slot before it is refused with 503
+ADMISSION_DEADLINE = float(os.environ.get("LIBRARY_ADMISSION_DEADLINE", "1.0"))
+# Requests per second per client (user, or address without a session), with bursts of
+# up to RATE_BURST; 0 disables rate limiting. Each worker keeps its own buckets.
+RATE_LIMIT = float(os.environ.get("LIBRARY_RATE_LIMIT", "20"))
+RATE_BURST = int(os.environ.get("LIBRARY_RATE_BURST", "60"))
+# Clients tracked per worker; the least recently seen are forgotten first
+RATE_CLIENTS = 100_000
+# Long-lived or operational routes that are never limited; a refused health
+# probe would look like a dead worker
+EXEMPT_PATHS = frozenset({"/events", "/metrics", "/health/live", "/health/ready", "/docs", "/redoc",
+                          "/openapi.json"})
+
+# -------------------------------
+# Admission Control
+# -------------------------------
+
+class Rejected(Exception):
+    def __init__(self, status_code: int, reason: str, detail: str, retry_after: float):
+        self.status_code = status_code
+        self.reason = reason
+        self.detail = detail
+        self.retry_after = retry_after
+
+    def response(self) -> JSONResponse:
+        return JSONResponse({"detail": self.detail}, status_code=self.status_code,
+                            headers={"Retry-After": str(max(1, math.ceil(self.retry_after)))})
+
+
+class ConcurrencyLimit:
+    """
+    At most `limit` requests of one class run at once; up to `max_queue` more
+    wait in FIFO order for `deadline` seconds. Anything beyond that is refused
+    with 503 right away, so a burst turns into quick refusals the client can
+    retry instead of a queue every request times out in.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int, deadline: float = ADMISSION_DEADLINE):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.deadline = deadline
+        self.active = 0
+        self._waiters = deque()
+        self._stats = {"admitted": 0, "queued": 0, "queue_full": 0, "deadline": 0, "wait_seconds": 0.0}
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self):
+        if self.limit <= 0 or (self.active < self.limit and not self._waiters):
+            self.active += 1
+            self._stats["admitted"] += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self._stats["queue_full"] += 1
+            raise Rejected(503, "queue_full", "Server busy, please retry.", self.deadline)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._stats["queued"] += 1
+        started = time.perf_counter()
+        try:
+            # shield: on timeout, check whether release() handed us the slot at the last moment
+            await asyncio.wait_for(asyncio.shield(waiter), self.deadline)
+        except asyncio.TimeoutError:
+            if not waiter.done():
+                waiter.cancel()
+                self._waiters.remove(waiter)
+                self._stats["deadline"] += 1
+                raise Rejected(503, "deadline", "Server busy, please retry.", self.deadline)
+        except asyncio.CancelledError:
+            # Client went away while queued; pass on a slot it may have been given
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            raise
+        finally:
+            self._stats["wait_seconds"] += time.perf_counter() - started
+        self._stats["admitted"] += 1
+
+    def release(self):
+        # Hand the slot straight to the oldest waiter, so active does not change
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> dict:
+        return {**self._stats, "limit": self.limit, "active": self.active, "waiting": self.waiting,
+                "wait_seconds": round(self._stats["wait_seconds"], 3)}
+
+
+class TokenBuckets:
+    """One token bucket per client key: `rate` tokens per second, holding at most `burst`."""
+
+    def __init__(self, rate: float = RATE_LIMIT, burst: int = RATE_BURST, max_clients: int = RATE_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._stats = {"allowed": 0, "limited": 0}
+
+    def take(self, key: str) -> float:
+        """0 if the request may go ahead, otherwise the seconds until a token is available."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            tokens = self.burst
+            if len(self._buckets) >= self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            self._buckets.move_to_end(key)
+        if tokens < 1:
+            self._buckets[key] = [tokens, now]
+            self._stats["limited"] += 1
+            return (1 - tokens) / self.rate
+        self._buckets[key] = [tokens - 1, now]
+        self._stats["allowed"] += 1
+        return 0.0
+
+    def stats(self) -> dict:
+        return {**self._stats, "rate": self.rate, "burst": self.burst, "clients": len(self._buckets)}
+
+
+def route_class(scope) -> str:
+    """read, write or admin; None for routes that are never limited."""
+    path = scope["path"]
+    if path in EXEMPT_PATHS:
+        return None
+    if path.startswith("/admin/"):
+        return "admin"
+    return "read" if scope["method"] in ("GET", "HEAD") else "write"
+
+
+def client_key(scope) -> str:
+    """The signed-in user if the request carries a valid session, else the client address."""
+    scheme, _, token = (Headers(scope=scope).get("authorization") or "").partition(" ")
+    session = sessions.validate(token.strip()) if scheme.lower() == "bearer" else None
+    if session is not None:
+        return f"user:{session.user_id}"
+    client = scope.get("client")
+    return f"addr:{client[0] if client else '-'}"
+
+
+class Admission:
+    def __init__(self, read: int = READ_CONCURRENCY, write: int = WRITE_CONCURRENCY,
+                 admin: int = ADMIN_CONCURRENCY, rate: float = RATE_LIMIT, burst: int = RATE_BURST):
+        self.limits = {
+            name: ConcurrencyLimit(name, limit, limit * QUEUE_PER_SLOT)
+            for name, limit in (("read", read), ("write", write), ("admin", admin))
+        }
+        self.buckets = TokenBuckets(rate, burst)
+
+    def stats(self) -> dict:
+        return {"classes": {name: limit.stats() for name, limit in self.limits.items()},
+                "rate_limit": self.buckets.stats()}
+
+
+admission = Admission()
+
+# -------------------------------
+# ASGI Middleware
+# -------------------------------
+
+class AdmissionMiddleware:
+    """
+    Rate-limits each client (429) and caps concurrent requests per route class
+    (503), both with Retry-After. Reads, writes and admin calls have separate
+    limits, so a storm of dashboard reloads cannot take the slots a checkout
+    needs. It sits inside ResponseCacheMiddleware: cache hits never touch
+    SQLite and are served without using a slot or a token.
+    """
+
+    def __init__(self, app, control: Admission = admission):
+        self.app = app
+        self.control = control
+
+    async def __call__(self, scope, receive, send):
+        kind = route_class(scope) if scope["type"] == "http" else None
+        if kind is None:
+            await self.app(scope, receive, send)
+            return
+        limit = self.control.limits[kind]
+        try:
+            wait = self.control.buckets.take(client_key(scope))
+            if wait:
+                raise Rejected(429, "rate_limited", "Too many requests, please slow down.", wait)
+            await limit.acquire()
+        except Rejected as rejected:
+            await rejected.response()(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limit.release()
@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+from database import DATABASE, pool
+from writequeue import write_queue
+
+# Returned loans older than this many days move to LoanArchive; 0 disables archiving
+ARCHIVE_AFTER_DAYS = int(os.environ.get("LIBRARY_ARCHIVE_AFTER_DAYS", "365"))
+# Seconds between archive runs
+ARCHIVE_INTERVAL = float(os.environ.get("LIBRARY_ARCHIVE_INTERVAL", "3600"))
+# Loans moved per write-queue operation (~10 ms of write lock), so request writes never wait long
+ARCHIVE_BATCH_ROWS = 100
+# Pause between batches and between vacuum steps
+ARCHIVE_PAUSE = 0.05
+# Free pages handed back to the filesystem per incremental_vacuum step
+VACUUM_STEP_PAGES = 1000
+# Only vacuum once this many pages are free
+VACUUM_MIN_FREE_PAGES = 1024
+
+# Loans returned before a cutoff, oldest return first, from idx_history_returned
+ARCHIVABLE_LOANS = """
+    SELECT HistoryID FROM BorrowingHistory
+    WHERE ReturnDate IS NOT NULL AND ReturnDate < ?
+    ORDER BY ReturnDate LIMIT ?
+"""
+
+log = logging.getLogger("library.archive")
+
+# -------------------------------
+# Loan Archiving
+# -------------------------------
+
+def enable_incremental_vacuum(database: str) -> bool:
+    """
+    Switch the file to auto_vacuum = INCREMENTAL. That takes one full VACUUM,
+    so it is done once, before any worker starts. Returns True if it converted.
+    """
+    conn = sqlite3.connect(database, isolation_level=None)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return True
+    finally:
+        conn.close()
+
+
+def move_batch(conn: sqlite3.Connection, cutoff: str, limit: int = ARCHIVE_BATCH_ROWS) -> int:
+    """Write-queue operation: move up to `limit` loans returned before `cutoff` to LoanArchive."""
+    ids = [row[0] for row in conn.execute(ARCHIVABLE_LOANS, (cutoff, limit))]
+    if not ids:
+        return 0
+    placeholders = ",".join("?" * len(ids))
+    conn.execute(f"""
+        INSERT OR REPLACE INTO LoanArchive (HistoryID, UserID, BookID, BorrowDate, DueDate, ReturnDate)
+        SELECT HistoryID, UserID, BookID, BorrowDate, DueDate, ReturnDate
+        FROM BorrowingHistory WHERE HistoryID IN ({placeholders})
+    """, ids)
+    conn.execute(f"DELETE FROM BorrowingHistory WHERE HistoryID IN ({placeholders})", ids)
+    return len(ids)
+
+
+class LoanArchiver:
+    """
+    Background task moving returned loans older than after_days from
+    BorrowingHistory to LoanArchive, then compacting the file.
+
+    Each batch of batch_rows loans is one operation on the write queue, so it
+    commits alongside request writes and never holds the write lock for more
+    than a few milliseconds; the pause between batches lets queued writes
+    through. Readers that need every loan (the recommender, /history/) read
+    the AllLoans view. Afterwards, if enough pages are free, it returns them
+    to the filesystem with PRAGMA incremental_vacuum, a step at a time.
+    Every worker runs one; they start at random offsets, and a batch only
+    moves rows still in BorrowingHistory, so running twice is harmless.
+    """
+
+    def __init__(self, after_days: int = ARCHIVE_AFTER_DAYS, interval: float = ARCHIVE_INTERVAL,
+                 batch_rows: int = ARCHIVE_BATCH_ROWS):
+        self.after_days = after_days
+        self.interval = interval
+        self.batch_rows = batch_rows
+        self._task: asyncio.Task = None
+        self._stats = {"runs": 0, "moved": 0, "batches": 0, "vacuumed_pages": 0, "errors": 0,
+                       "last_run": None, "last_seconds": None}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running or self.after_days <= 0 or self.interval <= 0:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def archive(self) -> int:
+        """Move every loan old enough, one batch at a time. Returns the number moved."""
+        cutoff = (date.today() - timedelta(days=self.after_days)).isoformat()
+        moved = 0
+        while True:
+            count = await write_queue.submit(lambda conn: move_batch(conn, cutoff, self.batch_rows))
+            moved += count
+            self._stats["moved"] += count
+            self._stats["batches"] += 1
+            if count < self.batch_rows:
+                return moved
+            await asyncio.sleep(ARCHIVE_PAUSE)
+
+    async def vacuum(self) -> int:
+        """Release free pages to the filesystem. Returns the number released."""
+        async with pool.reader() as db:
+            cursor = await db.execute("PRAGMA auto_vacuum")
+            if (await cursor.fetchone())[0] != 2:
+                # Not converted yet (serve.py or `python archive.py` does that)
+                return 0
+            cursor = await db.execute("PRAGMA freelist_count")
+            free = (await cursor.fetchone())[0]
+        if free < VACUUM_MIN_FREE_PAGES:
+            return 0
+        released = 0
+        while released < free:
+            async with pool.writer() as db:
+                # executescript steps the pragma to completion; execute() would free one page
+                await db.executescript(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})")
+            released += VACUUM_STEP_PAGES
+            await asyncio.sleep(ARCHIVE_PAUSE)
+        released = min(released, free)
+        self._stats["vacuumed_pages"] += released
+        return released
+
+    async def run_once(self) -> dict:
+        started = time.perf_counter()
+        moved = await self.archive()
+        released = await self.vacuum()
+        self._stats["runs"] += 1
+        self._stats["last_run"] = time.time()
+        self._stats["last_seconds"] = round(time.perf_counter() - started, 3)
+        return {"moved": moved, "vacuumed_pages": released}
+
+    async def _run(self):
+        # First run shortly after startup, at a random offset so workers do not collide
+        await asyncio.sleep(random.uniform(0.5, 1.0) * min(self.interval, 60))
+        while True:
+            try:
+                result = await self.run_once()
+                if result["moved"] or result["vacuumed_pages"]:
+                    log.info("archived %(moved)d loans, released %(vacuumed_pages)d pages", result)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._stats["errors"] += 1
+                log.exception("loan archive run failed")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {**self._stats, "after_days": self.after_days, "interval": self.interval, "running": self.running}
+
+
+archiver = LoanArchiver()
+
+
+async def main(database: str) -> dict:
+    from migrations import apply_migrations
+
+    if enable_incremental_vacuum(database):
+        print("Switched to incremental auto-vacuum")
+    pool.database = database
+    await pool.open()
+    try:
+        async with pool.writer() as db:
+            await apply_migrations(db)
+        await write_queue.start()
+        try:
+            return await archiver.run_once()
+        finally:
+            await write_queue.stop()
+    finally:
+        await pool.close()
+
+
+if __name__ == "__main__":
+    # python archive.py [database] -> one archive pass now, e.g. from cron with LIBRARY_ARCHIVE_INTERVAL=0
+    print(asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else DATABASE)))
@@ -0,0 +1,323 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import NamedTuple, Optional
+from fastapi import HTTPException, Request, Depends
+from starlette.datastructures import Headers
+
+# scrypt cost parameters: 16 MB of memory and a few tens of ms of CPU per hash
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+# Threads doing KDF work. hashlib releases the GIL while it hashes, so these
+# never block the event loop, but each one can keep a core busy; the default
+# leaves at least half the cores to request handling.
+KDF_WORKERS = int(os.environ.get("LIBRARY_KDF_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+# Niceness of the KDF threads (Linux applies it per thread). Under load the
+# scheduler then favours the event loop, so hashing uses spare CPU only.
+KDF_NICE = int(os.environ.get("LIBRARY_KDF_NICE", "19"))
+# Logins/registrations allowed to queue for a KDF thread; beyond that they get 503
+KDF_MAX_WAITING = int(os.environ.get("LIBRARY_KDF_MAX_WAITING", "16"))
+
+SESSION_TTL = 12 * 3600  # seconds
+# Verified tokens remembered, so a request costs a dict lookup instead of an HMAC
+SESSION_CACHE_SIZE = 10000
+# Tokens are signed with this key. Without LIBRARY_SECRET_KEY a random key is
+# used, which logs everyone out on restart and only works with one process.
+SECRET_KEY = (os.environ.get("LIBRARY_SECRET_KEY") or secrets.token_hex(32)).encode()
+# Set LIBRARY_REQUIRE_SESSION=0 to let requests without a token through (for local scripts)
+REQUIRE_SESSION = os.environ.get("LIBRARY_REQUIRE_SESSION", "1") != "0"
+
+# -------------------------------
+# Password Hashing
+# -------------------------------
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=64 * 1024 * 1024, dklen=32)
+
+
+def hash_password(password: str) -> str:
+    """scrypt$n$r$p$salt$hash, all in one column so parameters can change later."""
+    salt = secrets.token_bytes(16)
+    digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(digest)}"
+
+
+def is_hashed(stored: str) -> bool:
+    return stored.startswith("scrypt$")
+
+
+def verify_password(password: str, stored: Optional[str]) -> tuple:
+    """
+    Returns (matches, replacement) where replacement is a fresh hash to store
+    when the old one is outdated, else None. Passwords saved before hashing
+    was introduced are still plaintext; they match by constant-time comparison
+    and get replaced. stored=None (unknown user) is checked against a dummy
+    hash so the answer takes as long as for a real account.
+    """
+    if stored is None:
+        verify_password(password, dummy_hash())
+        return False, None
+    if not is_hashed(stored):
+        matches = hmac.compare_digest(password.encode(), stored.encode())
+        return matches, hash_password(password) if matches else None
+    _, n, r, p, salt, digest = stored.split("$")
+    matches = hmac.compare_digest(_scrypt(password, _unb64(salt), int(n), int(r), int(p)), _unb64(digest))
+    outdated = (int(n), int(r), int(p)) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return matches, hash_password(password) if matches and outdated else None
+
+
+@lru_cache(maxsize=1)
+def dummy_hash() -> str:
+    return hash_password(secrets.token_hex(8))
+
+
+def _lower_priority(nice: int):
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), nice)
+    except (AttributeError, OSError):
+        # No per-thread priorities here (not Linux, or not permitted): run at normal priority
+        pass
+
+
+class KdfPool:
+    """
+    Runs hash_password/verify_password on a small dedicated thread pool.
+    At most `workers` hashes run at once; at most `max_waiting` calls may wait
+    for a thread, and any more are refused with 503 instead of piling up, so a
+    login storm is capped in CPU and memory and never touches the event loop.
+    The threads run at lower OS priority, so when the CPU is contended request
+    handling goes first and logins wait.
+    """
+
+    def __init__(self, workers: int = KDF_WORKERS, max_waiting: int = KDF_MAX_WAITING, nice: int = KDF_NICE):
+        self.workers = workers
+        self.max_waiting = max_waiting
+        self.nice = nice
+        self._executor: ThreadPoolExecutor = None
+        self._pending = 0
+        self._stats = {"calls": 0, "rejected": 0, "seconds": 0.0}
+
+    def check_capacity(self):
+        """Raise 503 now if run() would; lets callers refuse before doing any other work."""
+        if self._pending >= self.workers + self.max_waiting:
+            self._stats["rejected"] += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Too many sign-ins in progress, please retry.",
+                headers={"Retry-After": "1"}
+            )
+
+    async def run(self, fn, *args):
+        self.check_capacity()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="kdf",
+                                                initializer=_lower_priority, initargs=(self.nice,))
+        self._pending += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._pending -= 1
+            self._stats["calls"] += 1
+            self._stats["seconds"] += time.perf_counter() - started
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def stats(self) -> dict:
+        calls = self._stats["calls"] or 1
+        return {
+            "workers": self.workers,
+            "pending": self._pending,
+            "calls": self._stats["calls"],
+            "rejected": self._stats["rejected"],
+            "avg_ms": round(self._stats["seconds"] * 1000 / calls, 3),
+        }
+
+
+kdf_pool = KdfPool()
+
+# -------------------------------
+# Session Tokens
+# -------------------------------
+
+class Session(NamedTuple):
+    user_id: int
+    is_admin: bool
+    issued: int
+    expires: int
+
+
+class SessionStore:
+    """
+    Stateless signed tokens: "<user_id>.<admin>.<issued>.<expires>.<nonce>.<hmac>".
+    Any process with the same SECRET_KEY can check one. Verified tokens are kept
+    in an LRU so the common case is one dict lookup. revoke_user() invalidates
+    everything issued to a user so far (e.g. when the account is removed).
+    """
+
+    def __init__(self, secret: bytes = SECRET_KEY, ttl: int = SESSION_TTL, cache_size: int = SESSION_CACHE_SIZE):
+        self.secret = secret
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._revoked_before = {}
+        self._stats = {"hits": 0, "misses": 0, "rejected": 0}
+
+    def _sign(self, payload: str) -> str:
+        return _b64(hmac.new(self.secret, payload.encode(), hashlib.sha256).digest())
+
+    def issue(self, user_id: int, is_admin: bool) -> str:
+        issued = int(time.time())
+        payload = f"{user_id}.{int(is_admin)}.{issued}.{issued + self.ttl}.{secrets.token_hex(4)}"
+        return f"{payload}.{self._sign(payload)}"
+
+    def _decode(self, token: str) -> Optional[Session]:
+        payload, _, signature = token.rpartition(".")
+        if not payload or not hmac.compare_digest(signature, self._sign(payload)):
+            return None
+        try:
+            user_id, is_admin, issued, expires, _ = payload.split(".")
+            return Session(int(user_id), is_admin == "1", int(issued), int(expires))
+        except ValueError:
+            return None
+
+    def validate(self, token: str) -> Optional[Session]:
+        session = self._cache.get(token)
+        if session is not None:
+            self._cache.move_to_end(token)
+            self._stats["hits"] += 1
+        else:
+            self._stats["misses"] += 1
+            session = self._decode(token)
+            if session is None:
+                self._stats["rejected"] += 1
+                return None
+            self._cache[token] = session
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        if session.expires <= time.time() or session.issued < self._revoked_before.get(session.user_id, 0):
+            self._cache.pop(token, None)
+            self._stats["rejected"] += 1
+            return None
+        return session
+
+    def revoke_user(self, user_id: int, before: int = None):
+        """Reject the user's tokens issued before `before` (default: now)."""
+        # Tokens carry whole seconds, so anything issued up to now is covered
+        before = int(time.time()) + 1 if before is None else before
+        self._revoked_before[user_id] = max(before, self._revoked_before.get(user_id, 0))
+        for token in [t for t, session in self._cache.items() if session.user_id == user_id]:
+            del self._cache[token]
+
+    def stats(self) -> dict:
+        return {**self._stats, "cached": len(self._cache)}
+
+
+sessions = SessionStore()
+
+# -------------------------------
+# FastAPI Dependencies
+# -------------------------------
+
+def session_from_header(header: Optional[str]) -> Optional[Session]:
+    """The session for an "Authorization: Bearer <token>" header, or None if there is no header."""
+    if not header:
+        return None
+    scheme, _, token = header.partition(" ")
+    session = sessions.validate(token.strip()) if scheme.lower() == "bearer" else None
+    if session is None:
+        raise HTTPException(status_code=401, detail="Invalid or expired session.",
+                            headers={"WWW-Authenticate": "Bearer"})
+    return session
+
+
+def check_session(session: Optional[Session]) -> Optional[Session]:
+    if session is None and REQUIRE_SESSION:
+        raise HTTPException(status_code=401, detail="Please log in.", headers={"WWW-Authenticate": "Bearer"})
+    return session
+
+
+def check_admin(session: Optional[Session]) -> Optional[Session]:
+    if session is not None and not session.is_admin:
+        raise HTTPException(status_code=403, detail="Admin access required.")
+    return session
+
+# The dependencies are async only so FastAPI runs them inline instead of
+# handing each one to its threadpool; none of them awaits anything.
+
+async def get_session(request: Request) -> Optional[Session]:
+    return session_from_header(request.headers.get("authorization"))
+
+
+async def require_session(session: Optional[Session] = Depends(get_session)) -> Optional[Session]:
+    return check_session(session)
+
+
+async def require_admin(session: Optional[Session] = Depends(require_session)) -> Optional[Session]:
+    return check_admin(session)
+
+
+def authorize_user(session: Optional[Session], user_id: int):
+    """Patrons may only act as themselves; admins may act for anyone."""
+    if session is not None and not session.is_admin and session.user_id != user_id:
+        raise HTTPException(status_code=403, detail="You can only act on your own account.")
+
+
+def cache_authorized(scope) -> bool:
+    """
+    Check for ResponseCacheMiddleware, which answers hits before routing and
+    so before any endpoint dependency runs: /admin/ responses need an admin session.
+    """
+    if not scope["path"].startswith("/admin/"):
+        return True
+    try:
+        check_admin(check_session(session_from_header(Headers(scope=scope).get("authorization"))))
+        return True
+    except HTTPException:
+        return False
+
+# -------------------------------
+# Offline Rehash
+# -------------------------------
+
+def rehash_plaintext(database: str) -> int:
+    """Hash every password still stored in plaintext. Returns the number updated."""
+    conn = sqlite3.connect(database)
+    try:
+        rows = conn.execute("SELECT UserID, Password FROM Users").fetchall()
+        updates = [(hash_password(password), user_id) for user_id, password in rows if not is_hashed(password)]
+        with conn:
+            conn.executemany("UPDATE Users SET Password = ? WHERE UserID = ?", updates)
+        return len(updates)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    # python auth.py [database]  -> hash any remaining plaintext passwords
+    from database import DATABASE
+    print(f"Hashed {rehash_plaintext(sys.argv[1] if len(sys.argv) > 1 else DATABASE)} passwords")
@@ -0,0 +1,103 @@
+"""
+Thousands of concurrent borrow attempts against one book.
+
+    python benchmarks/concurrent_borrow.py [--attempts 2000] [--processes 4]
+
+Runs against a scratch copy of Library.db. Each process starts its own
+copy of the app (own connection pool) and fires its share of /borrow/
+requests for the same book at once, so the processes really contend for
+the SQLite write lock. Afterwards exactly one active loan must exist.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Every simulated client shares one address; rate limiting would measure only itself
+os.environ.setdefault("LIBRARY_RATE_LIMIT", "0")
+sys.path.insert(0, ROOT)
+
+
+async def _attempts(database: str, user_ids: list, book_id: int, start_at: float):
+    import httpx
+    import database as db_module
+    import reservations
+    from auth import sessions
+
+    db_module.pool.database = database
+    await reservations.startup()
+    # Measured at steady state, with the recommender and snapshot built
+    await reservations.lifecycle.wait_background()
+    await asyncio.sleep(max(0.0, start_at - time.time()))
+    try:
+        transport = httpx.ASGITransport(app=reservations.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def borrow(user_id):
+                token = sessions.issue(user_id, is_admin=False)
+                response = await client.post("/borrow/", json={"user_id": user_id, "book_id": book_id},
+                                             headers={"Authorization": f"Bearer {token}"})
+                return response.status_code
+            started = time.perf_counter()
+            statuses = Counter(await asyncio.gather(*(borrow(user_id) for user_id in user_ids)))
+            return statuses, time.perf_counter() - started
+    finally:
+        await reservations.shutdown()
+
+
+def _worker(database: str, user_ids: list, book_id: int, start_at: float):
+    return asyncio.run(_attempts(database, user_ids, book_id, start_at))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--attempts", type=int, default=2000)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--database", default=os.path.join(ROOT, "Library.db"))
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    database = os.path.join(workdir, "Library.db")
+    shutil.copy(args.database, database)
+    conn = sqlite3.connect(database)
+    book_id = conn.execute("""
+        SELECT BookID FROM Books
+        WHERE BookID NOT IN (SELECT BookID FROM BorrowingHistory WHERE ReturnDate IS NULL)
+        LIMIT 1
+    """).fetchone()[0]
+    conn.close()
+
+    # Distinct users so only the one-active-loan rule can stop them
+    user_ids = list(range(100_000, 100_000 + args.attempts))
+    shares = [user_ids[i::args.processes] for i in range(args.processes)]
+    # Give every process time to start its app, then fire at the same moment
+    start_at = time.time() + 3.0
+    with multiprocessing.Pool(args.processes) as workers:
+        results = workers.starmap(_worker, [(database, share, book_id, start_at) for share in shares])
+
+    statuses = sum((result[0] for result in results), Counter())
+    elapsed = max(result[1] for result in results)
+    conn = sqlite3.connect(database)
+    active = conn.execute(
+        "SELECT COUNT(*) FROM BorrowingHistory WHERE BookID = ? AND ReturnDate IS NULL", (book_id,)
+    ).fetchone()[0]
+    conn.close()
+    shutil.rmtree(workdir)
+
+    print(f"attempts:        {args.attempts} across {args.processes} processes")
+    print(f"status codes:    {dict(sorted(statuses.items()))}")
+    print(f"active loans:    {active} (expected 1)")
+    print(f"throughput:      {args.attempts / max(elapsed, 1e-9):.0f} attempts/s")
+    ok = active == 1 and statuses.get(200, 0) == 1 and set(statuses) <= {200, 409}
+    print("RESULT:", "OK" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Cost of idle /events streams on one worker.
+
+    python benchmarks/event_streams.py [--database benchmarks/library_synthetic.db]
+                                       [--streams 0 1000 5000] [--events 20] [--requests 200]
+
+For each stream count, starts serve.py with one worker on a scratch copy of
+the database and opens that many /events streams over raw sockets that just
+sit there. It then reports the worker's resident memory per open stream,
+the time from committing a change (a book inserted with the sqlite3 module,
+as another process would) until every stream has received its event, and
+GET /books/ latency with all the streams open.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate_data import generate
+from workers import free_port, DEFAULT_DATABASE
+
+
+def rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+async def open_stream(port: int):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /events HTTP/1.1\r\nHost: bench\r\nAccept: text/event-stream\r\n\r\n")
+    await writer.drain()
+    await reader.readuntil(b"retry: ")
+    return reader, writer
+
+
+async def wait_for_event(reader, marker: bytes) -> float:
+    await reader.readuntil(marker)
+    return time.perf_counter()
+
+
+async def get_latency(port: int, requests: int) -> list:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    timings = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        writer.write(b"GET /books/?limit=50 HTTP/1.1\r\nHost: bench\r\n\r\n")
+        await writer.drain()
+        head = await reader.readuntil(b"\r\n\r\n")
+        length = int(next(line.split(b":")[1] for line in head.split(b"\r\n")
+                          if line.lower().startswith(b"content-length")))
+        await reader.readexactly(length)
+        timings.append(time.perf_counter() - started)
+    writer.close()
+    return timings
+
+
+async def measure(database: str, port: int, pid: int, streams: int, events: int, requests: int) -> dict:
+    baseline = rss_mb(pid)
+    connections = []
+    for start in range(0, streams, 500):
+        connections += await asyncio.gather(*(open_stream(port) for _ in range(start, min(streams, start + 500))))
+    # Let the worker settle before reading its memory
+    await asyncio.sleep(1.0)
+    opened = rss_mb(pid)
+
+    fanout = []
+    conn = sqlite3.connect(database)
+    for n in range(events if streams else 0):
+        marker = f'"book_name":"bench event {n}"'.encode()
+        waiters = [asyncio.create_task(wait_for_event(reader, marker)) for reader, _ in connections]
+        started = time.perf_counter()
+        conn.execute("INSERT INTO Books (BookName, Author, Genre, Year) VALUES (?, 'Bench', 'Bench', 2000)",
+                     (f"bench event {n}",))
+        conn.commit()
+        arrivals = await asyncio.gather(*waiters)
+        fanout.append(max(arrivals) - started)
+    conn.close()
+
+    latency = np.array(await get_latency(port, requests)) * 1000
+    for _, writer in connections:
+        writer.close()
+    return {
+        "rss_mb": round(opened, 1),
+        "kb_per_stream": round((opened - baseline) * 1024 / streams, 1) if streams else 0.0,
+        "fanout_p50_ms": round(float(np.percentile(fanout, 50)) * 1000, 1) if fanout else None,
+        "fanout_max_ms": round(max(fanout) * 1000, 1) if fanout else None,
+        "books_p50_ms": round(float(np.percentile(latency, 50)), 2),
+        "books_p95_ms": round(float(np.percentile(latency, 95)), 2),
+    }
+
+
+def run(database: str, streams: int, events: int, requests: int) -> dict:
+    port = free_port()
+    env = {**os.environ, "LIBRARY_DATABASE": database, "LIBRARY_PORT": str(port), "LIBRARY_WORKERS": "1",
+           "LIBRARY_LOG_LEVEL": "warning", "LIBRARY_RATE_LIMIT": "0",
+           "LIBRARY_EVENT_MAX_CLIENTS": str(max(streams, 1) + 10)}
+    server = subprocess.Popen([sys.executable, "serve.py"], cwd=ROOT, env=env)
+    try:
+        import httpx
+        for _ in range(300):
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/books/?limit=1").status_code == 200:
+                    break
+            except httpx.TransportError:
+                time.sleep(0.1)
+        else:
+            raise SystemExit("serve.py did not come up")
+        # One worker runs in the serve.py process itself
+        return asyncio.run(measure(database, port, server.pid, streams, events, requests))
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=DEFAULT_DATABASE)
+    parser.add_argument("--streams", type=int, nargs="+", default=[0, 1000, 5000])
+    parser.add_argument("--events", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"{args.database} not found, generating 10^4 books")
+        generate(args.database, books=10_000, users=5_000, loans=30_000, ratings=10_000)
+
+    print(f"{'streams':>7} {'RSS MB':>8} {'KB/stream':>10} {'fan-out p50':>12} {'max ms':>8} "
+          f"{'books p50':>10} {'p95 ms':>8}")
+    for streams in args.streams:
+        workdir = tempfile.mkdtemp()
+        database = os.path.join(workdir, "Library.db")
+        shutil.copy(args.database, database)
+        try:
+            result = run(database, streams, args.events, args.requests)
+        finally:
+            shutil.rmtree(workdir)
+        print(f"{streams:>7} {result['rss_mb']:>8} {result['kb_per_stream']:>10} "
+              f"{result['fanout_p50_ms'] or '-':>12} {result['fanout_max_ms'] or '-':>8} "
+              f"{result['books_p50_ms']:>10} {result['books_p95_ms']:>8}")
+
+
+if __name__ == "__main__":
+    main()
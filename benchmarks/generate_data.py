@@ -0,0 +1,210 @@
+"""
+Build a synthetic library database with the current schema.
+
+    python benchmarks/generate_data.py --books 1000000 [--users N] [--loans N] [--ratings N]
+                                       [--out big.db] [--seed 0]
+
+The tables are copied from Library.db (so the schema always matches the app)
+and migrations are applied afterwards, exactly as startup would. Defaults
+scale from --books: users = books / 2, loans = books * 3, ratings = books.
+
+Popularity is skewed the way a real catalogue is: loans and ratings pick
+books from a Zipf distribution, a minority of users do most of the
+borrowing, and authors write very different numbers of books. Almost every
+loan is returned; about 5% of books have one active loan, roughly half of
+them overdue. Rows are generated and inserted in chunks, so 10^7 rows
+need no more memory than 10^5.
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CHUNK = 200_000
+GENRES = ["Mystery", "Fantasy", "Science Fiction", "Romance", "Adventure",
+          "Historical Fiction", "Thriller", "Horror", "Drama", "Fiction"]
+# Relative share of each genre in the catalogue
+GENRE_WEIGHTS = [14, 13, 12, 16, 8, 7, 11, 5, 9, 5]
+WORDS = ("shadow sky tomorrow river garden winter crown silent night echo storm glass "
+         "house iron last secret forgotten empire star ocean fire paper road moon "
+         "city stone heart wolf kingdom letter island light dark golden broken "
+         "hidden lost machine song summer thief tower voyage war wind").split()
+FIRST_NAMES = ("Eleanor Marcus Lena Oliver Amara Theo Ines Jonah Priya Felix Nadia "
+               "Hugo Clara Rafael Mei Tobias Zara Elias Ruth Kofi").split()
+LAST_NAMES = ("Bright Halloway Winters Grant Okafor Lindqvist Moreau Castillo Reyes "
+              "Nakamura Novak Byrne Haddad Sorensen Alvarez Whitfield Kaur Dubois").split()
+HISTORY_DAYS = 3 * 365
+LOAN_DAYS = 14
+
+
+_permutations = {}
+
+def zipf_ids(rng, n: int, size: int, s: float = 1.0) -> np.ndarray:
+    """
+    1-based IDs in [1, n] where the k-th most popular ID is drawn with weight ~ 1/k^s
+    (bounded Zipf, sampled by inverting the continuous CDF), shuffled so popular IDs
+    are spread over the table.
+    """
+    if n not in _permutations:
+        _permutations[n] = np.random.default_rng(n).permutation(n)
+    u = rng.random(size)
+    if s == 1.0:
+        ranks = np.exp(u * np.log(n + 1))
+    else:
+        ranks = (u * ((n + 1) ** (1 - s) - 1) + 1) ** (1 / (1 - s))
+    ranks = np.minimum(ranks.astype(np.int64) - 1, n - 1)
+    return _permutations[n][ranks] + 1
+
+
+def copy_schema(source: str, conn: sqlite3.Connection):
+    src = sqlite3.connect(source)
+    tables = src.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' "
+        "AND name NOT LIKE 'BooksSearch%'"
+    ).fetchall()
+    src.close()
+    for (sql,) in tables:
+        conn.execute(sql)
+
+
+def chunks(total: int):
+    for start in range(0, total, CHUNK):
+        yield start, min(CHUNK, total - start)
+
+
+def generate_books(conn, rng, books: int):
+    authors = max(books // 8, 1)
+    for start, size in chunks(books):
+        words = rng.integers(0, len(WORDS), (size, 3))
+        lengths = rng.integers(1, 4, size)
+        author_ids = zipf_ids(rng, authors, size, s=0.8)
+        genres = rng.choice(len(GENRES), size, p=np.array(GENRE_WEIGHTS) / sum(GENRE_WEIGHTS))
+        years = np.clip(rng.normal(2005, 15, size).astype(int), 1850, 2025)
+        rows = []
+        for i in range(size):
+            title = " ".join(WORDS[w] for w in words[i, :lengths[i]]).title()
+            author = int(author_ids[i])
+            rows.append((
+                f"{title} {start + i + 1}",
+                f"{FIRST_NAMES[author % len(FIRST_NAMES)]} {LAST_NAMES[author % len(LAST_NAMES)]} {author}",
+                GENRES[genres[i]],
+                int(years[i]),
+            ))
+        conn.executemany("INSERT INTO Books (BookName, Author, Genre, Year) VALUES (?, ?, ?, ?)", rows)
+
+
+def generate_users(conn, users: int):
+    for start, size in chunks(users):
+        conn.executemany("INSERT INTO Users (UserName, Password) VALUES (?, ?)",
+                         ((f"user{start + i + 1}", "password") for i in range(size)))
+
+
+def iso_dates(start: date, days: np.ndarray) -> list:
+    return (np.datetime64(start, "D") + days).astype(str).tolist()
+
+
+def generate_loans(conn, rng, loans: int, books: int, users: int):
+    today = date.today()
+    epoch = today - timedelta(days=HISTORY_DAYS)
+    # About 5% of books are out right now: one active loan each, spread over the last 4 weeks
+    active_books = rng.choice(books, min(books // 20, loans), replace=False) + 1
+    returned = loans - len(active_books)
+
+    for start, size in chunks(returned):
+        book_ids = zipf_ids(rng, books, size)
+        user_ids = zipf_ids(rng, users, size, s=0.8)
+        borrowed = rng.integers(0, HISTORY_DAYS - 30, size)
+        kept = np.clip(rng.exponential(10, size).astype(int), 1, 60)
+        conn.executemany(
+            "INSERT INTO BorrowingHistory (UserID, BookID, BorrowDate, DueDate, ReturnDate) VALUES (?, ?, ?, ?, ?)",
+            zip(user_ids.tolist(), book_ids.tolist(), iso_dates(epoch, borrowed),
+                iso_dates(epoch, borrowed + LOAN_DAYS), iso_dates(epoch, borrowed + kept))
+        )
+
+    user_ids = zipf_ids(rng, users, len(active_books), s=0.8)
+    borrowed = rng.integers(0, 28, len(active_books))
+    conn.executemany(
+        "INSERT INTO BorrowingHistory (UserID, BookID, BorrowDate, DueDate, ReturnDate) VALUES (?, ?, ?, ?, NULL)",
+        zip(user_ids.tolist(), active_books.tolist(), iso_dates(today, -borrowed),
+            iso_dates(today, LOAN_DAYS - borrowed))
+    )
+
+
+def generate_ratings(conn, rng, ratings: int, books: int, users: int):
+    # One rating per (user, book), as POST /reviews/add/ enforces; the index
+    # lets SQLite drop repeats instead of keeping every pair in memory here
+    conn.execute("CREATE UNIQUE INDEX tmp_ratings_unique ON Ratings (UserID, BookID)")
+    for start, size in chunks(ratings):
+        book_ids = zipf_ids(rng, books, size)
+        user_ids = zipf_ids(rng, users, size, s=0.8)
+        scores = np.clip(np.round(rng.normal(3.6, 1.0, size) * 2) / 2, 0.5, 5.0)
+        conn.executemany("INSERT OR IGNORE INTO Ratings (UserID, BookID, Rating) VALUES (?, ?, ?)",
+                         zip(user_ids.tolist(), book_ids.tolist(), scores.tolist()))
+    conn.execute("DROP INDEX tmp_ratings_unique")
+
+
+def generate(out: str, books: int, users: int, loans: int, ratings: int, seed: int = 0,
+             source: str = os.path.join(ROOT, "Library.db")):
+    import aiosqlite
+    from migrations import apply_migrations
+
+    if os.path.exists(out):
+        os.remove(out)
+    rng = np.random.default_rng(seed)
+    conn = sqlite3.connect(out, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("BEGIN")
+    copy_schema(source, conn)
+    for name, step in [
+        ("books", lambda: generate_books(conn, rng, books)),
+        ("users", lambda: generate_users(conn, users)),
+        ("loans", lambda: generate_loans(conn, rng, loans, books, users)),
+        ("ratings", lambda: generate_ratings(conn, rng, ratings, books, users)),
+    ]:
+        started = time.perf_counter()
+        step()
+        print(f"  {name:<10} {time.perf_counter() - started:7.1f}s")
+    conn.execute("COMMIT")
+    conn.close()
+
+    async def migrate():
+        async with aiosqlite.connect(out) as db:
+            await db.execute("PRAGMA journal_mode = WAL")
+            await apply_migrations(db)
+
+    started = time.perf_counter()
+    asyncio.run(migrate())
+    print(f"  {'migrations':<10} {time.perf_counter() - started:7.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=10_000)
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--loans", type=int)
+    parser.add_argument("--ratings", type=int)
+    parser.add_argument("--out", default=os.path.join(ROOT, "benchmarks", "library_synthetic.db"))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    users = args.users or max(args.books // 2, 1)
+    loans = args.loans if args.loans is not None else args.books * 3
+    ratings = args.ratings if args.ratings is not None else args.books
+    print(f"{args.out}: {args.books} books, {users} users, {loans} loans, {ratings} ratings")
+    started = time.perf_counter()
+    generate(args.out, args.books, users, loans, ratings, args.seed)
+    size_mb = os.path.getsize(args.out) / 2**20
+    print(f"done in {time.perf_counter() - started:.1f}s, {size_mb:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Write throughput of the group-commit queue against commit-per-request.
+
+    python benchmarks/group_commit.py [--requests 5000] [--batch-sizes 1 8 64 256]
+
+Runs against a scratch copy of Library.db with extra users and inserts one
+review per user, issuing the same statements as POST /reviews/add/. It
+compares the old path (each request runs its own transaction on the pooled
+aiosqlite writer and commits) with the write queue at several batch sizes.
+The HTTP layer is left out so only the write path is measured.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import database as db_module
+from database import pool, run_transaction
+from writequeue import write_queue
+
+
+def scratch_database(source: str, users: int) -> str:
+    workdir = tempfile.mkdtemp()
+    database = os.path.join(workdir, "Library.db")
+    shutil.copy(source, database)
+    conn = sqlite3.connect(database)
+    conn.executemany("INSERT INTO Users (UserName, Password) VALUES (?, ?)",
+                     ((f"bench_user_{i}", "pw") for i in range(users)))
+    conn.commit()
+    conn.close()
+    return database
+
+
+def review_statements(user_id: int, book_id: int):
+    return [
+        ("SELECT UserID FROM Users WHERE UserID = ?", (user_id,)),
+        ("SELECT BookID FROM Books WHERE BookID = ?", (book_id,)),
+        ("SELECT RatingID FROM Ratings WHERE UserID = ? AND BookID = ?", (user_id, book_id)),
+        ("INSERT INTO Ratings (UserID, BookID, Rating) VALUES (?, ?, ?)", (user_id, book_id, 4)),
+    ]
+
+
+async def commit_per_request(user_ids, book_id):
+    async def one(user_id):
+        async def work(db):
+            for sql, params in review_statements(user_id, book_id):
+                cursor = await db.execute(sql, params)
+                await cursor.fetchall()
+        async with pool.writer() as db:
+            await run_transaction(db, work)
+    await asyncio.gather(*(one(user_id) for user_id in user_ids))
+
+
+async def queued(user_ids, book_id):
+    async def one(user_id):
+        def work(db):
+            for sql, params in review_statements(user_id, book_id):
+                db.execute(sql, params).fetchall()
+        await write_queue.submit(work)
+    await asyncio.gather(*(one(user_id) for user_id in user_ids))
+
+
+async def run(database: str, requests: int, batch_size: int, delay_ms: float, synchronous: str) -> dict:
+    pool.database = database
+    db_module.CONNECTION_PRAGMAS[:] = [
+        f"PRAGMA synchronous = {synchronous}" if "synchronous" in pragma else pragma
+        for pragma in db_module.CONNECTION_PRAGMAS
+    ]
+    write_queue.batch_size = batch_size or 1
+    write_queue.batch_delay_ms = delay_ms
+    write_queue._stats = {key: type(value)() for key, value in write_queue._stats.items()}
+    await pool.open()
+    await write_queue.start()
+    try:
+        async with pool.reader() as db:
+            cursor = await db.execute("SELECT UserID FROM Users WHERE UserName LIKE 'bench_user_%'")
+            user_ids = [row[0] for row in await cursor.fetchall()][:requests]
+            cursor = await db.execute("SELECT MIN(BookID) FROM Books")
+            book_id = (await cursor.fetchone())[0]
+
+        started = time.perf_counter()
+        if batch_size == 0:
+            await commit_per_request(user_ids, book_id)
+        else:
+            await queued(user_ids, book_id)
+        elapsed = time.perf_counter() - started
+        stats = write_queue.stats()
+    finally:
+        await write_queue.stop()
+        await pool.close()
+
+    return {
+        "mode": "per-request" if batch_size == 0 else f"queue x{batch_size}",
+        "writes_per_s": round(len(user_ids) / elapsed),
+        "avg_batch": stats["avg_batch"] if batch_size else 1.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 64, 256])
+    parser.add_argument("--delay-ms", type=float, default=2.0)
+    parser.add_argument("--synchronous", default="NORMAL", choices=["OFF", "NORMAL", "FULL"])
+    parser.add_argument("--database", default=os.path.join(ROOT, "Library.db"))
+    args = parser.parse_args()
+
+    print(f"synchronous={args.synchronous}, {args.requests} writes")
+    print(f"{'mode':>14} {'writes/s':>9} {'avg batch':>10}")
+    # Batch size 0 = the old commit-per-request path
+    for batch_size in [0] + args.batch_sizes:
+        database = scratch_database(args.database, args.requests)
+        result = asyncio.run(run(database, args.requests, batch_size, args.delay_ms, args.synchronous))
+        shutil.rmtree(os.path.dirname(database))
+        print(f"{result['mode']:>14} {result['writes_per_s']:>9} {result['avg_batch']:>10}")
+
+
+if __name__ == "__main__":
+    main()
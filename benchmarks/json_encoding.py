@@ -0,0 +1,126 @@
+"""
+Cost of encoding list responses, before and after the orjson path.
+
+    python benchmarks/json_encoding.py [--database benchmarks/library_synthetic.db]
+                                       [--sizes 100 1000 10000] [--repeat 20]
+
+Loads books with include=availability,ratings through the app, on a
+scratch copy of the database, and for each list size times:
+- generic: what FastAPI does with a returned list of dicts
+  (jsonable_encoder, then json.dumps in JSONResponse), the old path
+- orjson:  pagination.json_list, rows as objects
+- columns: pagination.json_list with format=columns
+It reports the payload size and the time a client takes to parse it with
+json.loads. The last part times GET /books/ end to end through the app, in
+both formats.
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Every simulated client shares one address; rate limiting would measure only itself
+os.environ.setdefault("LIBRARY_RATE_LIMIT", "0")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate_data import generate
+from workers import DEFAULT_DATABASE
+
+# Ahead of benchmarks/, whose recommendations.py would shadow the app's
+sys.path.insert(0, ROOT)
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+import database as db_module
+import reservations
+from cache import response_cache
+from pagination import json_list, MAX_PAGE_SIZE
+
+
+def fake_request(query: str = "") -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": [], "query_string": query.encode()})
+
+
+def timed(fn, repeat: int) -> float:
+    """Median milliseconds per call."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return float(np.median(timings)) * 1000
+
+
+def encoders(items: list) -> dict:
+    rows, cols = fake_request(), fake_request("format=columns")
+    return {
+        "generic": lambda: JSONResponse(jsonable_encoder({"items": items, "next_after": None})).body,
+        "orjson": lambda: json_list(rows, items, next_after=None).body,
+        "columns": lambda: json_list(cols, items, next_after=None).body,
+    }
+
+
+def endpoint(client: TestClient, size: int, repeat: int) -> dict:
+    """Median ms for one page of `size` books through the app, as rows and as columns."""
+    results = {}
+    for name, extra in (("rows", ""), ("columns", "&format=columns")):
+        url = f"/books/?include=availability,ratings&limit={size}{extra}"
+
+        def get():
+            # Measure the endpoint, not the response cache
+            response_cache.invalidate("books")
+            assert client.get(url).status_code == 200
+
+        results[name] = timed(get, repeat)
+    return results
+
+
+def run(client: TestClient, sizes: list, repeat: int):
+    catalog = client.get("/books/?include=availability,ratings").json()
+    print(f"{'rows':>6} {'format':>8} {'encode ms':>10} {'KB':>9} {'parse ms':>9}")
+    for size in sizes:
+        items = catalog[:size]
+        for name, encode in encoders(items).items():
+            body = encode()
+            print(f"{len(items):>6} {name:>8} {timed(encode, repeat):>10.2f} {len(body) / 1024:>9.1f} "
+                  f"{timed(lambda: json.loads(body), repeat):>9.2f}")
+
+    page = min(sizes[-1], MAX_PAGE_SIZE)
+    print(f"\nGET /books/?include=availability,ratings&limit={page}")
+    for name, ms in endpoint(client, page, repeat).items():
+        print(f"{name:>8} {ms:>8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=DEFAULT_DATABASE)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"{args.database} not found, generating 10^4 books")
+        generate(args.database, books=10_000, users=5_000, loans=30_000, ratings=10_000)
+
+    workdir = tempfile.mkdtemp()
+    try:
+        # Startup migrates the database, so work on a copy
+        db_module.pool.database = os.path.join(workdir, "Library.db")
+        shutil.copy(args.database, db_module.pool.database)
+        with TestClient(reservations.app) as client:
+            run(client, args.sizes, args.repeat)
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
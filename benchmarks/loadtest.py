@@ -0,0 +1,289 @@
+"""
+Mixed-workload load test of the whole app, in process.
+
+    python benchmarks/loadtest.py [--database benchmarks/library_synthetic.db]
+                                  [--duration 20] [--concurrency 32]
+                                  [--mix browse=30,search=20,borrow=15,return=10,renew=5,review=10,recommend=10]
+                                  [--save benchmarks/baselines/NAME.json] [--compare OLD.json]
+
+Drives reservations.app through httpx's ASGI transport (no sockets, no
+uvicorn) from --concurrency client tasks for --duration seconds. Each task
+repeatedly picks an operation from the weighted mix:
+
+    browse     GET  /books/?limit=50&after=<random id>
+    search     GET  /api/books/?q=<word>&limit=20
+    borrow     POST /borrow/        (Zipf-popular books, so many are already out)
+    return     POST /return/        (a loan made earlier in the run)
+    renew      POST /renew/         (a loan made earlier in the run)
+    review     POST /reviews/add/
+    recommend  GET  /recommendations/<user>?limit=10
+
+Runs against a scratch copy of the database (generated with
+benchmarks/generate_data.py at 10^4 books if it does not exist yet).
+Prints throughput and p50/p95/p99 latency per operation. --save writes the
+results as JSON together with the git commit and database size; --compare
+prints the change against an earlier file and exits 1 if any p95 or
+throughput moved the wrong way by more than --tolerance percent.
+
+The clients share the server's event loop, so absolute latencies include
+client overhead; compare runs on the same machine and settings only.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Every simulated client shares one address; rate limiting would measure only itself
+os.environ.setdefault("LIBRARY_RATE_LIMIT", "0")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate_data import generate, zipf_ids, WORDS
+
+DEFAULT_DATABASE = os.path.join(ROOT, "benchmarks", "library_synthetic.db")
+DEFAULT_MIX = "browse=30,search=20,borrow=15,return=10,renew=5,review=10,recommend=10"
+# Refusals that are a normal answer for the operation, not a failure
+EXPECTED_STATUS = {
+    "browse": {200},
+    "search": {200},
+    "borrow": {200, 400, 409},
+    "return": {200, 400},
+    "renew": {200, 400},
+    "review": {200, 400},
+    "recommend": {200},
+}
+
+
+class Workload:
+    """Picks request targets from the database's ID ranges with the generator's skew."""
+
+    def __init__(self, database: str, seed: int = 0):
+        conn = sqlite3.connect(database)
+        self.books = conn.execute("SELECT MAX(BookID) FROM Books").fetchone()[0]
+        self.users = conn.execute("SELECT MAX(UserID) FROM Users").fetchone()[0]
+        self.counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                       for table in ("Books", "Users", "BorrowingHistory", "Ratings")}
+        conn.close()
+        self.rng = np.random.default_rng(seed)
+        self.random = random.Random(seed)
+        self._book_ids = []
+        self._user_ids = []
+        # Loans made during the run, available to return/renew
+        self.loans = []
+        self._tokens = {}
+
+    def book(self) -> int:
+        if not self._book_ids:
+            self._book_ids = zipf_ids(self.rng, self.books, 4096).tolist()
+        return self._book_ids.pop()
+
+    def user(self) -> int:
+        if not self._user_ids:
+            self._user_ids = zipf_ids(self.rng, self.users, 4096, s=0.8).tolist()
+        return self._user_ids.pop()
+
+    def request(self, operation: str):
+        """Return (operation, method, url, json body, acting user or None) for one operation."""
+        if operation in ("return", "renew") and not self.loans:
+            operation = "borrow"
+        if operation == "browse":
+            return operation, "GET", f"/books/?limit=50&after={self.random.randrange(self.books)}", None, None
+        if operation == "search":
+            return operation, "GET", f"/api/books/?q={self.random.choice(WORDS)}&limit=20", None, None
+        if operation == "borrow":
+            user = self.user()
+            return operation, "POST", "/borrow/", {"user_id": user, "book_id": self.book()}, user
+        if operation == "return":
+            loan = self.loans.pop(self.random.randrange(len(self.loans)))
+            return operation, "POST", "/return/", loan, loan["user_id"]
+        if operation == "renew":
+            loan = self.random.choice(self.loans)
+            return operation, "POST", "/renew/", loan, loan["user_id"]
+        if operation == "review":
+            user = self.user()
+            rating = self.random.choice([1, 2, 3, 3.5, 4, 4, 4.5, 5])
+            return operation, "POST", "/reviews/add/", {"user_id": user, "book_id": self.book(), "rating": rating}, user
+        user = self.user()
+        return operation, "GET", f"/recommendations/{user}?limit=10", None, user
+
+    def headers(self, user) -> dict:
+        """Authorization for the acting user; tokens are minted in process, as login would."""
+        if user is None:
+            return {}
+        if user not in self._tokens:
+            from auth import sessions
+            self._tokens[user] = {"Authorization": f"Bearer {sessions.issue(user, is_admin=False)}"}
+        return self._tokens[user]
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, weight = part.split("=")
+        if name not in EXPECTED_STATUS:
+            raise SystemExit(f"unknown operation {name!r}; choose from {', '.join(EXPECTED_STATUS)}")
+        mix[name] = float(weight)
+    return mix
+
+
+async def run(database: str, duration: float, concurrency: int, mix: dict, seed: int) -> dict:
+    import httpx
+    import database as db_module
+    import reservations
+
+    workload = Workload(database, seed)
+    db_module.pool.database = database
+    await reservations.startup()
+    # Measured at steady state, with the recommender and snapshot built
+    await reservations.lifecycle.wait_background()
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+    operations, weights = list(mix), list(mix.values())
+    try:
+        transport = httpx.ASGITransport(app=reservations.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=None) as client:
+            deadline = time.perf_counter() + duration
+
+            async def client_task():
+                while time.perf_counter() < deadline:
+                    operation = workload.random.choices(operations, weights)[0]
+                    operation, method, url, body, user = workload.request(operation)
+                    started = time.perf_counter()
+                    response = await client.request(method, url, json=body, headers=workload.headers(user))
+                    await response.aread()
+                    latencies[operation].append(time.perf_counter() - started)
+                    statuses[operation][response.status_code] += 1
+                    if operation == "borrow" and response.status_code == 200:
+                        workload.loans.append(body)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(client_task() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - started
+    finally:
+        await reservations.shutdown()
+
+    endpoints = {}
+    for operation in operations:
+        timings = np.array(latencies[operation]) * 1000
+        if not len(timings):
+            continue
+        unexpected = sum(count for status, count in statuses[operation].items()
+                         if status not in EXPECTED_STATUS[operation])
+        endpoints[operation] = {
+            "requests": len(timings),
+            "rps": round(len(timings) / elapsed, 1),
+            "p50_ms": round(float(np.percentile(timings, 50)), 2),
+            "p95_ms": round(float(np.percentile(timings, 95)), 2),
+            "p99_ms": round(float(np.percentile(timings, 99)), 2),
+            "max_ms": round(float(timings.max()), 2),
+            "errors": unexpected,
+            "statuses": {str(status): count for status, count in sorted(statuses[operation].items())},
+        }
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "rows": workload.counts,
+            "duration_s": duration,
+            "concurrency": concurrency,
+            "mix": mix,
+        },
+        "total_rps": round(sum(len(values) for values in latencies.values()) / elapsed, 1),
+        "endpoints": endpoints,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_report(result: dict):
+    rows = result["meta"]["rows"]
+    print(f"commit {result['meta']['commit']}, {rows['Books']} books, {rows['BorrowingHistory']} loans, "
+          f"concurrency {result['meta']['concurrency']}, {result['meta']['duration_s']}s")
+    print(f"{'operation':<10} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'errors':>7}  statuses")
+    for operation, stats in result["endpoints"].items():
+        print(f"{operation:<10} {stats['requests']:>9} {stats['rps']:>8} {stats['p50_ms']:>8} {stats['p95_ms']:>8} "
+              f"{stats['p99_ms']:>8} {stats['max_ms']:>8} {stats['errors']:>7}  {stats['statuses']}")
+    print(f"total: {result['total_rps']} req/s")
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> bool:
+    """Print the change per operation; return False if anything regressed beyond tolerance."""
+    def change(new, old):
+        return (new - old) / old * 100 if old else 0.0
+
+    ok = True
+    print(f"\nvs {baseline['meta']['commit']} ({baseline['meta']['timestamp']}):")
+    print(f"{'operation':<10} {'req/s':>16} {'p50 ms':>16} {'p95 ms':>16} {'p99 ms':>16}")
+    for operation, stats in result["endpoints"].items():
+        old = baseline["endpoints"].get(operation)
+        if old is None:
+            continue
+        cells = []
+        for key in ("rps", "p50_ms", "p95_ms", "p99_ms"):
+            delta = change(stats[key], old[key])
+            cells.append(f"{stats[key]:>8} {delta:+6.1f}%")
+        regressed = change(stats["rps"], old["rps"]) < -tolerance or change(stats["p95_ms"], old["p95_ms"]) > tolerance
+        ok = ok and not regressed
+        print(f"{operation:<10} {' '.join(cells)}{'  REGRESSED' if regressed else ''}")
+    delta = change(result["total_rps"], baseline["total_rps"])
+    print(f"total: {result['total_rps']} req/s ({delta:+.1f}%)")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=DEFAULT_DATABASE)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file from an earlier --save")
+    parser.add_argument("--tolerance", type=float, default=10.0, help="allowed regression, percent")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"{args.database} not found, generating 10^4 books")
+        generate(args.database, books=10_000, users=5_000, loans=30_000, ratings=10_000)
+
+    workdir = tempfile.mkdtemp()
+    database = os.path.join(workdir, "Library.db")
+    shutil.copy(args.database, database)
+    try:
+        result = asyncio.run(run(database, args.duration, args.concurrency, parse_mix(args.mix), args.seed))
+    finally:
+        shutil.rmtree(workdir)
+
+    print_report(result)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"saved {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(result, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
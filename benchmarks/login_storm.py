@@ -0,0 +1,130 @@
+"""
+Browse/borrow latency with and without a concurrent login storm.
+
+    python benchmarks/login_storm.py [--database benchmarks/library_synthetic.db]
+                                     [--duration 10] [--concurrency 16] [--logins 64]
+
+Runs the browse and borrow operations of benchmarks/loadtest.py from
+--concurrency client tasks twice: once alone, then while --logins more tasks
+log in as fast as they can (backing off for Retry-After when refused). Every
+login runs scrypt on the KDF pool, so the second run shows what a storm costs
+everyone else. Prints p50/p95/p99 for
+both runs, login throughput and how many logins the pool refused with 503.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# loadtest first: importing generate_data through it leaves the app's modules
+# ahead of same-named benchmark scripts (recommendations.py) on sys.path
+from loadtest import Workload, DEFAULT_DATABASE
+from generate_data import generate
+
+# Accounts the storm logs in as; the first login of each also upgrades its plaintext password
+STORM_USERS = 50
+
+
+async def phase(client, workload: Workload, duration: float, concurrency: int, logins: int) -> dict:
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+    deadline = time.perf_counter() + duration
+
+    async def traffic():
+        while time.perf_counter() < deadline:
+            operation = workload.random.choice(["browse", "browse", "borrow"])
+            operation, method, url, body, user = workload.request(operation)
+            started = time.perf_counter()
+            response = await client.request(method, url, json=body, headers=workload.headers(user))
+            await response.aread()
+            latencies[operation].append(time.perf_counter() - started)
+            statuses[operation][response.status_code] += 1
+
+    async def storm():
+        while time.perf_counter() < deadline:
+            user = workload.random.randint(1, STORM_USERS)
+            started = time.perf_counter()
+            response = await client.post("/login/", json={"username": f"user{user}", "password": "password"})
+            latencies["login"].append(time.perf_counter() - started)
+            statuses["login"][response.status_code] += 1
+            if response.status_code == 503:
+                await asyncio.sleep(float(response.headers.get("retry-after", 1)))
+
+    await asyncio.gather(*(traffic() for _ in range(concurrency)), *(storm() for _ in range(logins)))
+
+    result = {}
+    for operation, values in latencies.items():
+        timings = np.array(values) * 1000
+        result[operation] = {
+            "requests": len(timings),
+            "rps": round(len(timings) / duration, 1),
+            "p50_ms": round(float(np.percentile(timings, 50)), 2),
+            "p95_ms": round(float(np.percentile(timings, 95)), 2),
+            "p99_ms": round(float(np.percentile(timings, 99)), 2),
+            "statuses": dict(sorted(statuses[operation].items())),
+        }
+    return result
+
+
+async def run(database: str, duration: float, concurrency: int, logins: int) -> dict:
+    import httpx
+    import database as db_module
+    import reservations
+
+    workload = Workload(database)
+    db_module.pool.database = database
+    await reservations.startup()
+    # Measured at steady state, with the recommender and snapshot built
+    await reservations.lifecycle.wait_background()
+    try:
+        transport = httpx.ASGITransport(app=reservations.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            quiet = await phase(client, workload, duration, concurrency, 0)
+            storm = await phase(client, workload, duration, concurrency, logins)
+    finally:
+        await reservations.shutdown()
+    return {"quiet": quiet, "storm": storm}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=DEFAULT_DATABASE)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--logins", type=int, default=64)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"{args.database} not found, generating 10^4 books")
+        generate(args.database, books=10_000, users=5_000, loans=30_000, ratings=10_000)
+
+    workdir = tempfile.mkdtemp()
+    database = os.path.join(workdir, "Library.db")
+    shutil.copy(args.database, database)
+    try:
+        result = asyncio.run(run(database, args.duration, args.concurrency, args.logins))
+    finally:
+        shutil.rmtree(workdir)
+
+    from auth import KDF_WORKERS
+    print(f"{args.concurrency} browse/borrow clients, {args.logins} login clients, "
+          f"{KDF_WORKERS} KDF worker(s), {args.duration}s per run")
+    print(f"{'run':<6} {'operation':<8} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  statuses")
+    for name, operations in result.items():
+        for operation, stats in operations.items():
+            print(f"{name:<6} {operation:<8} {stats['requests']:>9} {stats['rps']:>8} {stats['p50_ms']:>8} "
+                  f"{stats['p95_ms']:>8} {stats['p99_ms']:>8}  {stats['statuses']}")
+
+
+if __name__ == "__main__":
+    main()
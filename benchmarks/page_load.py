@@ -0,0 +1,222 @@
+"""
+Bytes on the wire and time to interactive for a cold dashboard load.
+
+    python benchmarks/page_load.py [--database benchmarks/library_synthetic.db]
+                                   [--repeat 5] [--profiles 3g broadband lan]
+
+Replays what a browser with an empty cache fetches, through reservations.app
+over httpx's ASGI transport, on a scratch copy of the database:
+- login:  index.html, then the background image it refers to
+- user:   userDashboard.html, then /books/?include=availability,ratings,
+          /users/{id}/due-soon and /users/{id}/holds, which its onload
+          handler requests together
+- admin:  adminDashboard.html, then /books/ and /admin/users/
+The /events stream the dashboards also open is left out: it is not needed to
+use the page. The login page is then loaded again with a warm browser cache.
+
+Two modes are compared:
+- before: as the files were served before, i.e. no compression (Accept-Encoding:
+          identity) and no reuse of earlier responses, as from file:// or a plain
+          static file server
+- after:  Accept-Encoding: gzip, br, revalidating pages with If-None-Match
+          and keeping hashed assets for their max-age without asking again
+
+The server cache is cleared before every load, so each one starts cold on
+both sides. Time to interactive is estimated per network profile: every
+round of requests costs one round trip plus the slowest response's server
+time plus its bytes (response headers included) at the profile's bandwidth,
+and the client's time to decode and parse the data responses, measured
+here, is added at the end. For the login page the image round is included,
+as load time rather than time to interactive.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Every simulated client shares one address; rate limiting would measure only itself
+os.environ.setdefault("LIBRARY_RATE_LIMIT", "0")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate_data import generate
+from workers import DEFAULT_DATABASE
+
+# Ahead of benchmarks/, whose recommendations.py would shadow the app's
+sys.path.insert(0, ROOT)
+
+# name: (bandwidth in Mbit/s, round trip in ms)
+PROFILES = {
+    "3g": (1.6, 150.0),
+    "broadband": (20.0, 30.0),
+    "lan": (100.0, 2.0),
+}
+MODES = ("before", "after")
+
+
+class Fetch:
+    __slots__ = ("url", "status", "wire_bytes", "body_bytes", "server_ms", "decode_ms")
+
+    def __init__(self, url, status, wire_bytes, body_bytes, server_ms, decode_ms):
+        self.url = url
+        self.status = status
+        self.wire_bytes = wire_bytes
+        self.body_bytes = body_bytes
+        self.server_ms = server_ms
+        self.decode_ms = decode_ms
+
+
+class Browser:
+    """An httpx client that sends what a browser in the given mode would, and keeps its cache."""
+
+    def __init__(self, client, mode: str, token: str = None):
+        self.client = client
+        self.mode = mode
+        self.token = token
+        self.validators = {}
+        self.fresh = set()
+
+    async def get(self, url: str, auth: bool = False, parse: bool = False) -> Fetch:
+        if url in self.fresh:
+            return Fetch(url, "cached", 0, 0, 0.0, 0.0)
+        headers = {"Accept-Encoding": "identity" if self.mode == "before" else "gzip, br"}
+        if auth and self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        if self.mode == "after" and url in self.validators:
+            headers["If-None-Match"] = self.validators[url]
+
+        started = time.perf_counter()
+        async with self.client.stream("GET", url, headers=headers) as response:
+            raw = b"".join([chunk async for chunk in response.aiter_raw()])
+        server_ms = (time.perf_counter() - started) * 1000
+        assert response.status_code in (200, 304), (url, response.status_code)
+
+        # What the client spends turning the bytes into something it can use
+        started = time.perf_counter()
+        body = gzip.decompress(raw) if response.headers.get("content-encoding") == "gzip" else raw
+        if parse and body:
+            json.loads(body)
+        decode_ms = (time.perf_counter() - started) * 1000
+
+        if self.mode == "after":
+            if "immutable" in response.headers.get("cache-control", ""):
+                self.fresh.add(url)
+            elif "etag" in response.headers:
+                self.validators[url] = response.headers["etag"]
+        header_bytes = sum(len(k) + len(v) + 4 for k, v in response.headers.raw)
+        return Fetch(url, response.status_code, len(raw) + header_bytes, len(body), server_ms, decode_ms)
+
+    async def round(self, *requests) -> list:
+        # One request at a time, so the server times do not include each other
+        return [await self.get(url, **options) for url, options in requests]
+
+
+def estimate_ms(rounds: list, bandwidth_mbit: float, rtt_ms: float) -> float:
+    total = 0.0
+    for fetches in rounds:
+        network = [f for f in fetches if f.status != "cached"]
+        if not network:
+            continue
+        wire = sum(f.wire_bytes for f in network)
+        total += rtt_ms + max(f.server_ms for f in network) + wire * 8 / (bandwidth_mbit * 1000)
+    return total + sum(f.decode_ms for fetches in rounds for f in fetches)
+
+
+async def load(database: str, mode: str, user_id: int) -> dict:
+    """Rounds of fetches per scenario, from an empty browser cache."""
+    import re
+    import httpx
+    import database as db_module
+    import reservations
+    from auth import sessions
+    from cache import response_cache
+
+    db_module.pool.database = database
+    await reservations.startup()
+    # Measured at steady state, with the recommender and snapshot built
+    await reservations.lifecycle.wait_background()
+    scenarios = {}
+    try:
+        transport = httpx.ASGITransport(app=reservations.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            image = re.search(r"/static/login\.[0-9a-f]+\.jpg", (await client.get("/index.html")).text).group(0)
+            response_cache.clear()
+            browser = Browser(client, mode)
+            scenarios["login"] = [await browser.round(("/index.html", {})), await browser.round((image, {}))]
+
+            response_cache.clear()
+            browser.token = sessions.issue(user_id, is_admin=False)
+            scenarios["user"] = [
+                await browser.round(("/userDashboard.html", {})),
+                await browser.round(("/books/?include=availability,ratings", {"parse": True}),
+                                    (f"/users/{user_id}/due-soon", {"auth": True, "parse": True}),
+                                    (f"/users/{user_id}/holds", {"auth": True, "parse": True})),
+            ]
+
+            response_cache.clear()
+            browser.token = sessions.issue(user_id, is_admin=True)
+            scenarios["admin"] = [
+                await browser.round(("/adminDashboard.html", {})),
+                await browser.round(("/books/", {"parse": True}), ("/admin/users/", {"auth": True, "parse": True})),
+            ]
+
+            # Same browser, so its cache is warm
+            scenarios["login again"] = [await browser.round(("/index.html", {})), await browser.round((image, {}))]
+    finally:
+        await reservations.shutdown()
+    return scenarios
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=DEFAULT_DATABASE)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--profiles", nargs="+", choices=PROFILES, default=list(PROFILES))
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"{args.database} not found, generating 10^4 books")
+        generate(args.database, books=10_000, users=5_000, loans=30_000, ratings=10_000)
+
+    conn = sqlite3.connect(args.database)
+    user_id = conn.execute("SELECT MIN(UserID) FROM Users WHERE UserName != 'admin'").fetchone()[0]
+    conn.close()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        database = os.path.join(workdir, "Library.db")
+        shutil.copy(args.database, database)
+        results = {mode: [asyncio.run(load(database, mode, user_id)) for _ in range(args.repeat)]
+                   for mode in MODES}
+    finally:
+        shutil.rmtree(workdir)
+
+    print(f"median of {args.repeat} loads; estimated ms per profile (Mbit/s, round trip ms): "
+          + ", ".join(f"{name} {PROFILES[name]}" for name in args.profiles))
+    print(f"{'scenario':>12} {'mode':>7} {'requests':>9} {'wire KB':>10} {'body KB':>10} {'server ms':>10} "
+          f"{'decode ms':>10}" + "".join(f" {name + ' ms':>13}" for name in args.profiles))
+    for scenario in results["before"][0]:
+        for mode in MODES:
+            runs = [run[scenario] for run in results[mode]]
+            fetches = [[f for fetches in run for f in fetches] for run in runs]
+            requests = sum(f.status != "cached" for f in fetches[0])
+            wire = np.median([sum(f.wire_bytes for f in run) for run in fetches]) / 1024
+            body = np.median([sum(f.body_bytes for f in run) for run in fetches]) / 1024
+            server = np.median([sum(f.server_ms for f in run) for run in fetches])
+            decode = np.median([sum(f.decode_ms for f in run) for run in fetches])
+            line = f"{scenario:>12} {mode:>7} {requests:>9} {wire:>10.1f} {body:>10.1f} {server:>10.1f} {decode:>10.1f}"
+            for name in args.profiles:
+                line += f" {np.median([estimate_ms(run, *PROFILES[name]) for run in runs]):>13.0f}"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Checkout latency during a storm of catalogue reads, with and without admission control.
+
+    python benchmarks/read_storm.py [--database benchmarks/library_synthetic.db]
+                                    [--storm 256] [--checkouts 4] [--duration 10]
+
+Drives reservations.app through httpx's ASGI transport, as loadtest.py
+does. --storm client tasks fetch uncached /books/ pages with availability
+as fast as they can, as a crowd of reloading dashboards would, while
+--checkouts signed-in users borrow and return a book every THINK_TIME
+seconds. Each mode
+runs on a fresh scratch copy of the database:
+
+    off          no concurrency limits, no rate limit
+    concurrency  the default per-class concurrency limits
+    full         concurrency limits plus the per-client rate limit (the
+                 storm shares one address, so it is mostly refused with 429)
+
+Prints checkout latency, the latency of the storm's successful reads, and
+what happened to the rest of them.
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate_data import generate
+from workers import DEFAULT_DATABASE
+
+# Ahead of benchmarks/, whose recommendations.py would shadow the app's
+sys.path.insert(0, ROOT)
+
+MODES = ("off", "concurrency", "full")
+# Pause between one borrower's loans, well inside the per-user rate limit
+THINK_TIME = 0.2
+
+
+def configure(mode: str):
+    from admission import admission, READ_CONCURRENCY, WRITE_CONCURRENCY, ADMIN_CONCURRENCY, RATE_LIMIT
+
+    defaults = {"read": READ_CONCURRENCY, "write": WRITE_CONCURRENCY, "admin": ADMIN_CONCURRENCY}
+    for name, limit in admission.limits.items():
+        limit.limit = 0 if mode == "off" else defaults[name]
+    admission.buckets.rate = RATE_LIMIT if mode == "full" else 0
+
+
+async def run(database: str, mode: str, storm: int, checkouts: int, duration: float) -> dict:
+    import httpx
+    import database as db_module
+    import reservations
+    from auth import sessions
+
+    conn = sqlite3.connect(database)
+    books = conn.execute("SELECT MAX(BookID) FROM Books").fetchone()[0]
+    users = conn.execute("SELECT UserID FROM Users ORDER BY UserID LIMIT ?", (checkouts,)).fetchall()
+    conn.close()
+
+    db_module.pool.database = database
+    configure(mode)
+    await reservations.startup()
+    # Measured at steady state, with the recommender and snapshot built
+    await reservations.lifecycle.wait_background()
+    checkout_ms = []
+    read_ms = []
+    storm_status = Counter()
+    rng = random.Random(0)
+    try:
+        transport = httpx.ASGITransport(app=reservations.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://storm", timeout=None) as client:
+            deadline = time.perf_counter() + duration
+
+            async def reader():
+                while time.perf_counter() < deadline:
+                    url = f"/books/?include=availability&limit=200&after={rng.randrange(books)}"
+                    started = time.perf_counter()
+                    response = await client.get(url)
+                    storm_status[response.status_code] += 1
+                    if response.status_code == 200:
+                        read_ms.append((time.perf_counter() - started) * 1000)
+                    if "retry-after" in response.headers:
+                        # A well-behaved client waits as told (plus jitter) before trying again
+                        await asyncio.sleep(float(response.headers["retry-after"]) * rng.uniform(1, 2))
+
+            async def borrower(user_id: int):
+                headers = {"Authorization": f"Bearer {sessions.issue(user_id, is_admin=False)}"}
+                while time.perf_counter() < deadline:
+                    loan = {"user_id": user_id, "book_id": rng.randrange(1, books + 1)}
+                    started = time.perf_counter()
+                    response = await client.post("/borrow/", json=loan, headers=headers)
+                    assert response.status_code in (200, 409), response.text
+                    checkout_ms.append((time.perf_counter() - started) * 1000)
+                    if response.status_code == 200:
+                        await client.post("/return/", json=loan, headers=headers)
+                    await asyncio.sleep(THINK_TIME)
+
+            await asyncio.gather(*(reader() for _ in range(storm)),
+                                 *(borrower(user_id) for (user_id,) in users))
+    finally:
+        await reservations.shutdown()
+
+    timings, reads = np.array(checkout_ms), np.array(read_ms)
+    return {
+        "checkouts": len(timings),
+        "p50_ms": round(float(np.percentile(timings, 50)), 1),
+        "p99_ms": round(float(np.percentile(timings, 99)), 1),
+        "max_ms": round(float(timings.max()), 1),
+        "read_p50_ms": round(float(np.percentile(reads, 50)), 1),
+        "read_p99_ms": round(float(np.percentile(reads, 99)), 1),
+        "storm": dict(sorted(storm_status.items())),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=DEFAULT_DATABASE)
+    parser.add_argument("--storm", type=int, default=256)
+    parser.add_argument("--checkouts", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"{args.database} not found, generating 10^4 books")
+        generate(args.database, books=10_000, users=5_000, loans=30_000, ratings=10_000)
+
+    print(f"{args.storm} storm clients, {args.checkouts} borrowers, {args.duration}s per mode")
+    print(f"{'':>12} {'checkout':>35} {'storm reads':>17}")
+    print(f"{'mode':>12} {'count':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'p50 ms':>8} {'p99 ms':>8}  statuses")
+    for mode in args.modes:
+        workdir = tempfile.mkdtemp()
+        database = os.path.join(workdir, "Library.db")
+        shutil.copy(args.database, database)
+        try:
+            result = asyncio.run(run(database, mode, args.storm, args.checkouts, args.duration))
+        finally:
+            shutil.rmtree(workdir)
+        print(f"{mode:>12} {result['checkouts']:>8} {result['p50_ms']:>8} {result['p99_ms']:>8} "
+              f"{result['max_ms']:>8} {result['read_p50_ms']:>8} {result['read_p99_ms']:>8}  {result['storm']}")
+
+
+if __name__ == "__main__":
+    main()
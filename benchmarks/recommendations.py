@@ -0,0 +1,67 @@
+"""
+Recommendation query latency against history size.
+
+    python benchmarks/recommendations.py [--sizes 10000 100000 1000000] [--queries 200]
+
+Builds the engine from synthetic loans with Zipf-skewed book popularity
+(no database needed) and times recommend() for random users in each mode.
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from recommendations import RecommendationEngine
+
+GENRES = ["Mystery", "Fantasy", "Science Fiction", "Romance", "Thriller", "Drama", "Adventure", "Horror"]
+
+
+def synthetic(history: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    n_books = max(history // 20, 100)
+    n_users = max(history // 10, 100)
+    books = [(i + 1, f"Author {i % (n_books // 5 + 1)}", GENRES[i % len(GENRES)]) for i in range(n_books)]
+    book_ids = np.minimum(rng.zipf(1.3, history), n_books)
+    user_ids = rng.integers(1, n_users + 1, history)
+    loans = list(zip(user_ids.tolist(), book_ids.tolist()))
+    rated = rng.random(history) < 0.3
+    ratings = list(zip(user_ids[rated].tolist(), book_ids[rated].tolist(),
+                       rng.integers(1, 6, int(rated.sum())).tolist()))
+    return books, loans, ratings, n_users
+
+
+def run(history: int, queries: int):
+    books, loans, ratings, n_users = synthetic(history)
+    engine = RecommendationEngine()
+    start = time.perf_counter()
+    engine.load(books, loans, ratings)
+    build = time.perf_counter() - start
+
+    rng = np.random.default_rng(1)
+    users = rng.integers(1, n_users + 1, queries).tolist()
+    results = {"history": history, "build_s": round(build, 3)}
+    for mode in ("genre", "author", "popular"):
+        timings = []
+        for user_id in users:
+            start = time.perf_counter()
+            engine.recommend(user_id, mode=mode, limit=10)
+            timings.append(time.perf_counter() - start)
+        timings = np.array(timings) * 1000
+        results[mode] = {"p50_ms": round(float(np.percentile(timings, 50)), 3),
+                         "p99_ms": round(float(np.percentile(timings, 99)), 3)}
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'history':>10} {'build s':>8} " + " ".join(f"{m + ' p50/p99 ms':>22}" for m in ("genre", "author", "popular")))
+    for size in args.sizes:
+        r = run(size, args.queries)
+        cells = " ".join(f"{r[m]['p50_ms']:>10.3f}/{r[m]['p99_ms']:<11.3f}" for m in ("genre", "author", "popular"))
+        print(f"{r['history']:>10} {r['build_s']:>8} {cells}")
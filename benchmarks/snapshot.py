@@ -0,0 +1,189 @@
+"""
+Memory and read latency of the in-memory catalog snapshot (LIBRARY_READ_MODE=snapshot).
+
+    python benchmarks/snapshot.py [--database benchmarks/library_synthetic.db]
+                                  [--readers 16] [--rate 300] [--writers 2] [--duration 10]
+
+First loads the snapshot from a scratch copy of the database and reports
+load time, the size CatalogSnapshot.stats() accounts for and the memory
+tracemalloc sees allocated by the load, per book and scaled to a million
+books. For a multi-million-row figure, generate a bigger catalog first:
+
+    python benchmarks/generate_data.py --books 1000000 --loans 100000 --out /tmp/million.db
+    python benchmarks/snapshot.py --database /tmp/million.db
+
+Then, for each read mode, drives reservations.app through httpx's ASGI
+transport, as read_storm.py does: --readers tasks fetch random pages of
+/books/?include=availability,ratings and random /available/ batches, --rate
+requests per second between them (0: as fast as they can), while --writers
+signed-in users borrow and return books back to back. Prints read latency
+and throughput and checkout latency in each mode. Everything shares one
+event loop, so with an unlimited rate a faster read mode also takes CPU
+time from the writers; a fixed rate gives both modes the same read load.
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Every simulated client shares one address; rate limiting would measure only itself
+os.environ.setdefault("LIBRARY_RATE_LIMIT", "0")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate_data import generate
+from workers import DEFAULT_DATABASE
+
+# Ahead of benchmarks/, whose recommendations.py would shadow the app's
+sys.path.insert(0, ROOT)
+
+MODES = ("sqlite", "snapshot")
+# Book IDs per /available/ batch
+BATCH_IDS = 50
+
+
+async def measure_memory(database: str):
+    import database as db_module
+    from migrations import apply_migrations
+    from snapshot import CatalogSnapshot
+
+    db_module.pool.database = database
+    await db_module.pool.open()
+    try:
+        async with db_module.pool.writer() as db:
+            await apply_migrations(db)
+        snapshot = CatalogSnapshot(mode="snapshot", verify_interval=0)
+        tracemalloc.start()
+        await snapshot.start()
+        traced, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stats = snapshot.stats()
+        await snapshot.stop()
+    finally:
+        await db_module.pool.close()
+
+    books = stats["books"]
+    print(f"{books} books loaded in {stats['last_load_seconds']}s")
+    print(f"{'':>22} {'MB':>9} {'bytes/book':>11} {'MB per 10^6 books':>18}")
+    for name, size in (("snapshot.stats()", stats["bytes"]), ("tracemalloc, held", traced),
+                       ("tracemalloc, peak", peak)):
+        print(f"{name:>22} {size / 2**20:>9.1f} {size / books:>11.1f} {size / books * 1e6 / 2**20:>18.1f}")
+
+
+def percentiles(timings: list) -> str:
+    if not timings:
+        return f"{'-':>8} {'-':>8}"
+    values = np.array(timings)
+    return f"{np.percentile(values, 50):>8.2f} {np.percentile(values, 99):>8.2f}"
+
+
+async def run(database: str, mode: str, readers: int, rate: float, writers: int, duration: float) -> dict:
+    import httpx
+    import database as db_module
+    import reservations
+    from auth import sessions
+    from snapshot import catalog_snapshot
+
+    conn = sqlite3.connect(database)
+    books = conn.execute("SELECT MAX(BookID) FROM Books").fetchone()[0]
+    users = conn.execute("SELECT UserID FROM Users ORDER BY UserID LIMIT ?", (writers,)).fetchall()
+    conn.close()
+
+    db_module.pool.database = database
+    catalog_snapshot.enabled = mode == "snapshot"
+    await reservations.startup()
+    # Measured at steady state, with the recommender and snapshot built
+    await reservations.lifecycle.wait_background()
+    page_ms, batch_ms, checkout_ms = [], [], []
+    rng = random.Random(0)
+    try:
+        transport = httpx.ASGITransport(app=reservations.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            deadline = time.perf_counter() + duration
+
+            async def reader():
+                next_at = time.perf_counter() + rng.uniform(0, readers / rate) if rate else 0
+                while time.perf_counter() < deadline:
+                    if rate:
+                        await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+                        next_at += readers / rate
+                    if rng.random() < 0.5:
+                        url, timings = f"/books/?include=availability,ratings&limit=100&after={rng.randrange(books)}", page_ms
+                    else:
+                        ids = ",".join(str(rng.randrange(1, books + 1)) for _ in range(BATCH_IDS))
+                        url, timings = f"/available/?ids={ids}", batch_ms
+                    started = time.perf_counter()
+                    response = await client.get(url)
+                    assert response.status_code == 200, response.text
+                    timings.append((time.perf_counter() - started) * 1000)
+
+            async def writer(user_id: int):
+                headers = {"Authorization": f"Bearer {sessions.issue(user_id, is_admin=False)}"}
+                while time.perf_counter() < deadline:
+                    loan = {"user_id": user_id, "book_id": rng.randrange(1, books + 1)}
+                    started = time.perf_counter()
+                    response = await client.post("/borrow/", json=loan, headers=headers)
+                    assert response.status_code in (200, 409), response.text
+                    checkout_ms.append((time.perf_counter() - started) * 1000)
+                    if response.status_code == 200:
+                        await client.post("/return/", json=loan, headers=headers)
+
+            await asyncio.gather(*(reader() for _ in range(readers)), *(writer(user_id) for (user_id,) in users))
+        stats = catalog_snapshot.stats()
+    finally:
+        await reservations.shutdown()
+    return {"page_ms": page_ms, "batch_ms": batch_ms, "checkout_ms": checkout_ms,
+            "reads_per_s": (len(page_ms) + len(batch_ms)) / duration, "events": stats["events"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=DEFAULT_DATABASE)
+    parser.add_argument("--readers", type=int, default=16)
+    parser.add_argument("--rate", type=float, default=300.0)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--memory-only", action="store_true")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"{args.database} not found, generating 10^4 books")
+        generate(args.database, books=10_000, users=5_000, loans=30_000, ratings=10_000)
+
+    workdir = tempfile.mkdtemp()
+    try:
+        database = os.path.join(workdir, "Library.db")
+        shutil.copy(args.database, database)
+        asyncio.run(measure_memory(database))
+        if args.memory_only:
+            return
+
+        print(f"\n{args.readers} readers at {args.rate or 'unlimited'} req/s, {args.writers} writers, "
+              f"{args.duration}s per mode")
+        print(f"{'':>10} {'books page':>17} {'/available batch':>17} {'checkout':>17}")
+        print(f"{'mode':>10} {'p50 ms':>8} {'p99 ms':>8} {'p50 ms':>8} {'p99 ms':>8} {'p50 ms':>8} {'p99 ms':>8}"
+              f" {'reads/s':>8} {'events':>7}")
+        for mode in args.modes:
+            # Each mode on a fresh copy, so both see the same loans
+            shutil.copy(args.database, database)
+            for suffix in ("-wal", "-shm"):
+                if os.path.exists(database + suffix):
+                    os.remove(database + suffix)
+            result = asyncio.run(run(database, mode, args.readers, args.rate, args.writers, args.duration))
+            print(f"{mode:>10} {percentiles(result['page_ms'])} {percentiles(result['batch_ms'])} "
+                  f"{percentiles(result['checkout_ms'])} {result['reads_per_s']:>8.0f} {result['events']:>7}")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
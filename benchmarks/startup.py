@@ -0,0 +1,165 @@
+"""
+Import and startup time of a worker, for keeping rolling restarts fast.
+
+    python benchmarks/startup.py [--database benchmarks/library_synthetic.db]
+                                 [--repeat 5] [--modules 15]
+
+Every sample runs in a fresh interpreter on a scratch copy of the database
+(migrated by one discarded start first), since a module is imported only
+once per process and a restarted worker always starts cold:
+- import:  `import reservations`, and the --modules imports with the most
+           self time according to python -X importtime
+- startup: reservations.startup() run in-process with LIBRARY_READ_MODE=snapshot,
+           reporting each phase from lifecycle.stats(); "ready" is when the
+           worker starts serving, "all built" when the background phases
+           (recommender, catalog snapshot) have finished too, which is when
+           the worker used to start serving before startup had phases
+- serve:   python serve.py with one worker, from spawning the process until
+           GET /health/ready answers 200 over a real socket (after one
+           discarded start, which converts the copy to incremental auto-vacuum)
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate_data import generate
+from workers import DEFAULT_DATABASE, free_port
+
+# Ahead of benchmarks/, whose recommendations.py would shadow the app's
+sys.path.insert(0, ROOT)
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import reservations; print(time.perf_counter() - t)"
+CHILD_ENV = {"LIBRARY_RATE_LIMIT": "0", "LIBRARY_READ_MODE": "snapshot", "LIBRARY_LOG_LEVEL": "warning"}
+
+
+def child(database: str):
+    """Runs in the subprocess: import, start, wait for the background phases, print the timings as JSON."""
+    started = time.perf_counter()
+    import database as db_module
+    import reservations
+    from lifecycle import lifecycle
+    imported = time.perf_counter() - started
+
+    async def run():
+        db_module.pool.database = database
+        await reservations.startup()
+        await lifecycle.wait_background()
+        stats = lifecycle.stats()
+        await reservations.shutdown()
+        return stats
+
+    stats = asyncio.run(run())
+    print(json.dumps({"import": imported, "ready": stats["ready_seconds"],
+                      "phases": {name: phase["seconds"] for name, phase in stats["phases"].items()},
+                      "background": [name for name, phase in stats["phases"].items() if phase["background"]]}))
+
+
+def import_seconds() -> float:
+    output = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    return float(output)
+
+
+def slowest_modules(count: int) -> list:
+    """(self ms, cumulative ms, module) of the imports with the most self time."""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "import reservations"], cwd=ROOT,
+                            check=True, capture_output=True, text=True).stderr
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line.removeprefix("import time:").split("|")
+        modules.append((int(own) / 1000, int(cumulative) / 1000, name.strip()))
+    return sorted(modules, reverse=True)[:count]
+
+
+def startup_run(database: str) -> dict:
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", database],
+                            env={**os.environ, **CHILD_ENV}, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def serve_seconds(database: str) -> float:
+    import httpx
+
+    port = free_port()
+    env = {**os.environ, **CHILD_ENV, "LIBRARY_DATABASE": database, "LIBRARY_PORT": str(port),
+           "LIBRARY_WORKERS": "1"}
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "serve.py"], cwd=ROOT, env=env)
+    try:
+        with httpx.Client() as http:
+            while time.perf_counter() - started < 60:
+                try:
+                    if http.get(f"http://127.0.0.1:{port}/health/ready").status_code == 200:
+                        return time.perf_counter() - started
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.01)
+        raise SystemExit("serve.py did not become ready")
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=DEFAULT_DATABASE)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--modules", type=int, default=15)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return
+
+    if not os.path.exists(args.database):
+        print(f"{args.database} not found, generating 10^4 books")
+        generate(args.database, books=10_000, users=5_000, loans=30_000, ratings=10_000)
+
+    imports = [import_seconds() for _ in range(args.repeat)]
+    print(f"import reservations: median {np.median(imports) * 1000:.0f} ms, "
+          f"min {min(imports) * 1000:.0f} ms over {args.repeat} interpreters")
+    print(f"{'self ms':>9} {'cumul ms':>9}  module")
+    for own, cumulative, name in slowest_modules(args.modules):
+        print(f"{own:>9.1f} {cumulative:>9.1f}  {name}")
+
+    workdir = tempfile.mkdtemp()
+    try:
+        database = os.path.join(workdir, "Library.db")
+        shutil.copy(args.database, database)
+        startup_run(database)
+        runs = [startup_run(database) for _ in range(args.repeat)]
+        # The first serve.py start also switches the copy to incremental auto-vacuum
+        serve_seconds(database)
+        served = [serve_seconds(database) for _ in range(args.repeat)]
+    finally:
+        shutil.rmtree(workdir)
+
+    print(f"\nstartup, median of {args.repeat} processes (ms)")
+    for name in runs[0]["phases"]:
+        kind = "background" if name in runs[0]["background"] else "foreground"
+        print(f"{name:>12} {kind:>11} {np.median([run['phases'][name] for run in runs]) * 1000:>9.1f}")
+    ready = [run["import"] + run["ready"] for run in runs]
+    built = [run["import"] + run["ready"] + max(run["phases"][name] for name in run["background"])
+             if run["background"] else run["import"] + run["ready"] for run in runs]
+    print(f"{'import + ready':>26} {np.median(ready) * 1000:>9.1f}")
+    print(f"{'import + all built':>26} {np.median(built) * 1000:>9.1f}")
+    print(f"{'serve.py to /health/ready':>26} {np.median(served) * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Read throughput of serve.py against its number of worker processes.
+
+    python benchmarks/workers.py [--database benchmarks/library_synthetic.db]
+                                 [--workers 1 2 4] [--clients 8] [--duration 10]
+
+For each worker count, starts serve.py on a scratch copy of the database,
+drives it over real sockets from --clients client processes (keyset browse
+pages and uncached catalogue searches, half each) and reports requests per
+second and the speed-up over the first worker count. Read-heavy traffic
+should scale close to linearly until the workers run out of cores, so run
+it on a machine with at least as many cores as the largest worker count
+plus the clients.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate_data import generate, WORDS
+
+DEFAULT_DATABASE = os.path.join(ROOT, "benchmarks", "library_synthetic.db")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def client(base_url: str, books: int, deadline: float, seed: int) -> int:
+    import httpx
+
+    rng = random.Random(seed)
+    done = 0
+    # No keep-alive: a fresh connection per request, so the kernel spreads them over the workers
+    with httpx.Client(base_url=base_url, limits=httpx.Limits(max_keepalive_connections=0)) as http:
+        while time.time() < deadline:
+            if rng.random() < 0.5:
+                url = f"/books/?limit=50&after={rng.randrange(books)}"
+            else:
+                url = f"/api/books/?q={rng.choice(WORDS)}&limit=20"
+            if http.get(url).status_code == 200:
+                done += 1
+    return done
+
+
+def measure(database: str, workers: int, clients: int, duration: float, books: int) -> float:
+    port = free_port()
+    env = {**os.environ, "LIBRARY_DATABASE": database, "LIBRARY_PORT": str(port),
+           "LIBRARY_WORKERS": str(workers), "LIBRARY_LOG_LEVEL": "warning", "LIBRARY_RATE_LIMIT": "0"}
+    server = subprocess.Popen([sys.executable, "serve.py"], cwd=ROOT, env=env)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        import httpx
+        for _ in range(300):
+            try:
+                if httpx.get(f"{base_url}/books/?limit=1").status_code == 200:
+                    break
+            except httpx.TransportError:
+                time.sleep(0.1)
+        else:
+            raise SystemExit("serve.py did not come up")
+        # Let every worker finish startup before timing
+        time.sleep(1.0)
+        deadline = time.time() + duration
+        with multiprocessing.Pool(clients) as pool:
+            counts = pool.starmap(client, [(base_url, books, deadline, seed) for seed in range(clients)])
+        return sum(counts) / duration
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=DEFAULT_DATABASE)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"{args.database} not found, generating 10^4 books")
+        generate(args.database, books=10_000, users=5_000, loans=30_000, ratings=10_000)
+
+    conn = sqlite3.connect(args.database)
+    books = conn.execute("SELECT MAX(BookID) FROM Books").fetchone()[0]
+    conn.close()
+
+    print(f"{os.cpu_count()} cores, {args.clients} client processes, {args.duration}s per run")
+    print(f"{'workers':>7} {'req/s':>9} {'speed-up':>9}")
+    first = None
+    for workers in args.workers:
+        workdir = tempfile.mkdtemp()
+        database = os.path.join(workdir, "Library.db")
+        shutil.copy(args.database, database)
+        try:
+            rps = measure(database, workers, args.clients, args.duration, books)
+        finally:
+            shutil.rmtree(workdir)
+        first = first or rps
+        print(f"{workers:>7} {rps:>9.1f} {rps / first:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
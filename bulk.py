@@ -0,0 +1,329 @@
+import codecs
+import csv
+import io
+import json
+from fastapi import APIRouter, HTTPException, Request, Query, Depends, status
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+import aiosqlite
+from database import pool, get_db, run_transaction
+from pagination import keyset_rows
+from recommendations import recommender
+from cache import response_cache
+from resources import Book
+from auth import require_admin
+from migrations import ADD_IMPORTED_FACETS
+
+# Rows validated, deduplicated and inserted per write transaction
+IMPORT_CHUNK_ROWS = 5000
+# Bound on the number of per-row problems echoed back in the response
+MAX_REPORTED_ERRORS = 1000
+# SQLite host parameter limit is much higher, but keep IN lists modest
+LOOKUP_BATCH = 500
+# Row triggers on Books that the import replaces with one set-based statement per chunk
+SEARCH_TRIGGER = "trg_books_search_insert"
+CHANGE_TRIGGER = "trg_books_changed_insert"
+EVENT_TRIGGER = "trg_books_event_insert"
+FACET_TRIGGER = "trg_books_facets_insert"
+
+router = APIRouter(
+    prefix="/admin/books",
+    tags=["Admin"],
+    dependencies=[Depends(require_admin)],
+)
+
+# -------------------------------
+# Parsing Helpers
+# -------------------------------
+
+# SQLite's lower() only folds ASCII and trim() only strips spaces, so the
+# Python side of the dedup key has to do exactly the same to match the index
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+def _normalize(text: str) -> str:
+    text = text.strip(" ")
+    return text.lower() if text.isascii() else text.translate(_ASCII_LOWER)
+
+
+def dedup_key(title: str, author: str) -> tuple:
+    """Normalized title+author, equal to (lower(trim(BookName)), lower(trim(Author))) in SQL."""
+    return _normalize(title), _normalize(author)
+
+
+INVALID_UTF8 = "Not valid UTF-8"
+
+
+def _decode_lines(data: bytes) -> list:
+    """Lines of `data`, each decoded, or None for one that is not valid UTF-8."""
+    try:
+        return [line.rstrip("\r") for line in data.decode("utf-8").split("\n")]
+    except UnicodeDecodeError:
+        lines = []
+        for raw in data.split(b"\n"):
+            try:
+                lines.append(raw.decode("utf-8").rstrip("\r"))
+            except UnicodeDecodeError:
+                lines.append(None)
+        return lines
+
+
+async def _lines(request: Request):
+    """
+    Decode the upload as it arrives and yield it line by line; a line that
+    is not valid UTF-8 is yielded as None, for the parser to report.
+    """
+    pending = b""
+    first = True
+    async for chunk in request.stream():
+        pending += chunk
+        if first:
+            if len(pending) < len(codecs.BOM_UTF8):
+                continue
+            pending = pending.removeprefix(codecs.BOM_UTF8)
+            first = False
+        # b"\n" never occurs inside a multi-byte UTF-8 sequence
+        end = pending.rfind(b"\n")
+        if end < 0:
+            continue
+        complete, pending = pending[:end], pending[end + 1:]
+        for line in _decode_lines(complete):
+            yield line
+    pending = pending.removeprefix(codecs.BOM_UTF8) if first else pending
+    if pending:
+        for line in _decode_lines(pending):
+            yield line
+
+
+async def _ndjson_records(lines):
+    number = 0
+    async for line in lines:
+        number += 1
+        if line is None:
+            yield number, None, INVALID_UTF8
+            continue
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("expected a JSON object")
+            yield number, record, None
+        except ValueError as e:
+            yield number, None, f"Invalid JSON: {e}"
+
+
+async def _csv_records(lines):
+    header = None
+    number = 0
+    record_text, first_line = "", 0
+    async for line in lines:
+        number += 1
+        if line is None:
+            # Drops a quoted record it was part of; the next line starts afresh
+            yield first_line or number, None, INVALID_UTF8
+            record_text, first_line = "", 0
+            continue
+        record_text = f"{record_text}\n{line}" if record_text else line
+        first_line = first_line or number
+        # A quoted field may span lines: wait until the quotes are balanced
+        if record_text.count('"') % 2:
+            continue
+        text, line_number = record_text, first_line
+        record_text, first_line = "", 0
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [name.strip().lower() for name in values]
+            continue
+        if len(values) != len(header):
+            yield line_number, None, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        yield line_number, dict(zip(header, values)), None
+    if record_text:
+        yield first_line, None, "Unterminated quoted field"
+
+
+def _validate(record: dict) -> Book:
+    # Accept the admin dashboard's field names as well as the API's
+    if "title" not in record and "book_name" in record:
+        record = {**record, "title": record["book_name"]}
+    return Book(**record)
+
+# -------------------------------
+# Import
+# -------------------------------
+
+# Titles and authors already in the catalog, one batch of lower(trim(BookName)) at a time
+EXISTING_KEYS = """
+    SELECT lower(trim(BookName)), lower(trim(Author)) FROM Books
+    WHERE lower(trim(BookName)) IN ({placeholders})
+"""
+
+
+async def _existing_keys(db: aiosqlite.Connection, keys: list) -> set:
+    found = set()
+    titles = sorted({title for title, _ in keys})
+    for start in range(0, len(titles), LOOKUP_BATCH):
+        batch = titles[start:start + LOOKUP_BATCH]
+        placeholders = ",".join("?" for _ in batch)
+        cursor = await db.execute(EXISTING_KEYS.format(placeholders=placeholders), batch)
+        found.update(tuple(row) for row in await cursor.fetchall())
+    return found
+
+
+async def _insert_chunk(chunk: list, report: dict):
+    """Dedup one chunk of (line, Book) against itself and the table, then insert it in one transaction."""
+    keys = [dedup_key(book.title, book.author) for _, book in chunk]
+
+    async def work(db):
+        existing = await _existing_keys(db, keys)
+        rows, duplicates = [], []
+        for (line, book), key in zip(chunk, keys):
+            if key in existing:
+                duplicates.append(line)
+                continue
+            existing.add(key)
+            rows.append((book.title, book.author, book.genre, book.year))
+
+        cursor = await db.execute("SELECT IFNULL(MAX(BookID), 0) FROM Books")
+        last_id = (await cursor.fetchone())[0]
+        # The per-row search trigger costs ~10x the insert itself, so index the
+        # chunk with one INSERT ... SELECT instead, bump the change counter
+        # once rather than per row and log one books_imported event instead of
+        # a book_added per row, and add the chunk to the facet counts with
+        # one grouped upsert. DDL is transactional and we hold the write
+        # lock, so no other write can slip past without the triggers.
+        cursor = await db.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name IN (?, ?, ?, ?)",
+            (SEARCH_TRIGGER, CHANGE_TRIGGER, EVENT_TRIGGER, FACET_TRIGGER)
+        )
+        triggers = dict(await cursor.fetchall())
+        for name in triggers:
+            await db.execute(f"DROP TRIGGER {name}")
+        await db.executemany(
+            "INSERT INTO Books (BookName, Author, Genre, Year) VALUES (?, ?, ?, ?)", rows
+        )
+        if SEARCH_TRIGGER in triggers:
+            await db.execute("""
+                INSERT INTO BooksSearch (rowid, BookName, Author, Genre)
+                SELECT BookID, BookName, Author, Genre FROM Books WHERE BookID > ?
+            """, (last_id,))
+        if CHANGE_TRIGGER in triggers and rows:
+            await db.execute("UPDATE ChangeCounters SET Version = Version + 1 WHERE Tag = 'books'")
+        if EVENT_TRIGGER in triggers and rows:
+            # Clients refetch /books/?after=first_book_id-1 instead of patching row by row
+            await db.execute("""
+                INSERT INTO Events (Type, Data)
+                SELECT 'books_imported', json_object('count', COUNT(*), 'first_book_id', MIN(BookID),
+                                                     'last_book_id', MAX(BookID))
+                FROM Books WHERE BookID > ?
+            """, (last_id,))
+        if FACET_TRIGGER in triggers and rows:
+            await db.execute(ADD_IMPORTED_FACETS, (last_id,))
+        for sql in triggers.values():
+            await db.execute(sql)
+        # We hold the write lock, so every row past last_id is ours
+        cursor = await db.execute("SELECT BookID, Author, Genre FROM Books WHERE BookID > ?", (last_id,))
+        return await cursor.fetchall(), duplicates
+
+    async with pool.writer() as db:
+        inserted, duplicates = await run_transaction(db, work)
+
+    for book_id, author, genre in inserted:
+        recommender.add_book(book_id, author, genre)
+    report["inserted"] += len(inserted)
+    report["duplicates"] += len(duplicates)
+    for line in duplicates:
+        _report_error(report, line, "Duplicate title and author")
+
+
+def _report_error(report: dict, line: int, error: str):
+    report["error_count"] += 1
+    if len(report["errors"]) < MAX_REPORTED_ERRORS:
+        report["errors"].append({"line": line, "error": error})
+
+
+@router.post("/import",
+             summary="Bulk import books",
+             response_description="Counts and per-row errors")
+async def import_books(request: Request):
+    """
+    Stream a CSV (Content-Type: text/csv, with a header row) or NDJSON
+    (application/x-ndjson) upload of books with title/book_name, author, genre and year.
+    Rows are validated with the Book model, deduplicated on normalized title+author
+    against the catalog and the rest of the upload, and inserted IMPORT_CHUNK_ROWS at a time.
+    Duplicates count as row errors; invalid rows are reported and skipped.
+    """
+    content_type = request.headers.get("content-type", "")
+    if "csv" in content_type:
+        records = _csv_records(_lines(request))
+    elif "json" in content_type:
+        records = _ndjson_records(_lines(request))
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Upload text/csv or application/x-ndjson"
+        )
+
+    report = {"received": 0, "inserted": 0, "duplicates": 0, "error_count": 0, "errors": []}
+    chunk = []
+    try:
+        async for line, record, error in records:
+            report["received"] += 1
+            if error is None:
+                try:
+                    chunk.append((line, _validate(record)))
+                except ValidationError as e:
+                    error = "; ".join(f"{'.'.join(map(str, item['loc']))}: {item['msg']}" for item in e.errors())
+            if error is not None:
+                _report_error(report, line, error)
+            if len(chunk) >= IMPORT_CHUNK_ROWS:
+                await _insert_chunk(chunk, report)
+                chunk = []
+        if chunk:
+            await _insert_chunk(chunk, report)
+    finally:
+        if report["inserted"]:
+            response_cache.invalidate("books")
+    return report
+
+# -------------------------------
+# Export
+# -------------------------------
+
+EXPORT_FIELDS = ["book_id", "book_name", "author", "genre", "year"]
+EXPORT_SELECT = "SELECT BookID, BookName, Author, Genre, Year FROM Books"
+
+async def _export_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    async for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+async def _export_ndjson(rows):
+    async for row in rows:
+        yield json.dumps(dict(zip(EXPORT_FIELDS, row))) + "\n"
+
+
+@router.get("/export",
+            summary="Bulk export books",
+            response_description="The whole catalog as CSV or NDJSON")
+async def export_books(format: str = Query("csv", enum=["csv", "ndjson"]),
+                       db: aiosqlite.Connection = Depends(get_db)):
+    """Stream every book in BookID order, reading the table in keyset chunks."""
+    rows = keyset_rows(db, EXPORT_SELECT, "BookID")
+    if format == "ndjson":
+        return StreamingResponse(_export_ndjson(rows), media_type="application/x-ndjson")
+    return StreamingResponse(
+        _export_csv(rows),
+        media_type="text/csv",
+        headers={"Content-Disposition": 'attachment; filename="books.csv"'}
+    )
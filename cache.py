@@ -0,0 +1,242 @@
+import hashlib
+from collections import OrderedDict
+from starlette.datastructures import Headers
+from compression import MIN_SIZE, accepted_encodings, gzip_bytes
+
+# Total size of cached response bodies
+CACHE_MAX_BYTES = 32 * 1024 * 1024
+# Larger responses are streamed through without being cached
+CACHE_MAX_ENTRY_BYTES = 8 * 1024 * 1024
+
+# GET routes whose responses are cached, and the tag that invalidates them
+CACHED_ROUTES = {
+    "/books/": "books",
+    "/reviews/": "reviews",
+    "/admin/users/": "users",
+}
+
+# Query string fragments that make a cached response also depend on another tag
+QUERY_TAGS = {
+    b"availability": "loans",
+    b"ratings": "reviews",
+}
+
+# -------------------------------
+# Response Cache
+# -------------------------------
+
+class CacheEntry:
+    __slots__ = ("tags", "body", "etag", "media_type", "gzipped")
+
+    def __init__(self, tags: tuple, body: bytes, media_type: str):
+        self.tags = tags
+        self.body = body
+        self.etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        self.media_type = media_type
+        # Compressed the first time a client that accepts gzip asks for it
+        self.gzipped = None
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + len(self.gzipped or b"")
+
+
+class ResponseCache:
+    """
+    LRU cache of serialized response bodies, bounded by total size.
+    Entries carry one or more tags; write endpoints call invalidate(tag) after committing.
+    Each tag has a generation number so a response computed before an
+    invalidation is never stored after it.
+    """
+
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES, max_entry_bytes: int = CACHE_MAX_ENTRY_BYTES):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._size = 0
+        self._stats = {"hits": 0, "misses": 0, "not_modified": 0, "evictions": 0, "invalidations": 0,
+                       "compressions": 0}
+
+    def generation(self, tag: str) -> int:
+        return self._generations.get(tag, 0)
+
+    def generations(self, tags: tuple) -> tuple:
+        return tuple(self.generation(tag) for tag in tags)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self._stats["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self._stats["hits"] += 1
+        return entry
+
+    def record_not_modified(self):
+        self._stats["not_modified"] += 1
+
+    def put(self, key, tags: tuple, generations: tuple, body: bytes, media_type: str) -> CacheEntry:
+        entry = CacheEntry(tags, body, media_type)
+        if generations != self.generations(tags) or len(body) > self.max_entry_bytes:
+            return entry
+        self._discard(key)
+        self._entries[key] = entry
+        self._size += len(body)
+        self._evict()
+        return entry
+
+    def gzipped(self, key, entry: CacheEntry) -> bytes:
+        """The entry's body gzipped, compressing it once and keeping the result with the entry."""
+        if entry.gzipped is None:
+            entry.gzipped = gzip_bytes(entry.body)
+            self._stats["compressions"] += 1
+            if self._entries.get(key) is entry:
+                self._size += len(entry.gzipped)
+                self._evict()
+        return entry.gzipped
+
+    def _evict(self):
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= evicted.size
+            self._stats["evictions"] += 1
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry.size
+
+    def invalidate(self, *tags: str):
+        for tag in tags:
+            self._generations[tag] = self.generation(tag) + 1
+            for key in [k for k, entry in self._entries.items() if tag in entry.tags]:
+                self._discard(key)
+            self._stats["invalidations"] += 1
+
+    def clear(self):
+        for tag in {tag for entry in self._entries.values() for tag in entry.tags}:
+            self._generations[tag] = self.generation(tag) + 1
+        self._entries.clear()
+        self._size = 0
+
+    def stats(self) -> dict:
+        return {**self._stats, "entries": len(self._entries), "bytes": self._size, "max_bytes": self.max_bytes}
+
+
+response_cache = ResponseCache()
+
+
+# Appended inside the quotes of a cached body's ETag when it is sent gzipped,
+# since the two encodings are different representations
+GZIP_ETAG_SUFFIX = "-gzip"
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    gzip_etag = etag[:-1] + GZIP_ETAG_SUFFIX + '"'
+    return any(tag.strip().removeprefix("W/") in (etag, gzip_etag) for tag in if_none_match.split(","))
+
+# -------------------------------
+# ASGI Middleware
+# -------------------------------
+
+class ResponseCacheMiddleware:
+    """
+    Serves CACHED_ROUTES from the response cache, answering If-None-Match with 304.
+    On a miss the response is buffered up to max_entry_bytes so it can be
+    stored and sent with its ETag; anything larger is passed through as it streams.
+    Bodies of at least MIN_SIZE bytes go gzipped to clients that accept it,
+    compressed once per entry rather than on every hit.
+    """
+
+    def __init__(self, app, cache: ResponseCache = response_cache, routes: dict = CACHED_ROUTES,
+                 query_tags: dict = QUERY_TAGS, authorize=None):
+        self.app = app
+        # authorize(scope) -> bool; requests it refuses bypass the cache so the
+        # endpoint's own dependencies answer them
+        self.authorize = authorize
+        self.cache = cache
+        self.routes = routes
+        self.query_tags = query_tags
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET" or scope["path"] not in self.routes:
+            await self.app(scope, receive, send)
+            return
+        if self.authorize is not None and not self.authorize(scope):
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        key = (scope["path"], scope["query_string"], headers.get("accept", ""))
+        entry = self.cache.get(key)
+        if entry is not None:
+            await self._respond(send, headers, key, entry)
+            return
+
+        tags = (self.routes[scope["path"]],) + tuple(
+            tag for query, tag in self.query_tags.items() if query in scope["query_string"]
+        )
+        generations = self.cache.generations(tags)
+        start = None
+        buffer = []
+        size = 0
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, size, passthrough
+            if message["type"] == "http.response.start":
+                if message["status"] != 200:
+                    passthrough = True
+                    await send(message)
+                else:
+                    start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            buffer.append(body)
+            size += len(body)
+            if size > self.cache.max_entry_bytes:
+                # Too big to cache: flush what we have and stream the rest
+                passthrough = True
+                await send(start)
+                await send({"type": "http.response.body", "body": b"".join(buffer), "more_body": more_body})
+                buffer.clear()
+            elif not more_body:
+                media_type = Headers(raw=start["headers"]).get("content-type", "application/json")
+                entry = self.cache.put(key, tags, generations, b"".join(buffer), media_type)
+                await self._respond(send, headers, key, entry)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def _respond(self, send, request_headers: Headers, key, entry: CacheEntry):
+        gzipped = len(entry.body) >= MIN_SIZE and "gzip" in accepted_encodings(request_headers.get("accept-encoding"))
+        etag = entry.etag[:-1] + GZIP_ETAG_SUFFIX + '"' if gzipped else entry.etag
+        headers = [
+            (b"etag", etag.encode()),
+            (b"cache-control", b"no-cache"),
+            (b"vary", b"Accept-Encoding"),
+        ]
+        if etag_matches(request_headers.get("if-none-match"), entry.etag):
+            self.cache.record_not_modified()
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        body = self.cache.gzipped(key, entry) if gzipped else entry.body
+        if gzipped:
+            headers.append((b"content-encoding", b"gzip"))
+        headers += [
+            (b"content-type", entry.media_type.encode()),
+            (b"content-length", str(len(body)).encode()),
+        ]
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
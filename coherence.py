@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import os
+import time
+import aiosqlite
+from database import pool
+from cache import response_cache
+from recommendations import recommender
+from auth import sessions
+from writequeue import write_queue
+from snapshot import catalog_snapshot
+from events import event_bus, latest_event_id, read_events, prune_events, EVENT_RETENTION, HEARTBEAT_SECONDS
+
+# Seconds between checks for writes made by other processes; 0 disables the watcher
+SYNC_INTERVAL = float(os.environ.get("LIBRARY_SYNC_INTERVAL", "0.25"))
+
+# ChangeCounters tags whose changes the recommender has to catch up on
+RECOMMENDER_TAGS = {"books", "loans", "reviews"}
+
+# Seconds between trims of the Events table
+EVENT_PRUNE_INTERVAL = 60.0
+
+log = logging.getLogger("library.coherence")
+
+# -------------------------------
+# Cross-Process Change Watcher
+# -------------------------------
+
+class ChangeWatcher:
+    """
+    Keeps this process's in-memory state in step with writes committed by
+    other processes: the other workers, bulk scripts, the sqlite3 shell.
+
+    Every interval it reads PRAGMA data_version on its own connection, which
+    only changes when some other connection has committed. Only then does it
+    read ChangeCounters (bumped by triggers on every table write) and, for
+    each tag whose version moved:
+      - invalidates that response cache tag,
+      - lets the recommender read the new loans/ratings/books,
+      - for "users", loads RevokedSessions so deleted users' tokens stop working.
+    Before that, the catalog snapshot (if enabled) applies the new Events.
+    It also reads the Events rows added since the last poll and publishes
+    them to this worker's /events streams, so every worker (including this
+    one) streams the same events in the same order, and sends the streams'
+    keep-alives. Writes made by this process invalidate locally right away as before;
+    the watcher seeing them again costs one extra cache miss.
+    """
+
+    def __init__(self, interval: float = SYNC_INTERVAL):
+        self.interval = interval
+        self._db: aiosqlite.Connection = None
+        self._task: asyncio.Task = None
+        self._data_version = None
+        self._versions = {}
+        self._revocations_since = 0
+        self._event_seq = 0
+        self._pruned_at = 0.0
+        self._heartbeat_at = 0.0
+        self._stats = {"polls": 0, "changes": 0, "invalidations": 0, "recommender_rows": 0, "events": 0,
+                       "snapshot_events": 0, "errors": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.running or self.interval <= 0:
+            return
+        self._db = await pool.dedicated_reader()
+        self._data_version = await self._read_data_version()
+        self._versions = await self._read_versions()
+        await self._load_revocations()
+        # Streams start from now; history before startup is not replayed
+        self._event_seq = event_bus.last_id = await latest_event_id(self._db)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        event_bus.close()
+        # The connection belongs to the pool, which closes it
+
+    async def _read_data_version(self) -> int:
+        cursor = await self._db.execute("PRAGMA data_version")
+        return (await cursor.fetchone())[0]
+
+    async def _read_versions(self) -> dict:
+        cursor = await self._db.execute("SELECT Tag, Version FROM ChangeCounters")
+        return dict(await cursor.fetchall())
+
+    async def _load_revocations(self):
+        # >= because several users can be revoked within the same second
+        cursor = await self._db.execute(
+            "SELECT UserID, RevokedBefore FROM RevokedSessions WHERE RevokedBefore >= ?",
+            (self._revocations_since,)
+        )
+        for user_id, before in await cursor.fetchall():
+            sessions.revoke_user(user_id, before)
+            self._revocations_since = max(self._revocations_since, before)
+
+    async def poll(self) -> list:
+        """One check; returns the tags that changed since the last one."""
+        self._stats["polls"] += 1
+        data_version = await self._read_data_version()
+        if data_version == self._data_version:
+            return []
+
+        # Published as read: a stream must never see the same event twice
+        for event in await read_events(self._db, self._event_seq):
+            event_bus.publish(event)
+            self._event_seq = event.id
+            self._stats["events"] += 1
+
+        # Before the cache is invalidated, so what is recomputed is not stale
+        self._stats["snapshot_events"] += await catalog_snapshot.catch_up()
+
+        versions = await self._read_versions()
+        changed = [tag for tag, version in versions.items() if self._versions.get(tag) != version]
+        if changed:
+            self._stats["changes"] += 1
+            self._stats["invalidations"] += len(changed)
+            response_cache.invalidate(*changed)
+            if "users" in changed:
+                await self._load_revocations()
+            if RECOMMENDER_TAGS.intersection(changed) and recommender.ready:
+                self._stats["recommender_rows"] += await recommender.catch_up(self._db)
+        # Only now, so a poll that fails part way is repeated in full
+        self._data_version = data_version
+        self._versions = versions
+        return changed
+
+    async def _prune_events(self):
+        cursor = await self._db.execute("SELECT IFNULL(MAX(Seq) - MIN(Seq), 0) FROM Events")
+        # Let it overshoot a little so the delete is not a tiny write every time
+        if (await cursor.fetchone())[0] > EVENT_RETENTION * 1.1:
+            await write_queue.submit(prune_events)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll()
+                if time.monotonic() - self._heartbeat_at > HEARTBEAT_SECONDS:
+                    self._heartbeat_at = time.monotonic()
+                    event_bus.heartbeat()
+                if time.monotonic() - self._pruned_at > EVENT_PRUNE_INTERVAL:
+                    self._pruned_at = time.monotonic()
+                    await self._prune_events()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # e.g. the database is briefly locked; keep watching
+                self._stats["errors"] += 1
+                log.exception("change watcher poll failed")
+
+    def stats(self) -> dict:
+        return {**self._stats, "interval": self.interval, "running": self.running, "versions": dict(self._versions),
+                "event_seq": self._event_seq}
+
+
+change_watcher = ChangeWatcher()
@@ -0,0 +1,90 @@
+import gzip
+import os
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder
+
+try:
+    import brotli
+except ImportError:  # optional: without it assets are precompressed with gzip only
+    brotli = None
+
+# Responses smaller than this are sent as they are; compressing them saves
+# less than the headers cost
+MIN_SIZE = int(os.environ.get("LIBRARY_GZIP_MIN_BYTES", "1024"))
+# On-the-fly gzip level: on JSON, 5 gets most of level 9's ratio for about a quarter of the CPU
+LEVEL = int(os.environ.get("LIBRARY_GZIP_LEVEL", "5"))
+# Share of an asset's size a precompressed encoding must save to be kept
+MIN_SAVING = 0.05
+# Content types never compressed on the fly: streams that must reach the client
+# as they are written, and formats that are compressed already
+SKIP_TYPES = ("text/event-stream", "image/")
+
+# -------------------------------
+# Encoding Helpers
+# -------------------------------
+
+def accepted_encodings(accept_encoding: str) -> set:
+    """Codings named in an Accept-Encoding header, leaving out any with q=0."""
+    accepted = set()
+    for part in (accept_encoding or "").lower().split(","):
+        coding, _, params = part.partition(";")
+        q = params.strip().removeprefix("q=")
+        if coding.strip() and q not in ("0", "0.0", "0.00", "0.000"):
+            accepted.add(coding.strip())
+    return accepted
+
+
+def gzip_bytes(body: bytes, level: int = LEVEL) -> bytes:
+    # mtime=0 so the same body always compresses to the same bytes
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+def precompress(body: bytes, media_type: str = "") -> dict:
+    """
+    Every encoding of a static asset worth sending, identity included, at the
+    highest settings: this runs once per asset, not per request. An encoding
+    that saves less than MIN_SAVING is left out, since the client would spend
+    longer decoding it than the bytes take to send. SKIP_TYPES are not tried
+    at all: gzip saves under 1% on a JPEG and takes most of the startup build.
+    """
+    encodings = {"identity": body}
+    if media_type.startswith(SKIP_TYPES):
+        return encodings
+    candidates = {"gzip": gzip_bytes(body, level=9)}
+    if brotli is not None:
+        candidates["br"] = brotli.compress(body, quality=11)
+    for coding, encoded in candidates.items():
+        if len(encoded) <= len(body) * (1 - MIN_SAVING):
+            encodings[coding] = encoded
+    return encodings
+
+# -------------------------------
+# ASGI Middleware
+# -------------------------------
+
+class _Responder(GZipResponder):
+    async def send_with_gzip(self, message):
+        await super().send_with_gzip(message)
+        if message["type"] == "http.response.start":
+            # Pass SKIP_TYPES through the same way as responses already encoded
+            content_type = Headers(raw=message["headers"]).get("content-type", "")
+            if content_type.startswith(SKIP_TYPES):
+                self.content_encoding_set = True
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Gzips responses of at least MIN_SIZE bytes for clients that accept it, as
+    Starlette's GZipMiddleware does, except SKIP_TYPES and responses that
+    already carry a Content-Encoding (precompressed assets, cached bodies).
+    """
+
+    def __init__(self, app, minimum_size: int = MIN_SIZE, compresslevel: int = LEVEL):
+        super().__init__(app, minimum_size=minimum_size, compresslevel=compresslevel)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and "gzip" in accepted_encodings(Headers(scope=scope).get("accept-encoding")):
+            responder = _Responder(self.app, self.minimum_size, compresslevel=self.compresslevel)
+            await responder(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
@@ -0,0 +1,226 @@
+import asyncio
+import os
+import random
+import sqlite3
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+import aiosqlite
+from metrics import TimedConnection, db_pool_wait
+
+DATABASE = os.environ.get("LIBRARY_DATABASE", "Library.db")
+
+# Number of read-only connections kept open next to the single writer
+READER_COUNT = int(os.environ.get("LIBRARY_READERS", "4"))
+
+# Applied to every pooled connection when it is opened
+CONNECTION_PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",      # ~16 MB page cache
+    "PRAGMA mmap_size = 268435456",    # 256 MB memory map
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+]
+
+# Retries for a write transaction that hits SQLITE_BUSY, with exponential backoff
+TRANSACTION_RETRIES = 5
+TRANSACTION_BACKOFF = 0.01  # seconds, doubled after each attempt
+
+# -------------------------------
+# Connection Pool
+# -------------------------------
+
+class ConnectionPool:
+    """
+    Long-lived aiosqlite connections shared by all requests.
+    Keeps a fixed set of reader connections and one writer connection.
+    SQLite only allows one writer at a time, so writers queue on a lock
+    instead of colliding on the database file. Readers are handed out first
+    come, first served: a released reader goes straight to the longest
+    waiting request, so a busy task cannot keep re-taking it.
+    """
+
+    def __init__(self, database: str = DATABASE, readers: int = READER_COUNT):
+        self.database = database
+        self.reader_count = readers
+        self._idle = deque()
+        self._waiters = deque()
+        self._writer: aiosqlite.Connection = None
+        self._writer_lock: asyncio.Lock = None
+        self._all = []
+        self._stats = {
+            "reader": {"checkouts": 0, "wait_total": 0.0, "wait_max": 0.0},
+            "writer": {"checkouts": 0, "wait_total": 0.0, "wait_max": 0.0},
+        }
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self, read_only: bool) -> aiosqlite.Connection:
+        db = await aiosqlite.connect(self.database, factory=TimedConnection)
+        for pragma in CONNECTION_PRAGMAS:
+            await db.execute(pragma)
+        if read_only:
+            await db.execute("PRAGMA query_only = ON")
+        self._all.append(db)
+        return db
+
+    async def open(self):
+        if self.is_open:
+            return
+        self._writer_lock = asyncio.Lock()
+        # Open the writer first so WAL mode is set before readers attach
+        self._writer = await self._connect(read_only=False)
+        # Each connection has its own thread, so the readers can open side by side
+        self._idle.extend(await asyncio.gather(*(self._connect(read_only=True) for _ in range(self.reader_count))))
+
+    async def warm_up(self):
+        """Have every connection parse the schema now rather than in the first request it serves."""
+        await asyncio.gather(*(db.execute_fetchall("SELECT COUNT(*) FROM sqlite_master") for db in self._all))
+
+    async def dedicated_reader(self) -> aiosqlite.Connection:
+        """A read-only connection outside the pool for a background task; closed with the pool."""
+        return await self._connect(read_only=True)
+
+    async def close(self):
+        for db in self._all:
+            await db.close()
+        self._all = []
+        self._idle.clear()
+        self._waiters.clear()
+        self._writer = None
+        self._writer_lock = None
+
+    def _record(self, kind: str, waited: float):
+        stats = self._stats[kind]
+        stats["checkouts"] += 1
+        stats["wait_total"] += waited
+        stats["wait_max"] = max(stats["wait_max"], waited)
+        db_pool_wait.observe((kind,), waited)
+
+    async def acquire_reader(self) -> aiosqlite.Connection:
+        start = time.perf_counter()
+        if self._idle and not self._waiters:
+            db = self._idle.popleft()
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                db = await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # Handed a connection just as we were cancelled: pass it on
+                    self.release_reader(waiter.result())
+                elif waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                raise
+        self._record("reader", time.perf_counter() - start)
+        return db
+
+    def release_reader(self, db: aiosqlite.Connection):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(db)
+                return
+        self._idle.append(db)
+
+    async def acquire_writer(self) -> aiosqlite.Connection:
+        start = time.perf_counter()
+        await self._writer_lock.acquire()
+        self._record("writer", time.perf_counter() - start)
+        return self._writer
+
+    async def release_writer(self, db: aiosqlite.Connection):
+        try:
+            # Never hand the next request a half-finished transaction
+            if db.in_transaction:
+                await db.rollback()
+        finally:
+            self._writer_lock.release()
+
+    @asynccontextmanager
+    async def reader(self):
+        db = await self.acquire_reader()
+        try:
+            yield db
+        finally:
+            self.release_reader(db)
+
+    @asynccontextmanager
+    async def writer(self):
+        db = await self.acquire_writer()
+        try:
+            yield db
+        finally:
+            await self.release_writer(db)
+
+    def stats(self) -> dict:
+        result = {}
+        for kind, stats in self._stats.items():
+            checkouts = stats["checkouts"]
+            result[kind] = {
+                "checkouts": checkouts,
+                "wait_total_ms": round(stats["wait_total"] * 1000, 3),
+                "wait_avg_ms": round(stats["wait_total"] * 1000 / checkouts, 3) if checkouts else 0.0,
+                "wait_max_ms": round(stats["wait_max"] * 1000, 3),
+            }
+        result["readers"] = {
+            "size": self.reader_count,
+            "idle": len(self._idle),
+            "waiting": len(self._waiters),
+        }
+        result["writer"]["busy"] = bool(self._writer_lock and self._writer_lock.locked())
+        return result
+
+
+pool = ConnectionPool()
+
+# -------------------------------
+# FastAPI Dependencies
+# -------------------------------
+
+async def get_db():
+    """Read-only connection for endpoints that only run SELECTs."""
+    async with pool.reader() as db:
+        yield db
+
+
+async def get_write_db():
+    """The writer connection, held exclusively for the whole request."""
+    async with pool.writer() as db:
+        yield db
+
+# -------------------------------
+# Transactions
+# -------------------------------
+
+def is_busy_error(error: Exception) -> bool:
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in message or "busy" in message)
+
+
+async def run_transaction(db: aiosqlite.Connection, work, retries: int = TRANSACTION_RETRIES):
+    """
+    Run `await work(db)` inside one BEGIN IMMEDIATE transaction and commit it.
+    The write lock is taken up front, so the reads in `work` cannot go stale
+    before its writes. If the database stays locked past busy_timeout the
+    whole transaction is retried with jittered exponential backoff; any other
+    exception (including HTTPException) rolls back and propagates.
+    """
+    delay = TRANSACTION_BACKOFF
+    for attempt in range(retries + 1):
+        try:
+            await db.execute("BEGIN IMMEDIATE")
+            result = await work(db)
+            await db.commit()
+            return result
+        except Exception as e:
+            if db.in_transaction:
+                await db.rollback()
+            if not is_busy_error(e) or attempt == retries:
+                raise
+        await asyncio.sleep(delay * (0.5 + random.random()))
+        delay *= 2
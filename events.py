@@ -0,0 +1,218 @@
+import asyncio
+import os
+import sqlite3
+from collections import deque
+from typing import NamedTuple, Optional
+import aiosqlite
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+# Undelivered events a client may fall behind by before it is disconnected
+EVENT_BUFFER = int(os.environ.get("LIBRARY_EVENT_BUFFER", "256"))
+# Open streams per worker; more are refused with 503
+MAX_SUBSCRIBERS = int(os.environ.get("LIBRARY_EVENT_MAX_CLIENTS", "10000"))
+# Recent events kept in memory so a reconnecting client (Last-Event-ID) can catch up
+EVENT_HISTORY = 1000
+# Seconds between keep-alive comments on idle streams
+HEARTBEAT_SECONDS = 15.0
+KEEP_ALIVE = b": keep-alive\n\n"
+# How long a disconnected EventSource waits before reconnecting
+RETRY_MS = 2000
+# Rows kept in the Events table; older ones are pruned by the change watcher
+EVENT_RETENTION = 10_000
+# Events after a sequence number, in order: the tail every worker and stream reads
+EVENTS_AFTER = "SELECT Seq, Type, Data FROM Events WHERE Seq > ? ORDER BY Seq"
+
+router = APIRouter(tags=["Events"])
+
+# -------------------------------
+# Event Bus
+# -------------------------------
+
+class Event(NamedTuple):
+    id: int
+    type: str
+    # The encoded SSE message, built once and shared by every subscriber
+    frame: bytes
+
+
+def encode_event(seq: int, type: str, data: str) -> Event:
+    return Event(seq, type, f"id: {seq}\nevent: {type}\ndata: {data}\n\n".encode())
+
+
+class Subscriber:
+    """One open stream: a bounded buffer of frames and a flag to wake its writer."""
+    __slots__ = ("since", "dropped", "_buffer", "_limit", "_ready")
+
+    def __init__(self, limit: int, since: int):
+        self.since = since
+        self.dropped = False
+        self._buffer = deque()
+        self._limit = limit
+        self._ready = asyncio.Event()
+
+    def push(self, frame: bytes) -> bool:
+        if len(self._buffer) >= self._limit:
+            return False
+        self._buffer.append(frame)
+        self._ready.set()
+        return True
+
+    def close(self):
+        self.dropped = True
+        self._buffer.clear()
+        self._ready.set()
+
+    async def wait(self) -> bytes:
+        """Everything buffered, once there is something."""
+        if not self._buffer and not self.dropped:
+            await self._ready.wait()
+        self._ready.clear()
+        frames = b"".join(self._buffer)
+        self._buffer.clear()
+        return frames
+
+
+class EventBus:
+    """
+    In-process fan-out of change events to /events streams.
+
+    Events come from the Events table (written by triggers in the same
+    transaction as the change) via coherence.ChangeWatcher, so a stream sees
+    writes made by every worker, not just its own. publish() never blocks:
+    each subscriber has a buffer of at most EVENT_BUFFER frames, and one that
+    is full (a client not reading fast enough) is dropped instead of holding
+    up the others or growing without bound. Its browser reconnects with
+    Last-Event-ID and is replayed from the recent history, or sent a reset
+    event telling it to refetch if it fell too far behind. An idle stream
+    costs one small object and one parked coroutine, with no timer of its
+    own: heartbeat() writes the keep-alive to every idle stream at once.
+    """
+
+    def __init__(self, buffer: int = EVENT_BUFFER, history: int = EVENT_HISTORY,
+                 max_subscribers: int = MAX_SUBSCRIBERS):
+        self.buffer = buffer
+        self.max_subscribers = max_subscribers
+        self.last_id = 0
+        self._history = deque(maxlen=history)
+        self._subscribers = set()
+        self._stats = {"published": 0, "delivered": 0, "dropped": 0, "rejected": 0, "replayed": 0, "resets": 0}
+
+    def check_capacity(self):
+        if len(self._subscribers) >= self.max_subscribers:
+            self._stats["rejected"] += 1
+            raise HTTPException(status_code=503, detail="Too many event streams",
+                                headers={"Retry-After": str(RETRY_MS // 1000)})
+
+    def subscribe(self, last_event_id: Optional[int] = None) -> Subscriber:
+        subscriber = Subscriber(self.buffer, self.last_id)
+        if last_event_id is not None and last_event_id < self.last_id:
+            oldest = self._history[0].id if self._history else self.last_id + 1
+            if last_event_id + 1 >= oldest:
+                # Replay is not subject to the live buffer limit; history is bounded anyway
+                missed = [event.frame for event in self._history if event.id > last_event_id]
+                subscriber._buffer.extend(missed)
+                self._stats["replayed"] += len(missed)
+            else:
+                subscriber._buffer.append(self._reset_frame())
+                self._stats["resets"] += 1
+        elif last_event_id is not None:
+            # Ahead of this worker (it came from one that polled sooner): skip what it has seen
+            subscriber.since = last_event_id
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+
+    def publish(self, event: Event):
+        self.last_id = max(self.last_id, event.id)
+        self._history.append(event)
+        self._stats["published"] += 1
+        for subscriber in list(self._subscribers):
+            if event.id <= subscriber.since:
+                continue
+            if subscriber.push(event.frame):
+                self._stats["delivered"] += 1
+            else:
+                self._stats["dropped"] += 1
+                self._subscribers.discard(subscriber)
+                subscriber.close()
+
+    def heartbeat(self):
+        """A comment line on every idle stream, so proxies do not time it out."""
+        for subscriber in self._subscribers:
+            if not subscriber._buffer:
+                subscriber.push(KEEP_ALIVE)
+
+    def close(self):
+        """
+        End every stream. uvicorn waits for open responses before it shuts
+        down, so serve.py calls this as soon as the exit signal arrives.
+        """
+        for subscriber in self._subscribers:
+            subscriber.close()
+        self._subscribers.clear()
+
+    def _reset_frame(self) -> bytes:
+        # Carries the current id so the client's next reconnect resumes from here
+        return f"id: {self.last_id}\nevent: reset\ndata: {{}}\n\n".encode()
+
+    async def stream(self, last_event_id: Optional[int] = None):
+        """SSE body for one client. Subscribes on first iteration, so a response never sent never subscribes."""
+        subscriber = self.subscribe(last_event_id)
+        try:
+            yield f"retry: {RETRY_MS}\n\n".encode()
+            while not subscriber.dropped:
+                frames = await subscriber.wait()
+                if subscriber.dropped:
+                    break
+                yield frames
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self) -> dict:
+        return {**self._stats, "subscribers": len(self._subscribers), "last_id": self.last_id,
+                "history": len(self._history)}
+
+
+event_bus = EventBus()
+
+
+async def latest_event_id(db: aiosqlite.Connection) -> int:
+    cursor = await db.execute("SELECT IFNULL(MAX(Seq), 0) FROM Events")
+    return (await cursor.fetchone())[0]
+
+
+async def read_events(db: aiosqlite.Connection, after: int) -> list:
+    cursor = await db.execute(EVENTS_AFTER, (after,))
+    return [encode_event(*row) for row in await cursor.fetchall()]
+
+
+def prune_events(conn: sqlite3.Connection, keep: int = EVENT_RETENTION):
+    """Write-queue operation dropping all but the newest `keep` events."""
+    conn.execute("DELETE FROM Events WHERE Seq <= (SELECT MAX(Seq) FROM Events) - ?", (keep,))
+
+# -------------------------------
+# Endpoint
+# -------------------------------
+
+@router.get("/events")
+async def get_events(request: Request, last_event_id: Optional[int] = None):
+    """
+    Server-Sent Events stream of catalog, availability and review changes:
+    book_added, book_updated, book_removed, books_imported, loan_opened,
+    loan_closed, loan_overdue, hold_ready and hold_released (a book set
+    aside for a hold, or back on the shelf; both carry "available"),
+    review_added, review_deleted, and reset (refetch everything).
+    Each data line is a small JSON object; ids resume via Last-Event-ID.
+    """
+    header = request.headers.get("last-event-id")
+    if header is not None and header.isdigit():
+        last_event_id = int(header)
+    event_bus.check_capacity()
+    return StreamingResponse(
+        event_bus.stream(last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import time
+from writequeue import write_queue
+from cache import response_cache
+
+# Days a patron has to borrow a book once it is set aside for them
+HOLD_PICKUP_DAYS = int(os.environ.get("LIBRARY_HOLD_PICKUP_DAYS", "3"))
+# Seconds between sweeps for holds whose pickup deadline has passed; 0 disables the sweeper
+HOLD_SWEEP_INTERVAL = float(os.environ.get("LIBRARY_HOLD_SWEEP_INTERVAL", "60"))
+# Expired holds handled per write-queue operation, and operations per sweep
+HOLD_SWEEP_BATCH = 200
+HOLD_SWEEP_MAX_BATCHES = 10
+# Pause between batches
+HOLD_SWEEP_PAUSE = 0.05
+# Open (waiting or ready) holds one patron may have at once
+MAX_OPEN_HOLDS = 20
+
+# A ready hold takes the book off the shelf as a loan does: availability is
+# "no active loan and no ready hold", one probe of each partial unique index
+READY_HOLD_JOIN = "LEFT JOIN Holds X ON X.BookID = B.BookID AND X.Status = 'ready'"
+UNAVAILABLE_COLUMN = "IFNULL(H.HistoryID, X.HoldID)"
+
+# Head of a book's queue, a hold's place in it, and ready holds past their deadline
+QUEUE_HEAD = """
+    SELECT HoldID, UserID FROM Holds
+    WHERE BookID = ? AND Status = 'waiting'
+    ORDER BY HoldID LIMIT 1
+"""
+QUEUE_POSITION = """
+    SELECT COUNT(*) FROM Holds
+    WHERE BookID = ? AND Status = 'waiting' AND HoldID <= ?
+"""
+EXPIRED_HOLDS = """
+    SELECT HoldID, BookID FROM Holds
+    WHERE Status = 'ready' AND PickupBy < datetime('now')
+    ORDER BY PickupBy LIMIT ?
+"""
+
+log = logging.getLogger("library.holds")
+
+# -------------------------------
+# Hold Queue
+# -------------------------------
+# Each book's waiting holds form a FIFO queue in HoldID order, kept by the
+# partial index idx_holds_queue, so the head of a queue is one index seek
+# and a patron's position is a count over the index range in front of them.
+
+def queue_position(conn: sqlite3.Connection, book_id: int, hold_id: int) -> int:
+    """1-based place of a waiting hold in its book's queue."""
+    return conn.execute(QUEUE_POSITION, (book_id, hold_id)).fetchone()[0]
+
+
+def hand_on(conn: sqlite3.Connection, book_id: int, pickup_days: int = HOLD_PICKUP_DAYS):
+    """
+    Set a just-freed book aside for the first patron waiting for it, inside
+    the caller's transaction. Returns the (HoldID, UserID) that became ready,
+    or None if nobody is waiting.
+    """
+    head = conn.execute(QUEUE_HEAD, (book_id,)).fetchone()
+    if head is None:
+        return None
+    conn.execute("""
+        UPDATE Holds SET Status = 'ready', ReadyAt = datetime('now'), PickupBy = datetime('now', ?)
+        WHERE HoldID = ?
+    """, (f"+{pickup_days} days", head[0]))
+    return head
+
+
+def expire_batch(conn: sqlite3.Connection, limit: int = HOLD_SWEEP_BATCH) -> int:
+    """
+    Write-queue operation: expire up to `limit` ready holds past their pickup
+    deadline and hand each book on to the next patron in its queue.
+    """
+    rows = conn.execute(EXPIRED_HOLDS, (limit,)).fetchall()
+    for hold_id, book_id in rows:
+        conn.execute("UPDATE Holds SET Status = 'expired', ClosedAt = datetime('now') WHERE HoldID = ?",
+                     (hold_id,))
+        hand_on(conn, book_id)
+    return len(rows)
+
+# -------------------------------
+# Expiry Sweeper
+# -------------------------------
+
+class HoldSweeper:
+    """
+    Background task expiring holds nobody picked up in time. Ready holds are
+    kept ordered by deadline by idx_holds_pickup, so a sweep reads only the
+    ones that are due, at most max_batches batches of batch_rows. Each batch
+    expires its holds and readies the next ones in one write-queue operation,
+    so with several workers a hold is still expired, and handed on, once.
+    """
+
+    def __init__(self, interval: float = HOLD_SWEEP_INTERVAL, batch_rows: int = HOLD_SWEEP_BATCH,
+                 max_batches: int = HOLD_SWEEP_MAX_BATCHES):
+        self.interval = interval
+        self.batch_rows = batch_rows
+        self.max_batches = max_batches
+        self._task: asyncio.Task = None
+        self._stats = {"runs": 0, "expired": 0, "batches": 0, "errors": 0, "backlog": False,
+                       "last_run": None, "last_seconds": None}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running or self.interval <= 0:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def run_once(self) -> int:
+        """One bounded sweep. Returns the number of holds expired."""
+        started = time.perf_counter()
+        expired = 0
+        for batch in range(self.max_batches):
+            if batch:
+                await asyncio.sleep(HOLD_SWEEP_PAUSE)
+            count = await write_queue.submit(lambda conn: expire_batch(conn, self.batch_rows))
+            expired += count
+            self._stats["batches"] += 1
+            if count < self.batch_rows:
+                break
+        if expired:
+            # Books handed on or back on the shelf; other workers hear of it through ChangeCounters
+            response_cache.invalidate("loans")
+        self._stats["backlog"] = count == self.batch_rows
+        self._stats["expired"] += expired
+        self._stats["runs"] += 1
+        self._stats["last_run"] = time.time()
+        self._stats["last_seconds"] = round(time.perf_counter() - started, 3)
+        return expired
+
+    async def _run(self):
+        # Random offset so workers do not all sweep at the same moment
+        await asyncio.sleep(random.uniform(0.5, 1.0) * min(self.interval, 10))
+        while True:
+            try:
+                expired = await self.run_once()
+                if expired:
+                    log.info("%d holds expired", expired)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._stats["errors"] += 1
+                log.exception("hold sweep failed")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {**self._stats, "interval": self.interval, "running": self.running}
+
+
+hold_sweeper = HoldSweeper()
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+log = logging.getLogger("library.startup")
+
+# A background phase retried after failing waits this long first, doubled after each failure up to the max
+BACKGROUND_RETRY_DELAY = 1.0
+BACKGROUND_RETRY_MAX = 60.0
+
+# -------------------------------
+# Startup Phases
+# -------------------------------
+
+class Lifecycle:
+    """
+    Startup as a sequence of named, timed phases. The foreground phases run
+    before the worker reports ready. Builds that requests can do without
+    for a while (the recommender, the catalog snapshot) run as background
+    phases after that, while traffic is already being served.
+
+    `state` goes starting -> ready -> stopping. /health/live answers as soon
+    as the process does; /health/ready only while the state is "ready", so
+    a load balancer can tell a worker that is still starting or draining
+    from one that has died.
+    """
+
+    def __init__(self):
+        self.state = "starting"
+        self._phases = {}
+        self._tasks = {}
+        self._started = None
+        self._stats = {"starts": 0, "ready_seconds": None, "background_failures": 0}
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def begin(self):
+        self.state = "starting"
+        self._phases = {}
+        self._tasks = {}
+        self._started = time.perf_counter()
+        self._stats["starts"] += 1
+
+    @asynccontextmanager
+    async def phase(self, name: str, background: bool = False):
+        """Time the block as phase `name`; one that raises is recorded as failed."""
+        record = self._phases[name] = {"status": "running", "background": background, "seconds": None}
+        started = time.perf_counter()
+        try:
+            yield
+            record["status"] = "done"
+        except asyncio.CancelledError:
+            record["status"] = "cancelled"
+            raise
+        finally:
+            record["seconds"] = round(time.perf_counter() - started, 3)
+            if record["status"] == "running":
+                record["status"] = "failed"
+            log.info("startup phase %s %s in %.3fs", name, record["status"], record["seconds"])
+
+    def background(self, name: str, work, retry: bool = False):
+        """
+        Run `await work()` as a background phase. A failure is logged, not
+        raised: the app keeps serving. With `retry`, a failed phase runs
+        again after a backoff until it succeeds, so work() must be safe to
+        repeat; until then it is listed as failed by stats().
+        """
+        async def run():
+            delay = BACKGROUND_RETRY_DELAY
+            while True:
+                try:
+                    async with self.phase(name, background=True):
+                        await work()
+                    return
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    self._stats["background_failures"] += 1
+                    log.exception("background phase %s failed%s", name,
+                                  f", retrying in {delay:.0f}s" if retry else "")
+                if not retry:
+                    return
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, BACKGROUND_RETRY_MAX)
+
+        self._tasks[name] = asyncio.create_task(run())
+
+    def mark_ready(self):
+        self.state = "ready"
+        self._stats["ready_seconds"] = round(time.perf_counter() - self._started, 3)
+        log.info("ready in %.3fs (%s)", self._stats["ready_seconds"],
+                 ", ".join(f"{name} {phase['seconds']:.3f}s" for name, phase in self._phases.items()))
+
+    async def wait_background(self):
+        """Until every background phase has finished, e.g. for a benchmark that needs them all."""
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def stop(self):
+        """Stop reporting ready and cancel background phases still running."""
+        self.state = "stopping"
+        for task in self._tasks.values():
+            task.cancel()
+        await self.wait_background()
+        self._tasks = {}
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "state": self.state,
+            "phases": self._phases,
+            "background_pending": sorted(name for name, task in self._tasks.items() if not task.done()),
+            "background_failed": sorted(name for name, phase in self._phases.items()
+                                        if phase["background"] and phase["status"] == "failed"),
+        }
+
+
+lifecycle = Lifecycle()
@@ -0,0 +1,352 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from functools import lru_cache
+
+# Statements slower than this (execute + fetch, in ms) are logged with their query plan
+SLOW_QUERY_MS = float(os.environ.get("LIBRARY_SLOW_QUERY_MS", "100"))
+# Recent slow statements kept for /admin/slow_queries/
+SLOW_QUERY_HISTORY = 100
+# A statement's plan is captured again once its cached plan is this old
+SLOW_QUERY_PLAN_TTL = 600.0
+# Distinct statements with their own histogram series; the rest are counted under "other"
+MAX_STATEMENT_SERIES = int(os.environ.get("LIBRARY_METRICS_MAX_STATEMENTS", "64"))
+# Statement labels longer than this become a prefix plus a short hash of the whole statement
+STATEMENT_LABEL_CHARS = 80
+
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+# Coarser, since every statement has a series of its own
+STATEMENT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.025, 0.1, 0.5)
+
+slow_query_log = logging.getLogger("library.slow_query")
+
+# -------------------------------
+# Histograms
+# -------------------------------
+
+class Histogram:
+    """
+    Prometheus-style histogram keyed by a tuple of label values.
+    observe() is a bisect and three additions under an uncontended lock, so it
+    is cheap enough to call for every request and every SQL statement. It is
+    also called from the aiosqlite and write-queue threads, hence the lock.
+
+    With `max_keys`, at most that many distinct values of the first label
+    get series of their own; later ones are observed as "other".
+    """
+
+    def __init__(self, name: str, help: str, labels: tuple, buckets: tuple, max_keys: int = None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.max_keys = max_keys
+        self._series = {}
+        self._keys = set()
+        self._lock = threading.Lock()
+
+    def observe(self, label_values: tuple, seconds: float):
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None and self.max_keys is not None and label_values[0] not in self._keys:
+                if len(self._keys) < self.max_keys:
+                    self._keys.add(label_values[0])
+                else:
+                    label_values = ("other",) + label_values[1:]
+                    series = self._series.get(label_values)
+            if series is None:
+                # One slot per bucket, one for +Inf, then the running sum
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += seconds
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+            self._keys.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {labels: list(series) for labels, series in self._series.items()}
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, series in sorted(self.snapshot().items()):
+            labels = _labels(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            cumulative += series[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in pairs)
+
+
+http_requests = Histogram(
+    "library_http_request_duration_seconds",
+    "HTTP request latency by method, route template and status.",
+    ("method", "route", "status"), REQUEST_BUCKETS,
+)
+db_statements = Histogram(
+    "library_db_statement_duration_seconds",
+    "SQLite execute time per normalized statement (fetching rows is left to the slow-query log).",
+    ("statement",), STATEMENT_BUCKETS, max_keys=MAX_STATEMENT_SERIES,
+)
+db_pool_wait = Histogram(
+    "library_db_pool_wait_seconds",
+    "Time spent waiting to check out a pooled connection.",
+    ("kind",), QUERY_BUCKETS,
+)
+
+# Callables returning {metric name: (type, help, value or {label pairs: value})},
+# read at scrape time so components only need to keep their own stats
+_collectors = []
+
+
+def register_collector(collector):
+    _collectors.append(collector)
+
+
+def render() -> str:
+    """Everything in the Prometheus text exposition format."""
+    lines = []
+    for histogram in (http_requests, db_statements, db_pool_wait):
+        lines += histogram.render()
+    lines += [f"# HELP library_db_slow_statements_total Statements slower than {SLOW_QUERY_MS} ms.",
+              "# TYPE library_db_slow_statements_total counter",
+              f"library_db_slow_statements_total {slow_queries.total}"]
+    for collector in _collectors:
+        for name, (kind, help, value) in collector().items():
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+            if isinstance(value, dict):
+                for label_pairs, sample in value.items():
+                    lines.append(f"{name}{{{_labels(label_pairs)}}} {sample}")
+            else:
+                lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+# -------------------------------
+# SQL Statement Timing
+# -------------------------------
+
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_SPACE = re.compile(r"\s+")
+
+@lru_cache(maxsize=2048)
+def normalize_sql(sql: str) -> str:
+    """One label per statement shape: literals become ?, IN (?, ?, ...) becomes IN (...)."""
+    sql = _SPACE.sub(" ", sql).strip()
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    return _IN_LIST.sub("IN (...)", sql)
+
+
+# Schema changes, pragmas and transaction control: not worth a series each
+_UNTIMED = ("CREATE", "DROP", "ALTER", "PRAGMA", "BEGIN", "COMMIT", "END", "ROLLBACK", "SAVEPOINT", "RELEASE",
+            "VACUUM", "ANALYZE", "REINDEX")
+
+@lru_cache(maxsize=2048)
+def statement_label(statement: str):
+    """The db_statements label of a normalized statement, or None if it is not recorded there."""
+    if statement[:9].upper().startswith(_UNTIMED):
+        return None
+    if len(statement) <= STATEMENT_LABEL_CHARS:
+        return statement
+    digest = hashlib.blake2b(statement.encode(), digest_size=4).hexdigest()
+    return f"{statement[:STATEMENT_LABEL_CHARS]}... #{digest}"
+
+
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS, history: int = SLOW_QUERY_HISTORY):
+        self.threshold = threshold_ms / 1000
+        self.recent = deque(maxlen=history)
+        self.total = 0
+        self._plans = {}
+
+    def plan(self, conn: sqlite3.Connection, statement: str, sql: str, parameters) -> list:
+        """EXPLAIN QUERY PLAN for the statement, captured at most once per TTL per statement shape."""
+        cached = self._plans.get(statement)
+        if cached and time.monotonic() - cached[0] < SLOW_QUERY_PLAN_TTL:
+            return cached[1]
+        plan = []
+        if not parameters:
+            # executemany: plan it with NULLs, the shape is what matters
+            parameters = [None] * sql.count("?")
+        if sql.lstrip()[:7].upper().startswith(_EXPLAINABLE):
+            try:
+                rows = sqlite3.Connection.execute(conn, f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+                plan = [row[-1] for row in rows]
+            except sqlite3.Error as e:
+                plan = [f"(plan unavailable: {e})"]
+        self._plans[statement] = (time.monotonic(), plan)
+        return plan
+
+    def record(self, conn: sqlite3.Connection, statement: str, sql: str, parameters, seconds: float):
+        self.total += 1
+        plan = self.plan(conn, statement, sql, parameters)
+        entry = {
+            "statement": statement,
+            "ms": round(seconds * 1000, 3),
+            "plan": plan,
+            "at": time.time(),
+        }
+        self.recent.append(entry)
+        slow_query_log.warning("slow statement (%.1f ms): %s | plan: %s",
+                               seconds * 1000, statement, "; ".join(plan) or "-")
+
+
+slow_queries = SlowQueryLog()
+
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    Times execute against the normalized statement text. Fetches only count
+    towards the slow-query log, as do DDL, pragmas and transaction control.
+    """
+
+    _statement = None
+    _label = None
+    _sql = None
+    _parameters = ()
+    _elapsed = 0.0
+    _logged = False
+
+    def _observe(self, phase: str, seconds: float):
+        if phase == "execute" and self._label is not None:
+            db_statements.observe((self._label,), seconds)
+        self._elapsed += seconds
+        if not self._logged and self._elapsed >= slow_queries.threshold:
+            self._logged = True
+            slow_queries.record(self.connection, self._statement, self._sql, self._parameters, self._elapsed)
+
+    def _start(self, sql: str, parameters):
+        self._statement = normalize_sql(sql)
+        self._label = statement_label(self._statement)
+        self._sql = sql
+        self._parameters = parameters
+        self._elapsed = 0.0
+        self._logged = False
+
+    def execute(self, sql, parameters=()):
+        self._start(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._observe("execute", time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        # The parameters are an iterator consumed by the call
+        self._start(sql, ())
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._observe("execute", time.perf_counter() - started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self._observe("fetch", time.perf_counter() - started)
+
+    def fetchmany(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(*args, **kwargs)
+        finally:
+            self._observe("fetch", time.perf_counter() - started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._observe("fetch", time.perf_counter() - started)
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    sqlite3 connection factory whose execute/executemany go through TimedCursor.
+    Used for the pooled aiosqlite connections (aiosqlite calls these methods on
+    its worker thread, so only SQLite time is measured, not queueing) and for
+    the write queue's connection.
+    """
+
+    def execute(self, sql, parameters=()):
+        return self.cursor(TimedCursor).execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor(TimedCursor).executemany(sql, seq_of_parameters)
+
+# -------------------------------
+# ASGI Middleware
+# -------------------------------
+
+class MetricsMiddleware:
+    """
+    Records every HTTP request in http_requests, labelled with the matched
+    route template (e.g. /reviews/{book_id}) rather than the raw path, so
+    label cardinality stays bounded. Add it last so it is outermost and also
+    times responses served by the other middleware.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests.observe(
+                (scope["method"], self._route(scope), status),
+                time.perf_counter() - started
+            )
+
+    def _route(self, scope) -> str:
+        route = scope.get("route")
+        if route is not None:
+            return route.path
+        # Answered before routing (cache hit, CORS preflight): match it ourselves
+        app = scope.get("app")
+        for candidate in getattr(app, "routes", ()):
+            match = getattr(candidate, "path_regex", None)
+            if match is not None and match.match(scope["path"]):
+                return candidate.path
+        return "unmatched"
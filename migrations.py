@@ -0,0 +1,509 @@
+import asyncio
+import sys
+import aiosqlite
+from database import DATABASE
+
+# -------------------------------
+# Schema Migrations
+# -------------------------------
+# Each migration is (version, description, statements). They run in order
+# at startup and the last applied version is stored in PRAGMA user_version.
+# Statements must be safe to run twice (IF NOT EXISTS etc.) so a migration
+# interrupted before its version was recorded can simply be re-applied.
+
+def _change_counter_triggers(table: str, tag: str) -> list:
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS trg_{table.lower()}_changed_{event.lower()} AFTER {event} ON {table} BEGIN
+               UPDATE ChangeCounters SET Version = Version + 1 WHERE Tag = '{tag}';
+           END"""
+        for event in ("INSERT", "UPDATE", "DELETE")
+    ]
+
+
+# Bayesian average of a BookRatings row: its ratings plus Weight phantom ratings at the prior Mean
+BAYESIAN_SCORE = "((SELECT Weight * Mean FROM RatingPrior) + RatingSum) / ((SELECT Weight FROM RatingPrior) + RatingCount)"
+
+
+def _rating_aggregate_sql(ref: str, adding: bool) -> str:
+    """Trigger body adding (or removing) the rating row `ref` (new/old) to its book's BookRatings row."""
+    op = "+" if adding else "-"
+    stars = ", ".join(f"Stars{k} = Stars{k} {op} (ROUND({ref}.Rating) = {k})" for k in range(6))
+    statements = []
+    if adding:
+        statements.append(f"""INSERT OR IGNORE INTO BookRatings (BookID, Genre)
+               SELECT BookID, Genre FROM Books WHERE BookID = {ref}.BookID;""")
+    statements.append(f"""UPDATE BookRatings
+               SET RatingCount = RatingCount {op} 1, RatingSum = RatingSum {op} {ref}.Rating,
+                   {stars}
+               WHERE BookID = {ref}.BookID;""")
+    statements.append(f"UPDATE BookRatings SET Score = {BAYESIAN_SCORE} WHERE BookID = {ref}.BookID;")
+    if not adding:
+        # Unrated books have no row, so /books/top-rated never has to skip them
+        statements.append(f"DELETE FROM BookRatings WHERE BookID = {ref}.BookID AND RatingCount <= 0;")
+    return "\n               ".join(statements)
+
+
+# Recomputes every BookRatings row and the prior mean from Ratings (also run by POST /admin/ratings/rebuild)
+REBUILD_BOOK_RATINGS = [
+    "UPDATE RatingPrior SET Mean = IFNULL((SELECT AVG(Rating) FROM Ratings), Mean)",
+    "DELETE FROM BookRatings",
+    f"""INSERT INTO BookRatings (BookID, Genre, RatingCount, RatingSum, {", ".join(f"Stars{k}" for k in range(6))})
+        SELECT R.BookID, B.Genre, COUNT(*), SUM(R.Rating),
+               {", ".join(f"SUM(ROUND(R.Rating) = {k})" for k in range(6))}
+        FROM Ratings R
+        JOIN Books B ON B.BookID = R.BookID
+        WHERE R.Rating IS NOT NULL
+        GROUP BY R.BookID""",
+    f"UPDATE BookRatings SET Score = {BAYESIAN_SCORE}",
+]
+
+
+# BookFacets keys (Scope, Facet, Value) for one book row `{b}`: whole-catalog
+# ('*') counts by genre, author and decade, and per-genre counts by author and decade
+FACET_KEYS = [
+    ("'*'", "'genre'", "{b}.Genre"),
+    ("'*'", "'author'", "{b}.Author"),
+    ("'*'", "'decade'", "({b}.Year / 10) * 10"),
+    ("{b}.Genre", "'author'", "{b}.Author"),
+    ("{b}.Genre", "'decade'", "({b}.Year / 10) * 10"),
+]
+
+FACET_UPSERT = """ON CONFLICT (Scope, Facet, Value) DO UPDATE
+               SET Books = Books + excluded.Books, Available = Available + excluded.Available"""
+
+
+def _facet_delta_sql(ref: str, books: str, available: str, source: str = "") -> str:
+    """
+    Trigger statement adding books/available to every facet of the book row
+    `ref` (new/old, or B read from `source` when a loan opens or closes).
+    """
+    keys = "\n                   UNION ALL ".join(
+        f"SELECT {scope} AS Scope, {facet} AS Facet, {value} AS Value{source}".format(b=ref)
+        for scope, facet, value in FACET_KEYS
+    )
+    return f"""INSERT INTO BookFacets (Scope, Facet, Value, Books, Available)
+               SELECT Scope, Facet, Value, {books}, {available} FROM (
+                   {keys}) WHERE true
+               {FACET_UPSERT};"""
+
+
+def _facet_rows_sql(books_source: str, available: str) -> str:
+    """SELECT of one (Scope, Facet, Value, Available) row per facet of every book in `books_source` (aliased B)."""
+    return "\n               UNION ALL ".join(
+        f"SELECT {scope}, {facet}, {value}, {available} FROM {books_source}".format(b="B")
+        for scope, facet, value in FACET_KEYS
+    )
+
+
+# 1 if book `book_id` has no active loan
+NOT_ON_LOAN = "NOT EXISTS (SELECT 1 FROM BorrowingHistory WHERE BookID = {} AND ReturnDate IS NULL)"
+# The book of the loan row a BorrowingHistory trigger fires for
+LOANED_BOOK = " FROM Books B WHERE B.BookID = new.BookID"
+
+REBUILD_BOOK_FACETS = [
+    "DELETE FROM BookFacets",
+    f"""INSERT INTO BookFacets (Scope, Facet, Value, Books, Available)
+        WITH B AS MATERIALIZED (
+            SELECT Books.Genre, Books.Author, Books.Year, H.HistoryID IS NULL AS Free
+            FROM Books
+            LEFT JOIN BorrowingHistory H ON H.BookID = Books.BookID AND H.ReturnDate IS NULL
+        ), F (Scope, Facet, Value, Free) AS (
+               {_facet_rows_sql("B", "Free")}
+        )
+        SELECT Scope, Facet, Value, COUNT(*), SUM(Free) FROM F
+        GROUP BY Scope, Facet, Value""",
+]
+
+# Facet counts for books inserted with the trigger dropped (bulk import): those with BookID > ?
+ADD_IMPORTED_FACETS = f"""
+    INSERT INTO BookFacets (Scope, Facet, Value, Books, Available)
+    WITH B AS MATERIALIZED (SELECT Genre, Author, Year FROM Books WHERE BookID > ?),
+    F (Scope, Facet, Value, Free) AS (
+           {_facet_rows_sql("B", "1")}
+    )
+    SELECT Scope, Facet, Value, COUNT(*), COUNT(*) FROM F
+    WHERE true
+    GROUP BY Scope, Facet, Value
+    {FACET_UPSERT}"""
+
+
+MIGRATIONS = [
+    (1, "Add lookup indexes", [
+        # Active loans only: borrow/return/renew and availability checks
+        """CREATE INDEX IF NOT EXISTS idx_history_active_book_user
+           ON BorrowingHistory (BookID, UserID) WHERE ReturnDate IS NULL""",
+        # mybooks and per-user history used by recommendations
+        """CREATE INDEX IF NOT EXISTS idx_history_user_book
+           ON BorrowingHistory (UserID, BookID)""",
+        """CREATE INDEX IF NOT EXISTS idx_history_book
+           ON BorrowingHistory (BookID)""",
+        # login / register
+        """CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username
+           ON Users (UserName)""",
+        # duplicate checks when adding books, genre filters
+        """CREATE INDEX IF NOT EXISTS idx_books_title_author
+           ON Books (BookName, Author)""",
+        """CREATE INDEX IF NOT EXISTS idx_books_genre
+           ON Books (Genre)""",
+        # reviews per book and the one-review-per-user check
+        """CREATE INDEX IF NOT EXISTS idx_ratings_book
+           ON Ratings (BookID)""",
+        """CREATE INDEX IF NOT EXISTS idx_ratings_user_book
+           ON Ratings (UserID, BookID)""",
+    ]),
+    (2, "Full-text catalog search", [
+        # External-content FTS5 index over Books, kept in sync by triggers
+        """CREATE VIRTUAL TABLE IF NOT EXISTS BooksSearch USING fts5(
+               BookName, Author, Genre,
+               content='Books', content_rowid='BookID',
+               tokenize='unicode61 remove_diacritics 2',
+               prefix='2 3')""",
+        """CREATE TRIGGER IF NOT EXISTS trg_books_search_insert AFTER INSERT ON Books BEGIN
+               INSERT INTO BooksSearch (rowid, BookName, Author, Genre)
+               VALUES (new.BookID, new.BookName, new.Author, new.Genre);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_books_search_delete AFTER DELETE ON Books BEGIN
+               INSERT INTO BooksSearch (BooksSearch, rowid, BookName, Author, Genre)
+               VALUES ('delete', old.BookID, old.BookName, old.Author, old.Genre);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_books_search_update AFTER UPDATE ON Books BEGIN
+               INSERT INTO BooksSearch (BooksSearch, rowid, BookName, Author, Genre)
+               VALUES ('delete', old.BookID, old.BookName, old.Author, old.Genre);
+               INSERT INTO BooksSearch (rowid, BookName, Author, Genre)
+               VALUES (new.BookID, new.BookName, new.Author, new.Genre);
+           END""",
+        "INSERT INTO BooksSearch (BooksSearch) VALUES ('rebuild')",
+        # Title matches outrank author matches, which outrank genre matches
+        "INSERT INTO BooksSearch (BooksSearch, rank) VALUES ('rank', 'bm25(10.0, 5.0, 1.0)')",
+    ]),
+    (3, "One active loan per book", [
+        # Close duplicate active loans left by the old check-then-insert race,
+        # keeping the earliest one, so the unique index can be built
+        """UPDATE BorrowingHistory SET ReturnDate = BorrowDate
+           WHERE ReturnDate IS NULL AND HistoryID NOT IN (
+               SELECT MIN(HistoryID) FROM BorrowingHistory
+               WHERE ReturnDate IS NULL GROUP BY BookID)""",
+        """CREATE UNIQUE INDEX IF NOT EXISTS idx_history_one_active_loan
+           ON BorrowingHistory (BookID) WHERE ReturnDate IS NULL""",
+        # Every lookup it served is now answered by the unique index
+        "DROP INDEX IF EXISTS idx_history_active_book_user",
+    ]),
+    (4, "Normalized title+author key for bulk import dedup", [
+        """CREATE INDEX IF NOT EXISTS idx_books_dedup_key
+           ON Books (lower(trim(BookName)), lower(trim(Author)))""",
+    ]),
+    (5, "Change counters for cross-process cache coherence", [
+        # One row per response cache tag, bumped by every write to its table,
+        # so each worker can tell what other processes changed
+        """CREATE TABLE IF NOT EXISTS ChangeCounters (
+               Tag TEXT PRIMARY KEY,
+               Version INTEGER NOT NULL DEFAULT 0
+           ) WITHOUT ROWID""",
+        "INSERT OR IGNORE INTO ChangeCounters (Tag) VALUES ('books'), ('loans'), ('reviews'), ('users')",
+        *_change_counter_triggers("Books", "books"),
+        *_change_counter_triggers("BorrowingHistory", "loans"),
+        *_change_counter_triggers("Ratings", "reviews"),
+        *_change_counter_triggers("Users", "users"),
+        # Deleting a user invalidates their session tokens in every worker
+        """CREATE TABLE IF NOT EXISTS RevokedSessions (
+               UserID INTEGER PRIMARY KEY,
+               RevokedBefore INTEGER NOT NULL
+           )""",
+        """CREATE TRIGGER IF NOT EXISTS trg_users_revoke_sessions AFTER DELETE ON Users BEGIN
+               INSERT OR REPLACE INTO RevokedSessions (UserID, RevokedBefore)
+               VALUES (old.UserID, CAST(strftime('%s', 'now') AS INTEGER) + 1);
+           END""",
+    ]),
+    (6, "Event log for the /events stream", [
+        # Delta messages written in the same transaction as the change they
+        # describe; every worker tails this table and pushes new rows to its
+        # SSE clients. AUTOINCREMENT so Seq (the SSE event id) is never reused
+        # after old rows are pruned.
+        """CREATE TABLE IF NOT EXISTS Events (
+               Seq INTEGER PRIMARY KEY AUTOINCREMENT,
+               Type TEXT NOT NULL,
+               Data TEXT NOT NULL
+           )""",
+        """CREATE TRIGGER IF NOT EXISTS trg_books_event_insert AFTER INSERT ON Books BEGIN
+               INSERT INTO Events (Type, Data) VALUES ('book_added', json_object(
+                   'book_id', new.BookID, 'book_name', new.BookName, 'author', new.Author,
+                   'genre', new.Genre, 'year', new.Year));
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_books_event_update AFTER UPDATE ON Books BEGIN
+               INSERT INTO Events (Type, Data) VALUES ('book_updated', json_object(
+                   'book_id', new.BookID, 'book_name', new.BookName, 'author', new.Author,
+                   'genre', new.Genre, 'year', new.Year));
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_books_event_delete AFTER DELETE ON Books BEGIN
+               INSERT INTO Events (Type, Data) VALUES ('book_removed', json_object('book_id', old.BookID));
+           END""",
+        # Loans carry availability only, not who borrowed
+        """CREATE TRIGGER IF NOT EXISTS trg_borrowinghistory_event_open
+           AFTER INSERT ON BorrowingHistory WHEN new.ReturnDate IS NULL BEGIN
+               INSERT INTO Events (Type, Data) VALUES ('loan_opened', json_object(
+                   'book_id', new.BookID, 'available', json('false')));
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_borrowinghistory_event_close
+           AFTER UPDATE OF ReturnDate ON BorrowingHistory
+           WHEN old.ReturnDate IS NULL AND new.ReturnDate IS NOT NULL BEGIN
+               INSERT INTO Events (Type, Data) VALUES ('loan_closed', json_object(
+                   'book_id', new.BookID, 'available', json('true')));
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_ratings_event_insert AFTER INSERT ON Ratings BEGIN
+               INSERT INTO Events (Type, Data) VALUES ('review_added', json_object(
+                   'rating_id', new.RatingID, 'user_id', new.UserID,
+                   'username', (SELECT UserName FROM Users WHERE UserID = new.UserID),
+                   'book_id', new.BookID, 'rating', new.Rating));
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_ratings_event_delete AFTER DELETE ON Ratings BEGIN
+               INSERT INTO Events (Type, Data) VALUES ('review_deleted', json_object(
+                   'rating_id', old.RatingID, 'book_id', old.BookID));
+           END""",
+    ]),
+    (7, "Archive table for old returned loans", [
+        # Returned loans are moved here by archive.LoanArchiver, keeping their
+        # HistoryID, so BorrowingHistory stays small and mostly active loans
+        """CREATE TABLE IF NOT EXISTS LoanArchive (
+               HistoryID INTEGER PRIMARY KEY,
+               UserID INTEGER,
+               BookID INTEGER,
+               BorrowDate DATE,
+               DueDate DATE,
+               ReturnDate DATE
+           )""",
+        """CREATE INDEX IF NOT EXISTS idx_archive_user_book
+           ON LoanArchive (UserID, BookID)""",
+        """CREATE INDEX IF NOT EXISTS idx_archive_book
+           ON LoanArchive (BookID)""",
+        # Finds the loans to archive, oldest first, without touching active ones
+        """CREATE INDEX IF NOT EXISTS idx_history_returned
+           ON BorrowingHistory (ReturnDate) WHERE ReturnDate IS NOT NULL""",
+        # Every loan ever made, for readers that need the full history
+        """CREATE VIEW IF NOT EXISTS AllLoans AS
+               SELECT HistoryID, UserID, BookID, BorrowDate, DueDate, ReturnDate FROM BorrowingHistory
+               UNION ALL
+               SELECT HistoryID, UserID, BookID, BorrowDate, DueDate, ReturnDate FROM LoanArchive""",
+    ]),
+    (8, "Per-book rating aggregates", [
+        # Count, sum, 0-5 star histogram and Bayesian score per rated book,
+        # kept current by triggers on Ratings. Genre is copied from Books so
+        # /books/top-rated is one index range scan, with or without a genre.
+        f"""CREATE TABLE IF NOT EXISTS BookRatings (
+               BookID INTEGER PRIMARY KEY,
+               Genre TEXT NOT NULL,
+               RatingCount INTEGER NOT NULL DEFAULT 0,
+               RatingSum REAL NOT NULL DEFAULT 0,
+               {" ".join(f"Stars{k} INTEGER NOT NULL DEFAULT 0," for k in range(6))}
+               Score REAL NOT NULL DEFAULT 0
+           )""",
+        """CREATE INDEX IF NOT EXISTS idx_bookratings_score
+           ON BookRatings (Score, BookID)""",
+        """CREATE INDEX IF NOT EXISTS idx_bookratings_genre_score
+           ON BookRatings (Genre, Score, BookID)""",
+        # The prior: Weight ratings at the catalog-wide mean. Rebuilding refreshes the mean.
+        """CREATE TABLE IF NOT EXISTS RatingPrior (
+               ID INTEGER PRIMARY KEY CHECK (ID = 1),
+               Mean REAL NOT NULL,
+               Weight REAL NOT NULL
+           )""",
+        "INSERT OR IGNORE INTO RatingPrior (ID, Mean, Weight) VALUES (1, 2.5, 10)",
+        *REBUILD_BOOK_RATINGS,
+        f"""CREATE TRIGGER IF NOT EXISTS trg_ratings_aggregate_insert
+           AFTER INSERT ON Ratings WHEN new.Rating IS NOT NULL BEGIN
+               {_rating_aggregate_sql("new", adding=True)}
+           END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_ratings_aggregate_delete
+           AFTER DELETE ON Ratings WHEN old.Rating IS NOT NULL BEGIN
+               {_rating_aggregate_sql("old", adding=False)}
+           END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_ratings_aggregate_update_old
+           AFTER UPDATE OF Rating, BookID ON Ratings WHEN old.Rating IS NOT NULL BEGIN
+               {_rating_aggregate_sql("old", adding=False)}
+           END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_ratings_aggregate_update_new
+           AFTER UPDATE OF Rating, BookID ON Ratings WHEN new.Rating IS NOT NULL BEGIN
+               {_rating_aggregate_sql("new", adding=True)}
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_books_aggregate_delete AFTER DELETE ON Books BEGIN
+               DELETE FROM BookRatings WHERE BookID = old.BookID;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_books_aggregate_genre AFTER UPDATE OF Genre ON Books BEGIN
+               UPDATE BookRatings SET Genre = new.Genre WHERE BookID = new.BookID;
+           END""",
+        # review_deleted now carries the rating, so clients can adjust a book's aggregates
+        "DROP TRIGGER IF EXISTS trg_ratings_event_delete",
+        """CREATE TRIGGER trg_ratings_event_delete AFTER DELETE ON Ratings BEGIN
+               INSERT INTO Events (Type, Data) VALUES ('review_deleted', json_object(
+                   'rating_id', old.RatingID, 'book_id', old.BookID, 'rating', old.Rating));
+           END""",
+    ]),
+    (9, "Active loans ordered by due date", [
+        # Active loans by due date: /admin/overdue and the overdue scanner
+        """CREATE INDEX IF NOT EXISTS idx_history_active_due
+           ON BorrowingHistory (DueDate, HistoryID) WHERE ReturnDate IS NULL""",
+        # One user's active loans by due date: /users/{id}/due-soon
+        """CREATE INDEX IF NOT EXISTS idx_history_active_user_due
+           ON BorrowingHistory (UserID, DueDate) WHERE ReturnDate IS NULL""",
+        # How far overdue.OverdueScanner has got along idx_history_active_due.
+        # Starts today, so loans already overdue do not all raise a notice at once.
+        """CREATE TABLE IF NOT EXISTS OverdueScan (
+               ID INTEGER PRIMARY KEY CHECK (ID = 1),
+               DueDate DATE NOT NULL,
+               HistoryID INTEGER NOT NULL
+           )""",
+        "INSERT OR IGNORE INTO OverdueScan (ID, DueDate, HistoryID) VALUES (1, date('now', 'localtime'), 0)",
+    ]),
+    (10, "Catalog facet counts", [
+        # Books and available books per facet value, for the whole catalog
+        # (Scope '*') and per genre (Scope = the genre), kept current by
+        # triggers on Books and on loans opening and closing
+        """CREATE TABLE IF NOT EXISTS BookFacets (
+               Scope TEXT NOT NULL,
+               Facet TEXT NOT NULL,
+               Value NOT NULL,
+               Books INTEGER NOT NULL,
+               Available INTEGER NOT NULL,
+               PRIMARY KEY (Scope, Facet, Value)
+           ) WITHOUT ROWID""",
+        # The most common values of a facet, in order, without sorting
+        """CREATE INDEX IF NOT EXISTS idx_bookfacets_top
+           ON BookFacets (Scope, Facet, Books DESC, Value)""",
+        *REBUILD_BOOK_FACETS,
+        f"""CREATE TRIGGER IF NOT EXISTS trg_books_facets_insert AFTER INSERT ON Books BEGIN
+               {_facet_delta_sql("new", "1", "1")}
+           END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_books_facets_delete AFTER DELETE ON Books BEGIN
+               {_facet_delta_sql("old", "-1", "-" + NOT_ON_LOAN.format("old.BookID"))}
+           END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_books_facets_update AFTER UPDATE OF Genre, Author, Year ON Books BEGIN
+               {_facet_delta_sql("old", "-1", "-" + NOT_ON_LOAN.format("old.BookID"))}
+               {_facet_delta_sql("new", "1", NOT_ON_LOAN.format("new.BookID"))}
+           END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_borrowinghistory_facets_open
+           AFTER INSERT ON BorrowingHistory WHEN new.ReturnDate IS NULL BEGIN
+               {_facet_delta_sql("B", "0", "-1", LOANED_BOOK)}
+           END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_borrowinghistory_facets_close
+           AFTER UPDATE OF ReturnDate ON BorrowingHistory
+           WHEN old.ReturnDate IS NULL AND new.ReturnDate IS NOT NULL BEGIN
+               {_facet_delta_sql("B", "0", "1", LOANED_BOOK)}
+           END""",
+    ]),
+    (11, "Hold queues", [
+        # Status: waiting -> ready (set aside, until PickupBy) -> fulfilled
+        # (borrowed), or cancelled / expired. Times are UTC.
+        """CREATE TABLE IF NOT EXISTS Holds (
+               HoldID INTEGER PRIMARY KEY,
+               UserID INTEGER NOT NULL,
+               BookID INTEGER NOT NULL,
+               Status TEXT NOT NULL DEFAULT 'waiting'
+                   CHECK (Status IN ('waiting', 'ready', 'fulfilled', 'cancelled', 'expired')),
+               PlacedAt TEXT NOT NULL DEFAULT (datetime('now')),
+               ReadyAt TEXT,
+               PickupBy TEXT,
+               ClosedAt TEXT
+           )""",
+        # Each book's queue in order: its head, and a hold's position
+        """CREATE INDEX IF NOT EXISTS idx_holds_queue
+           ON Holds (BookID, HoldID) WHERE Status = 'waiting'""",
+        # At most one copy, so at most one patron it is set aside for
+        """CREATE UNIQUE INDEX IF NOT EXISTS idx_holds_one_ready
+           ON Holds (BookID) WHERE Status = 'ready'""",
+        # Ready holds by deadline, for holds.HoldSweeper
+        """CREATE INDEX IF NOT EXISTS idx_holds_pickup
+           ON Holds (PickupBy) WHERE Status = 'ready'""",
+        # One open hold per patron and book; also lists a patron's holds
+        """CREATE UNIQUE INDEX IF NOT EXISTS idx_holds_user_open
+           ON Holds (UserID, BookID) WHERE Status IN ('waiting', 'ready')""",
+        # A ready hold makes the book unavailable, so it is a change to 'loans'
+        # for the response cache and an availability event like a loan
+        """CREATE TRIGGER IF NOT EXISTS trg_holds_event_ready
+           AFTER UPDATE OF Status ON Holds
+           WHEN new.Status = 'ready' AND old.Status != 'ready' BEGIN
+               UPDATE ChangeCounters SET Version = Version + 1 WHERE Tag = 'loans';
+               INSERT INTO Events (Type, Data) VALUES ('hold_ready', json_object(
+                   'book_id', new.BookID, 'hold_id', new.HoldID, 'available', json('false')));
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_holds_event_release
+           AFTER UPDATE OF Status ON Holds
+           WHEN old.Status = 'ready' AND new.Status != 'ready' BEGIN
+               UPDATE ChangeCounters SET Version = Version + 1 WHERE Tag = 'loans';
+               INSERT INTO Events (Type, Data) VALUES ('hold_released', json_object(
+                   'book_id', new.BookID, 'hold_id', new.HoldID, 'available', json('true')));
+           END""",
+        # One statement per status, so each is a search of the matching partial index
+        """CREATE TRIGGER IF NOT EXISTS trg_books_holds_delete AFTER DELETE ON Books BEGIN
+               UPDATE Holds SET Status = 'cancelled', ClosedAt = datetime('now')
+               WHERE BookID = old.BookID AND Status = 'waiting';
+               UPDATE Holds SET Status = 'cancelled', ClosedAt = datetime('now')
+               WHERE BookID = old.BookID AND Status = 'ready';
+           END""",
+        # A removed patron leaves their queues; a book set aside for them is
+        # handed on by the next sweep. The IN matches idx_holds_user_open.
+        """CREATE TRIGGER IF NOT EXISTS trg_users_holds_delete AFTER DELETE ON Users BEGIN
+               UPDATE Holds SET Status = 'cancelled', ClosedAt = datetime('now')
+               WHERE UserID = old.UserID AND Status IN ('waiting', 'ready') AND Status = 'waiting';
+               UPDATE Holds SET PickupBy = datetime('now', '-1 second')
+               WHERE UserID = old.UserID AND Status IN ('waiting', 'ready') AND Status = 'ready';
+           END""",
+    ]),
+    (12, "Admin role", [
+        # Admin rights come from this table, never from the user name: a
+        # patron registering as "admin" after that account is gone is a patron
+        """CREATE TABLE IF NOT EXISTS Admins (
+               UserID INTEGER PRIMARY KEY
+           )""",
+        # Until now the account named admin was the admin
+        "INSERT OR IGNORE INTO Admins (UserID) SELECT UserID FROM Users WHERE UserName = 'admin'",
+        """CREATE TRIGGER IF NOT EXISTS trg_users_admins_delete AFTER DELETE ON Users BEGIN
+               DELETE FROM Admins WHERE UserID = old.UserID;
+           END""",
+    ]),
+    (13, "Catalog sort orders", [
+        # GET /api/books/ without filters, sorted by author or year: read in
+        # index order and stop at the limit instead of sorting every book
+        """CREATE INDEX IF NOT EXISTS idx_books_author
+           ON Books (Author, BookID)""",
+        """CREATE INDEX IF NOT EXISTS idx_books_year
+           ON Books (Year, BookID)""",
+    ]),
+]
+
+
+async def get_schema_version(db: aiosqlite.Connection) -> int:
+    cursor = await db.execute("PRAGMA user_version")
+    return (await cursor.fetchone())[0]
+
+
+async def apply_migrations(db: aiosqlite.Connection) -> list:
+    """Apply every migration newer than the stored version. Returns the versions applied."""
+    current = await get_schema_version(db)
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            for statement in statements:
+                await db.execute(statement)
+            # PRAGMA does not accept bound parameters
+            await db.execute(f"PRAGMA user_version = {int(version)}")
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+async def main() -> int:
+    async with aiosqlite.connect(DATABASE) as db:
+        applied = await apply_migrations(db)
+        print(f"Applied migrations: {applied or 'none'}")
+        print(f"Schema version: {await get_schema_version(db)}")
+    return 0
+
+
+if __name__ == "__main__":
+    # python migrations.py -> migrate Library.db; query plans are checked by tests/test_query_plans.py
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import time
+from datetime import date
+from writequeue import write_queue
+
+# Seconds between scans for loans that have just become overdue; 0 disables the scanner
+OVERDUE_INTERVAL = float(os.environ.get("LIBRARY_OVERDUE_INTERVAL", "60"))
+# Loans noticed per write-queue operation, and operations per scan, so one scan's work is bounded
+OVERDUE_BATCH_ROWS = 200
+OVERDUE_MAX_BATCHES = 10
+# Pause between batches
+OVERDUE_PAUSE = 0.05
+# Default window for /users/{id}/due-soon
+DUE_SOON_DAYS = 3
+
+# Active loans due before a date, after the scan cursor, in idx_history_active_due order
+OVERDUE_AFTER = """
+    SELECT HistoryID, BookID, DueDate FROM BorrowingHistory
+    WHERE ReturnDate IS NULL AND DueDate < ? AND (DueDate, HistoryID) > (?, ?)
+    ORDER BY DueDate, HistoryID LIMIT ?
+"""
+
+log = logging.getLogger("library.overdue")
+
+# -------------------------------
+# Overdue Scanner
+# -------------------------------
+
+def notice_batch(conn: sqlite3.Connection, today: str, limit: int = OVERDUE_BATCH_ROWS) -> int:
+    """
+    Write-queue operation: raise a loan_overdue event for up to `limit` active
+    loans due before `today` and past the OverdueScan cursor, then advance it.
+    """
+    due_date, history_id = conn.execute("SELECT DueDate, HistoryID FROM OverdueScan WHERE ID = 1").fetchone()
+    rows = conn.execute(OVERDUE_AFTER, (today, due_date, history_id, limit)).fetchall()
+    if not rows:
+        return 0
+    conn.executemany("""
+        INSERT INTO Events (Type, Data) VALUES ('loan_overdue', json_object(
+            'history_id', ?, 'book_id', ?, 'due_date', ?))
+    """, rows)
+    conn.execute("UPDATE OverdueScan SET DueDate = ?, HistoryID = ? WHERE ID = 1", (rows[-1][2], rows[-1][0]))
+    return len(rows)
+
+
+class OverdueScanner:
+    """
+    Background task raising a loan_overdue event once for each loan whose due
+    date passes while it is still out.
+
+    Active loans are kept ordered by due date by idx_history_active_due, which
+    borrow, renew and return maintain as part of their own writes, so the
+    scanner never reads BorrowingHistory as a whole: it walks the index
+    forward from the cursor in OverdueScan to today, at most max_batches
+    batches of batch_rows per scan. The cursor moves in the same transaction
+    as the events, so with several workers each loan is still noticed once.
+    A loan renewed past the cursor is noticed again if it runs over again.
+    """
+
+    def __init__(self, interval: float = OVERDUE_INTERVAL, batch_rows: int = OVERDUE_BATCH_ROWS,
+                 max_batches: int = OVERDUE_MAX_BATCHES):
+        self.interval = interval
+        self.batch_rows = batch_rows
+        self.max_batches = max_batches
+        self._task: asyncio.Task = None
+        self._stats = {"runs": 0, "noticed": 0, "batches": 0, "errors": 0, "backlog": False,
+                       "last_run": None, "last_seconds": None}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running or self.interval <= 0:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def run_once(self) -> int:
+        """One bounded scan. Returns the number of loans noticed."""
+        started = time.perf_counter()
+        today = date.today().isoformat()
+        noticed = 0
+        for batch in range(self.max_batches):
+            if batch:
+                await asyncio.sleep(OVERDUE_PAUSE)
+            count = await write_queue.submit(lambda conn: notice_batch(conn, today, self.batch_rows))
+            noticed += count
+            self._stats["batches"] += 1
+            if count < self.batch_rows:
+                break
+        # A full last batch means more are waiting; the next scan carries on from the cursor
+        self._stats["backlog"] = count == self.batch_rows
+        self._stats["noticed"] += noticed
+        self._stats["runs"] += 1
+        self._stats["last_run"] = time.time()
+        self._stats["last_seconds"] = round(time.perf_counter() - started, 3)
+        return noticed
+
+    async def _run(self):
+        # Random offset so workers do not all scan at the same moment
+        await asyncio.sleep(random.uniform(0.5, 1.0) * min(self.interval, 10))
+        while True:
+            try:
+                noticed = await self.run_once()
+                if noticed:
+                    log.info("%d loans became overdue", noticed)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._stats["errors"] += 1
+                log.exception("overdue scan failed")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {**self._stats, "interval": self.interval, "running": self.running}
+
+
+overdue_scanner = OverdueScanner()
@@ -0,0 +1,125 @@
+import aiosqlite
+import orjson
+from fastapi import Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
+
+NDJSON = "application/x-ndjson"
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Rows read per query while streaming a whole table
+CHUNK_SIZE = 500
+
+# -------------------------------
+# Keyset Pagination
+# -------------------------------
+# List queries are paged on their integer primary key ("WHERE key > after
+# ORDER BY key LIMIT n") so every page is an index range scan, no matter how
+# deep into the table it is. The key must be the first selected column.
+
+def keyset_query(select: str, key: str) -> str:
+    """One page of `select` after a key value; parameters are the last key seen and the page size."""
+    return f"{select} WHERE {key} > ? ORDER BY {key} LIMIT ?"
+
+
+async def keyset_rows(db: aiosqlite.Connection, select: str, key: str,
+                      after: int = None, limit: int = None, chunk_size: int = CHUNK_SIZE):
+    """Yield rows of `select` in key order, reading at most chunk_size rows per query."""
+    last = after if after is not None else -1
+    remaining = limit
+    sql = keyset_query(select, key)
+    while remaining is None or remaining > 0:
+        size = chunk_size if remaining is None else min(chunk_size, remaining)
+        cursor = await db.execute(sql, (last, size))
+        rows = await cursor.fetchall()
+        for row in rows:
+            yield row
+        if len(rows) < size:
+            return
+        last = rows[-1][0]
+        if remaining is not None:
+            remaining -= len(rows)
+
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON in request.headers.get("accept", "")
+
+
+def wants_columns(request: Request) -> bool:
+    return request.query_params.get("format") == "columns"
+
+# -------------------------------
+# Encoding
+# -------------------------------
+# List endpoints return their rows already encoded by orjson. A Response
+# returned from an endpoint skips FastAPI's jsonable_encoder and response
+# validation, which for long lists cost more than the query itself.
+
+def columns(items: list) -> dict:
+    """Each field name once, with the array of its values, in row order."""
+    if not items:
+        return {}
+    return {name: [item[name] for item in items] for name in items[0]}
+
+
+def json_list(request: Request, items: list, **page) -> ORJSONResponse:
+    """
+    Encode a list endpoint's rows:
+    - format=columns -> {"columns": {field: [values...]}, "count": n, **page}
+    - page fields    -> {"items": [...], **page}, e.g. next_after
+    - neither        -> the plain JSON array
+    """
+    if wants_columns(request):
+        return ORJSONResponse({"columns": columns(items), "count": len(items), **page})
+    return ORJSONResponse({"items": items, **page} if page else items)
+
+
+async def _ndjson_lines(rows, to_dict):
+    async for row in rows:
+        yield orjson.dumps(to_dict(row)) + b"\n"
+
+
+async def _json_array(rows, to_dict):
+    first = True
+    async for row in rows:
+        yield (b"[" if first else b",") + orjson.dumps(to_dict(row))
+        first = False
+    yield b"[]" if first else b"]"
+
+
+async def list_response(request: Request, db: aiosqlite.Connection, select: str, key: str,
+                        to_dict, after: int = None, limit: int = None):
+    """List endpoint over a SELECT, read with keyset_rows; see rows_response."""
+    return await rows_response(
+        request, lambda after=None, limit=None: keyset_rows(db, select, key, after=after, limit=limit),
+        to_dict, after=after, limit=limit
+    )
+
+
+async def rows_response(request: Request, fetch, to_dict, after: int = None, limit: int = None):
+    """
+    Build the response for a list endpoint from fetch(after=, limit=), which
+    yields rows in key order with the key first, as keyset_rows does:
+    - Accept: application/x-ndjson -> one JSON object per line, streamed in chunks
+    - limit and/or after given     -> {"items": [...], "next_after": <cursor or null>}
+    - neither                      -> the full list as a JSON array, streamed in chunks
+    format=columns sends the same rows column by column (see json_list); a
+    whole-table columnar response is built in memory, since it cannot be streamed.
+    """
+    if limit is not None:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    if wants_ndjson(request):
+        return StreamingResponse(_ndjson_lines(fetch(after=after, limit=limit), to_dict), media_type=NDJSON)
+
+    if limit is None and after is None:
+        if wants_columns(request):
+            return json_list(request, [to_dict(row) async for row in fetch()])
+        return StreamingResponse(_json_array(fetch(), to_dict), media_type="application/json")
+
+    page_size = limit or DEFAULT_PAGE_SIZE
+    # Read one extra row to learn whether another page exists
+    rows = [row async for row in fetch(after=after, limit=page_size + 1)]
+    next_after = rows[page_size - 1][0] if len(rows) > page_size else None
+    return json_list(request, [to_dict(row) for row in rows[:page_size]], next_after=next_after)
@@ -0,0 +1,403 @@
+import asyncio
+from collections import defaultdict
+import numpy as np
+import aiosqlite
+
+# Weight of one loan in the user/book interaction matrix
+LOAN_WEIGHT = 1.0
+# A 5.0 rating adds this much, a 0.0 rating subtracts it
+RATING_WEIGHT = 1.0
+# Pending interactions are merged into the CSR arrays once there are this many
+COMPACT_THRESHOLD = 10_000
+# Caps on the two-hop walk so very popular books don't make queries expensive
+MAX_USERS_PER_BOOK = 2_000
+MAX_NEIGHBOURS = 500
+# Popularity only breaks ties between equally similar books
+POPULARITY_TIEBREAK = 1e-3
+
+MODES = ("genre", "author", "popular")
+
+# Rows added after build(), read by catch_up(): (kind, SQL selecting id first).
+# New loans are always in BorrowingHistory; only long-returned ones are archived.
+CATCH_UP_QUERIES = {
+    "books": "SELECT BookID, Author, Genre FROM Books WHERE BookID > ? ORDER BY BookID",
+    "loans": "SELECT HistoryID, UserID, BookID FROM BorrowingHistory WHERE HistoryID > ? ORDER BY HistoryID",
+    "ratings": "SELECT RatingID, UserID, BookID, Rating FROM Ratings WHERE RatingID > ? ORDER BY RatingID",
+}
+
+# -------------------------------
+# Helpers
+# -------------------------------
+
+def _grow(array: np.ndarray, size: int) -> np.ndarray:
+    if size <= len(array):
+        return array
+    grown = np.zeros(max(size, 2 * len(array), 16), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def _csr(rows: np.ndarray, cols: np.ndarray, data: np.ndarray, n_rows: int):
+    """Group COO entries by row: returns (indptr, cols, data)."""
+    order = np.argsort(rows, kind="stable")
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+    return indptr, cols[order], data[order]
+
+
+def _rating_weight(rating: float) -> float:
+    return RATING_WEIGHT * (float(rating) - 2.5) / 2.5
+
+# -------------------------------
+# Recommendation Engine
+# -------------------------------
+
+class RecommendationEngine:
+    """
+    Item-to-item recommendations from co-borrowing and co-rating.
+
+    Loans and ratings are kept as a sparse user x book weight matrix M, stored
+    twice in CSR form (grouped by book and grouped by user) as NumPy arrays.
+    A user's scores are a row of the cosine similarity M^T M, computed by a
+    two-hop walk (user -> books -> other readers -> their books) limited to
+    the user's neighbourhood, so a query never touches the whole history.
+
+    New loans and ratings go into a small pending buffer that queries read
+    alongside the CSR arrays, and are merged in once COMPACT_THRESHOLD is hit.
+
+    Rows written by other processes are picked up by catch_up(), which reads
+    everything above the highest ID seen so far. IDs passed to record_loan /
+    record_rating let it skip rows this process has already applied.
+    Deletions made elsewhere are only seen on the next build().
+    """
+
+    def __init__(self):
+        self.ready = False
+        self._watermarks = {kind: 0 for kind in CATCH_UP_QUERIES}
+        # IDs above the watermark that were recorded directly
+        self._applied = {kind: set() for kind in CATCH_UP_QUERIES}
+        self._reset()
+
+    def _reset(self):
+        # Book attributes, indexed by dense book index
+        self._book_index = {}
+        self._n_books = 0
+        self._book_ids = np.zeros(0, dtype=np.int64)
+        self._genre = np.zeros(0, dtype=np.int32)
+        self._author = np.zeros(0, dtype=np.int32)
+        self._active = np.zeros(0, dtype=bool)
+        self._popularity = np.zeros(0, dtype=np.float64)
+        self._sq_norm = np.zeros(0, dtype=np.float64)
+        self._genre_codes = {}
+        self._author_codes = {}
+        self._user_index = {}
+        # Merged interactions (COO) and the two CSR views built from them
+        self._users = np.zeros(0, dtype=np.int32)
+        self._books = np.zeros(0, dtype=np.int32)
+        self._weights = np.zeros(0, dtype=np.float32)
+        self._by_book = (np.zeros(1, dtype=np.int64), self._users, self._weights)
+        self._by_user = (np.zeros(1, dtype=np.int64), self._books, self._weights)
+        # Interactions not merged yet
+        self._pending = []
+        self._pending_by_book = defaultdict(list)
+        self._pending_by_user = defaultdict(list)
+
+    # ---- loading ----
+
+    async def build(self, db: aiosqlite.Connection, chunk_size: int = 10_000):
+        """(Re)load everything from the database."""
+        async def rows(sql, params=()):
+            cursor = await db.execute(sql, params)
+            while True:
+                chunk = await cursor.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                for row in chunk:
+                    yield row
+
+        # Archived loans are older than any live one, but the live table can be empty
+        cursor = await db.execute("""
+            SELECT (SELECT MAX(BookID) FROM Books),
+                   MAX(IFNULL((SELECT MAX(HistoryID) FROM BorrowingHistory), 0),
+                       IFNULL((SELECT MAX(HistoryID) FROM LoanArchive), 0)),
+                   (SELECT MAX(RatingID) FROM Ratings)
+        """)
+        watermarks = [value or 0 for value in await cursor.fetchone()]
+        # Only rows up to the watermarks, so catch_up() starts exactly where this ends
+        books = [row async for row in rows("SELECT BookID, Author, Genre FROM Books WHERE BookID <= ?",
+                                           (watermarks[0],))]
+        loans = [row async for row in rows("SELECT UserID, BookID FROM AllLoans WHERE HistoryID <= ?",
+                                           (watermarks[1],))]
+        ratings = [row async for row in rows("SELECT UserID, BookID, Rating FROM Ratings WHERE RatingID <= ?",
+                                             (watermarks[2],))]
+        # The arrays take about as long as the reads; build them in a fresh engine on a
+        # thread so requests are served meanwhile. What they record here in the
+        # meantime is above the watermarks, so catch_up() applies it again.
+        fresh = RecommendationEngine()
+        await asyncio.to_thread(fresh.load, books, loans, ratings)
+        self.__dict__.update(fresh.__dict__)
+        self._watermarks = dict(zip(CATCH_UP_QUERIES, watermarks))
+        self._applied = {kind: set() for kind in CATCH_UP_QUERIES}
+
+    async def catch_up(self, db: aiosqlite.Connection) -> int:
+        """Apply books, loans and ratings added since build() that were not recorded here. Returns rows applied."""
+        applied = 0
+        for kind, sql in CATCH_UP_QUERIES.items():
+            cursor = await db.execute(sql, (self._watermarks[kind],))
+            # Another catch_up() may have applied some of these while this one waited for them
+            rows = [row for row in await cursor.fetchall() if row[0] > self._watermarks[kind]]
+            if not rows:
+                continue
+            seen = self._applied[kind]
+            for row_id, *values in rows:
+                if row_id in seen:
+                    continue
+                applied += 1
+                if kind == "books":
+                    self.add_book(row_id, *values)
+                elif kind == "loans":
+                    self.record_loan(*values)
+                else:
+                    self.record_rating(*values)
+            self._watermarks[kind] = rows[-1][0]
+            self._applied[kind] = {row_id for row_id in seen if row_id > rows[-1][0]}
+        return applied
+
+    def _first_time(self, kind: str, row_id: int) -> bool:
+        """False if catch_up() already applied this row; otherwise remember it for catch_up() to skip."""
+        if row_id is None:
+            return True
+        if row_id <= self._watermarks[kind]:
+            return False
+        self._applied[kind].add(row_id)
+        return True
+
+    def load(self, books, loans, ratings):
+        """Load from (book_id, author, genre), (user_id, book_id) and (user_id, book_id, rating) rows."""
+        self._reset()
+        for book_id, author, genre in books:
+            self.add_book(book_id, author, genre)
+
+        users, items, weights = [], [], []
+        for user_id, book_id in loans:
+            index = self._book_index.get(book_id)
+            if index is None:
+                continue
+            users.append(self._user(user_id))
+            items.append(index)
+            weights.append(LOAN_WEIGHT)
+            self._popularity[index] += 1
+        for user_id, book_id, rating in ratings:
+            index = self._book_index.get(book_id)
+            if index is None or rating is None:
+                continue
+            users.append(self._user(user_id))
+            items.append(index)
+            weights.append(_rating_weight(rating))
+
+        self._users = np.asarray(users, dtype=np.int32)
+        self._books = np.asarray(items, dtype=np.int32)
+        self._weights = np.asarray(weights, dtype=np.float32)
+        np.add.at(self._sq_norm, self._books, self._weights.astype(np.float64) ** 2)
+        self._rebuild_csr()
+        self.ready = True
+
+    def _rebuild_csr(self):
+        self._by_book = _csr(self._books, self._users, self._weights, self._n_books)
+        self._by_user = _csr(self._users, self._books, self._weights, len(self._user_index))
+
+    def compact(self):
+        """Merge pending interactions into the CSR arrays."""
+        if not self._pending:
+            return
+        users, items, weights = zip(*self._pending)
+        self._users = np.concatenate([self._users, np.asarray(users, dtype=np.int32)])
+        self._books = np.concatenate([self._books, np.asarray(items, dtype=np.int32)])
+        self._weights = np.concatenate([self._weights, np.asarray(weights, dtype=np.float32)])
+        self._pending = []
+        self._pending_by_book.clear()
+        self._pending_by_user.clear()
+        self._rebuild_csr()
+
+    # ---- incremental updates ----
+
+    def _user(self, user_id: int) -> int:
+        index = self._user_index.get(user_id)
+        if index is None:
+            index = self._user_index[user_id] = len(self._user_index)
+        return index
+
+    def _code(self, codes: dict, value: str) -> int:
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+        return code
+
+    def add_book(self, book_id: int, author: str, genre: str):
+        index = self._book_index.get(book_id)
+        if index is None:
+            index = self._book_index[book_id] = self._n_books
+            self._n_books += 1
+            size = self._n_books
+            self._book_ids = _grow(self._book_ids, size)
+            self._genre = _grow(self._genre, size)
+            self._author = _grow(self._author, size)
+            self._active = _grow(self._active, size)
+            self._popularity = _grow(self._popularity, size)
+            self._sq_norm = _grow(self._sq_norm, size)
+        self._book_ids[index] = book_id
+        self._genre[index] = self._code(self._genre_codes, genre)
+        self._author[index] = self._code(self._author_codes, author)
+        self._active[index] = True
+
+    def remove_book(self, book_id: int):
+        index = self._book_index.get(book_id)
+        if index is not None:
+            self._active[index] = False
+
+    def _add_interaction(self, user_id: int, book_id: int, weight: float) -> int:
+        index = self._book_index.get(book_id)
+        if index is None:
+            return None
+        user = self._user(user_id)
+        self._pending.append((user, index, weight))
+        self._pending_by_book[index].append((user, weight))
+        self._pending_by_user[user].append((index, weight))
+        self._sq_norm[index] += weight * weight
+        if len(self._pending) >= COMPACT_THRESHOLD:
+            self.compact()
+        return index
+
+    def record_loan(self, user_id: int, book_id: int, history_id: int = None):
+        if not self._first_time("loans", history_id):
+            return
+        index = self._add_interaction(user_id, book_id, LOAN_WEIGHT)
+        if index is not None:
+            self._popularity[index] += 1
+
+    def record_rating(self, user_id: int, book_id: int, rating: float, rating_id: int = None):
+        if not self._first_time("ratings", rating_id):
+            return
+        self._add_interaction(user_id, book_id, _rating_weight(rating))
+
+    def remove_rating(self, user_id: int, book_id: int, rating: float):
+        # Adding the opposite weight cancels the rating out of every dot product
+        weight = _rating_weight(rating)
+        index = self._add_interaction(user_id, book_id, -weight)
+        if index is not None:
+            # The +w and -w entries each added w^2 to the norm
+            self._sq_norm[index] = max(self._sq_norm[index] - 2 * weight * weight, 0.0)
+
+    # ---- queries ----
+
+    def _row(self, csr, pending, index: int):
+        indptr, cols, data = csr
+        if index < len(indptr) - 1:
+            start, end = indptr[index], indptr[index + 1]
+            cols, data = cols[start:end], data[start:end]
+        else:
+            cols, data = cols[:0], data[:0]
+        extra = pending.get(index)
+        if extra:
+            extra_cols, extra_data = zip(*extra)
+            cols = np.concatenate([cols, np.asarray(extra_cols, dtype=cols.dtype)])
+            data = np.concatenate([data, np.asarray(extra_data, dtype=data.dtype)])
+        return cols, data
+
+    def _user_books(self, user: int):
+        books, weights = self._row(self._by_user, self._pending_by_user, user)
+        if not len(books):
+            return books, weights.astype(np.float64)
+        unique, inverse = np.unique(books, return_inverse=True)
+        return unique, np.bincount(inverse, weights=weights)
+
+    def _similarity(self, user: int, books: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        n = self._n_books
+        norms = np.sqrt(self._sq_norm[:n])
+
+        # Hop 1: readers of the user's books, weighted by how similar their reading is
+        readers, affinity = [], []
+        for book, weight in zip(books, weights):
+            if norms[book] == 0:
+                continue
+            users, user_weights = self._row(self._by_book, self._pending_by_book, book)
+            users, user_weights = users[-MAX_USERS_PER_BOOK:], user_weights[-MAX_USERS_PER_BOOK:]
+            readers.append(users)
+            affinity.append(user_weights * (weight / norms[book]))
+        if not readers:
+            return np.zeros(n)
+        neighbours, inverse = np.unique(np.concatenate(readers), return_inverse=True)
+        affinity = np.bincount(inverse, weights=np.concatenate(affinity))
+        affinity[neighbours == user] = 0
+        if len(neighbours) > MAX_NEIGHBOURS:
+            keep = np.argpartition(-affinity, MAX_NEIGHBOURS)[:MAX_NEIGHBOURS]
+            neighbours, affinity = neighbours[keep], affinity[keep]
+
+        # Hop 2: everything those readers borrowed or rated
+        items, item_weights = [], []
+        for neighbour, weight in zip(neighbours, affinity):
+            if weight == 0:
+                continue
+            their_books, their_weights = self._row(self._by_user, self._pending_by_user, neighbour)
+            items.append(their_books)
+            item_weights.append(their_weights * weight)
+        if not items:
+            return np.zeros(n)
+        scores = np.bincount(np.concatenate(items), weights=np.concatenate(item_weights), minlength=n)
+        return np.divide(scores, norms, out=np.zeros(n), where=norms > 0)
+
+    def recommend(self, user_id: int, mode: str = "genre", genre: str = None, limit: int = 5) -> list:
+        """
+        Top `limit` (book_id, score) pairs for a user, excluding books they already borrowed or rated.
+        mode "genre" keeps books in the genres the user reads, "author" keeps books by
+        authors they read, "popular" ranks by loan count. An explicit genre overrides the mode filter.
+        """
+        n = self._n_books
+        if n == 0 or limit <= 0:
+            return []
+
+        candidates = self._active[:n].copy()
+        user = self._user_index.get(user_id)
+        seen = np.zeros(0, dtype=np.int32)
+        if user is not None:
+            seen, weights = self._user_books(user)
+            candidates[seen] = False
+
+        if genre is not None:
+            code = self._genre_codes.get(genre)
+            if code is None:
+                return []
+            candidates &= self._genre[:n] == code
+        elif mode == "genre" and len(seen):
+            candidates &= np.isin(self._genre[:n], self._genre[seen])
+        elif mode == "author" and len(seen):
+            candidates &= np.isin(self._author[:n], self._author[seen])
+
+        popularity = self._popularity[:n]
+        if mode == "popular" or not len(seen):
+            scores = popularity.copy()
+        else:
+            peak = popularity.max() or 1.0
+            scores = self._similarity(user, seen, weights) + POPULARITY_TIEBREAK * popularity / peak
+
+        count = int(candidates.sum())
+        if count == 0:
+            return []
+        scores[~candidates] = -np.inf
+        k = min(limit, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(self._book_ids[i]), float(scores[i])) for i in top]
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "books": self._n_books,
+            "users": len(self._user_index),
+            "interactions": len(self._weights) + len(self._pending),
+            "pending": len(self._pending),
+            "watermarks": dict(self._watermarks),
+        }
+
+
+recommender = RecommendationEngine()
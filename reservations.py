@@ -1,509 +1,1116 @@
-import aiosqlite
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from datetime import datetime, timedelta
-from typing import List, Optional
-
-DATABASE = "Library.db"
-
-app = FastAPI()
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# -------------------------------
-# Pydantic Models
-# -------------------------------
-
-class BorrowRequest(BaseModel):
-    user_id: int
-    book_id: int
-
-class ReturnRequest(BaseModel):
-    user_id: int
-    book_id: int
-
-class RenewRequest(BaseModel):
-    user_id: int
-    book_id: int
-
-class LoginRequest(BaseModel):
-    username: str
-    password: str
-    
-class AddBookRequest(BaseModel):
-    book_name: str
-    author: str
-    genre: str
-    year: int
-
-class UserRequest(BaseModel):
-    username: str
-    password: str
-
-class RegisterRequest(BaseModel):
-    username: str
-    password: str
-
-class ReviewResponse(BaseModel):
-    rating_id: int
-    user_id: int
-    username: str
-    book_id: int
-    rating: float
-
-class AddReviewRequest(BaseModel):
-    user_id: int
-    book_id: int
-    rating: float
-
-class RecommendationRequest(BaseModel):
-    user_id: int
-    genre: Optional[str] = None
-    limit: Optional[int] = 5
-
-# -------------------------------
-# API Endpoints
-# -------------------------------
-
-@app.post("/register/")
-async def register(request: RegisterRequest):
-    async with aiosqlite.connect(DATABASE) as db:
-        # Check if the user already exists
-        cursor = await db.execute("SELECT UserName FROM Users WHERE UserName = ?", (request.username,))
-        existing_user = await cursor.fetchone()
-        if existing_user:
-            raise HTTPException(status_code=400, detail="Username already exists.")
-
-        # Insert new user into the database
-        await db.execute("""
-            INSERT INTO Users (UserName, Password) 
-            VALUES (?, ?)
-        """, (request.username, request.password))
-        await db.commit()
-
-        return {"message": "User registered successfully", "success": True}
-    
-@app.get("/recommendations/{user_id}")
-async def get_recommendations(user_id: int, genre: Optional[str] = None, limit: int = 5):
-    """
-    Get book recommendations based on user's borrowing history and optionally filtered by genre.
-    If genre is provided, it will filter recommendations by that genre.
-    Limit controls the maximum number of recommendations returned.
-    """
-    async with aiosqlite.connect(DATABASE) as db:
-        # First check if user exists
-        cursor = await db.execute("SELECT UserID FROM Users WHERE UserID = ?", (user_id,))
-        user = await cursor.fetchone()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found.")
-        
-        # Get genres the user has borrowed in the past
-        cursor = await db.execute("""
-            SELECT DISTINCT B.Genre
-            FROM BorrowingHistory H
-            JOIN Books B ON H.BookID = B.BookID
-            WHERE H.UserID = ?
-        """, (user_id,))
-        preferred_genres = [row[0] for row in await cursor.fetchall()]
-        
-        # If user has no history, recommend popular books
-        if not preferred_genres:
-            query = """
-                SELECT B.BookID, B.BookName, B.Author, B.Genre, B.Year, COUNT(*) as popularity
-                FROM Books B
-                JOIN BorrowingHistory H ON B.BookID = H.BookID
-            """
-            params = []
-            
-            if genre:
-                query += " WHERE B.Genre = ?"
-                params.append(genre)
-                
-            query += " GROUP BY B.BookID ORDER BY popularity DESC LIMIT ?"
-            params.append(limit)
-            
-            cursor = await db.execute(query, params)
-        else:
-            # Get books in user's preferred genres that they haven't borrowed
-            query = """
-                SELECT B.BookID, B.BookName, B.Author, B.Genre, B.Year
-                FROM Books B
-                WHERE B.BookID NOT IN (
-                    SELECT BookID FROM BorrowingHistory WHERE UserID = ?
-                )
-            """
-            params = [user_id]
-            
-            if genre:
-                query += " AND B.Genre = ?"
-                params.append(genre)
-            elif preferred_genres:
-                placeholders = ','.join(['?' for _ in preferred_genres])
-                query += f" AND B.Genre IN ({placeholders})"
-                params.extend(preferred_genres)
-                
-            query += " LIMIT ?"
-            params.append(limit)
-            
-            cursor = await db.execute(query, params)
-            
-        books = await cursor.fetchall()
-        
-        if not books:
-            # Fallback to general recommendations if no matches
-            query = "SELECT BookID, BookName, Author, Genre, Year FROM Books"
-            params = []
-            
-            if genre:
-                query += " WHERE Genre = ?"
-                params.append(genre)
-                
-            query += " LIMIT ?"
-            params.append(limit)
-            
-            cursor = await db.execute(query, params)
-            books = await cursor.fetchall()
-        
-        return [{
-            "book_id": row[0],
-            "book_name": row[1],
-            "author": row[2],
-            "genre": row[3],
-            "year": row[4]
-        } for row in books]
-
-# Alternative endpoint that uses POST and the Pydantic model
-@app.post("/recommendations/")
-async def post_recommendations(request: RecommendationRequest):
-    return await get_recommendations(
-        user_id=request.user_id,
-        genre=request.genre,
-        limit=request.limit
-    )
-    
-@app.get("/books/")
-async def get_all_books():
-    async with aiosqlite.connect(DATABASE) as db:
-        cursor = await db.execute("""
-            SELECT BookID, BookName, Author, Genre, Year FROM Books
-        """)
-        books = await cursor.fetchall()
-
-        # Return books as a list of dictionaries
-        return [{
-            "book_id": row[0],
-            "book_name": row[1],
-            "author": row[2],
-            "genre": row[3],
-            "year": row[4],
-        } for row in books]
-    
-@app.get("/available/{book_id}")
-async def check_availability(book_id: int):
-    async with aiosqlite.connect(DATABASE) as db:
-        cursor = await db.execute("SELECT BookName FROM Books WHERE BookID = ?", (book_id,))
-        book = await cursor.fetchone()
-        if not book:
-            raise HTTPException(status_code=404, detail="Book not found.")
-
-        cursor = await db.execute("""
-            SELECT COUNT(*) FROM BorrowingHistory 
-            WHERE BookID = ? AND ReturnDate IS NULL
-        """, (book_id,))
-        borrowed_count = (await cursor.fetchone())[0]
-
-        return {"available": borrowed_count == 0}
-
-
-@app.post("/borrow/")
-async def borrow_book(request: BorrowRequest):
-    async with aiosqlite.connect(DATABASE) as db:
-        # Check if book exists
-        cursor = await db.execute("SELECT BookName FROM Books WHERE BookID = ?", (request.book_id,))
-        book = await cursor.fetchone()
-        if not book:
-            raise HTTPException(status_code=404, detail="Book not found.")
-
-        # Check if already borrowed
-        cursor = await db.execute("""
-            SELECT * FROM BorrowingHistory 
-            WHERE UserID = ? AND BookID = ? AND ReturnDate IS NULL
-        """, (request.user_id, request.book_id))
-        active = await cursor.fetchone()
-        if active:
-            raise HTTPException(status_code=400, detail="You have already borrowed this book.")
-
-        borrow_date = datetime.now().date()
-        due_date = borrow_date + timedelta(days=14)
-
-        await db.execute("""
-            INSERT INTO BorrowingHistory (UserID, BookID, BorrowDate, DueDate, ReturnDate) 
-            VALUES (?, ?, ?, ?, NULL)
-        """, (request.user_id, request.book_id, borrow_date, due_date))
-        await db.commit()
-
-        return {"message": "Book borrowed successfully.", "due_date": due_date}
-
-
-@app.post("/return/")
-async def return_book(request: ReturnRequest):
-    async with aiosqlite.connect(DATABASE) as db:
-        cursor = await db.execute("""
-            SELECT * FROM BorrowingHistory 
-            WHERE UserID = ? AND BookID = ? AND ReturnDate IS NULL
-        """, (request.user_id, request.book_id))
-        record = await cursor.fetchone()
-        if not record:
-            raise HTTPException(status_code=400, detail="No active loan found for this book.")
-
-        return_date = datetime.now().date()
-
-        await db.execute("""
-            UPDATE BorrowingHistory 
-            SET ReturnDate = ? 
-            WHERE HistoryID = ?
-        """, (return_date, record[0]))
-        await db.commit()
-
-        return {"message": "Book returned successfully."}
-
-
-@app.post("/renew/")
-async def renew_book(request: RenewRequest):
-    async with aiosqlite.connect(DATABASE) as db:
-        cursor = await db.execute("""
-            SELECT DueDate FROM BorrowingHistory 
-            WHERE UserID = ? AND BookID = ? AND ReturnDate IS NULL
-        """, (request.user_id, request.book_id))
-        record = await cursor.fetchone()
-        if not record:
-            raise HTTPException(status_code=400, detail="No active loan found for this book.")
-
-        # Convert string to date
-        due_date = datetime.strptime(record[0], "%Y-%m-%d").date()
-        new_due_date = due_date + timedelta(days=7)
-
-        await db.execute("""
-            UPDATE BorrowingHistory 
-            SET DueDate = ? 
-            WHERE UserID = ? AND BookID = ? AND ReturnDate IS NULL
-        """, (new_due_date, request.user_id, request.book_id))
-        await db.commit()
-
-        return {"message": "Book renewed successfully.", "new_due_date": new_due_date}
-
-
-@app.get("/mybooks/{user_id}")
-async def get_my_books(user_id: int):
-    async with aiosqlite.connect(DATABASE) as db:
-        cursor = await db.execute("""
-            SELECT H.BookID, B.BookName, H.BorrowDate, H.DueDate 
-            FROM BorrowingHistory H
-            JOIN Books B ON H.BookID = B.BookID
-            WHERE H.UserID = ? AND H.ReturnDate IS NULL
-        """, (user_id,))
-        books = await cursor.fetchall()
-        return [{"book_id": row[0], "book_name": row[1], "borrow_date": row[2], "due_date": row[3]} for row in books]
-
-#all users
-@app.get("/users/")
-async def get_all_users():
-    async with aiosqlite.connect(DATABASE) as db:
-        cursor = await db.execute("SELECT UserID, UserName, Password FROM Users")
-        user = await cursor.fetchall()
-
-        return [{
-            "user_id": user[0],
-            "username": user[1],
-            "password": user[2]
-        }]
-
-#User Login
-@app.post("/login/")
-async def login(request: LoginRequest):
-    async with aiosqlite.connect(DATABASE) as db:
-        cursor = await db.execute("SELECT UserID, UserName, Password FROM Users WHERE UserName = ?", (request.username,))
-        user = await cursor.fetchone()
-
-        if not user:
-            raise HTTPException(status_code=401, detail="Invalid username or password.")
-
-        actualPassword = user[2]  # Password from database
-        if actualPassword != request.password:
-            raise HTTPException(status_code=401, detail="Invalid username or password.")
-
-        # Check if the user is an admin
-        is_admin = request.username == "admin" and request.password == "password"
-
-        return {
-            "message": "Login successful",
-            "user_id": user[0],
-            "isAdmin": is_admin
-        }
-
-#admin functions    
-@app.post("/admin/add_book/")
-async def add_book(request: AddBookRequest):
-    async with aiosqlite.connect(DATABASE) as db:
-        cursor = await db.execute("SELECT * FROM Books WHERE BookName = ?", (request.book_name,))
-        book = await cursor.fetchone()
-        if book:
-            raise HTTPException(status_code=400, detail="Book already exists.")
-
-        await db.execute("""
-            INSERT INTO Books (BookName, Author, Genre, Year) 
-            VALUES (?, ?, ?, ?)
-        """, (request.book_name, request.author, request.genre, request.year))
-        await db.commit()
-
-# View all users
-@app.get("/admin/users/")
-async def get_all_users():
-    async with aiosqlite.connect(DATABASE) as db:
-        cursor = await db.execute("SELECT UserID, UserName FROM Users")
-        users = await cursor.fetchall()
-        return [{"user_id": user[0], "username": user[1]} for user in users]
-
-# Add a new user
-@app.post("/admin/add_user/")
-async def add_user(request: UserRequest):
-    async with aiosqlite.connect(DATABASE) as db:
-        await db.execute("INSERT INTO Users (UserName, Password) VALUES (?, ?)", (request.username, request.password))
-        await db.commit()
-        return {"message": "User added successfully!"}
-
-# Remove a user
-@app.delete("/admin/remove_user/{user_id}")
-async def remove_user(user_id: int):
-    async with aiosqlite.connect(DATABASE) as db:
-        cursor = await db.execute("SELECT * FROM Users WHERE UserID = ?", (user_id,))
-        user = await cursor.fetchone()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found.")
-
-        await db.execute("DELETE FROM Users WHERE UserID = ?", (user_id,))
-        await db.commit()
-        return {"message": "User removed successfully!"}
-
-# Route to remove a book
-@app.delete("/admin/remove_book/{book_id}")
-async def remove_book(book_id: int):
-    async with aiosqlite.connect(DATABASE) as db:
-        cursor = await db.execute("SELECT * FROM Books WHERE BookID = ?", (book_id,))
-        book = await cursor.fetchone()
-        if not book:
-            raise HTTPException(status_code=404, detail="Book not found.")
-
-        await db.execute("DELETE FROM Books WHERE BookID = ?", (book_id,))
-        await db.commit()
-        return {"message": "Book removed successfully!"}
-    
-#see all reviews
-@app.get("/reviews/")
-async def get_all_reviews():
-    async with aiosqlite.connect(DATABASE) as db:
-        cursor = await db.execute("""
-            SELECT R.RatingID, R.UserID, U.UserName, R.BookID, R.Rating 
-            FROM Ratings R
-            JOIN Users U ON R.UserID = U.UserID
-        """)
-        reviews = await cursor.fetchall()
-        
-        return [{
-            "rating_id": row[0],
-            "user_id": row[1],
-            "username": row[2],
-            "book_id": row[3],
-            "rating": row[4]
-        } for row in reviews]
-
-#see specific reviews
-@app.get("/reviews/{book_id}")
-async def get_book_reviews(book_id: int):
-    async with aiosqlite.connect(DATABASE) as db:
-        # First check if book exists
-        cursor = await db.execute("SELECT BookID FROM Books WHERE BookID = ?", (book_id,))
-        if not await cursor.fetchone():
-            raise HTTPException(status_code=404, detail="Book not found")
-            
-        cursor = await db.execute("""
-            SELECT R.RatingID, R.UserID, U.UserName, R.BookID, R.Rating 
-            FROM Ratings R
-            JOIN Users U ON R.UserID = U.UserID
-            WHERE R.BookID = ?
-        """, (book_id,))
-        reviews = await cursor.fetchall()
-        
-        return [{
-            "rating_id": row[0],
-            "user_id": row[1],
-            "username": row[2],
-            "book_id": row[3],
-            "rating": row[4]
-        } for row in reviews]
-    
-#add reviews
-@app.post("/reviews/add/")
-async def add_review(request: AddReviewRequest):
-    # Validate rating is between 0 and 5 (or whatever your scale is)
-    if not (0 <= request.rating <= 5):
-        raise HTTPException(status_code=400, detail="Rating must be between 0 and 5")
-    
-    async with aiosqlite.connect(DATABASE) as db:
-        # Check if user exists
-        cursor = await db.execute("SELECT UserID FROM Users WHERE UserID = ?", (request.user_id,))
-        if not await cursor.fetchone():
-            raise HTTPException(status_code=404, detail="User not found")
-            
-        # Check if book exists
-        cursor = await db.execute("SELECT BookID FROM Books WHERE BookID = ?", (request.book_id,))
-        if not await cursor.fetchone():
-            raise HTTPException(status_code=404, detail="Book not found")
-            
-        # Check if user already reviewed this book
-        cursor = await db.execute("""
-            SELECT RatingID FROM Ratings WHERE UserID = ? AND BookID = ?
-        """, (request.user_id, request.book_id))
-        if await cursor.fetchone():
-            raise HTTPException(status_code=400, detail="You have already reviewed this book")
-            
-        await db.execute("""
-            INSERT INTO Ratings (UserID, BookID, Rating)
-            VALUES (?, ?, ?)
-        """, (request.user_id, request.book_id, request.rating))
-        await db.commit()
-        
-        return {"message": "Review added successfully"}
-    
-@app.delete("/reviews/{review_id}")
-async def delete_review(review_id: int):
-    async with aiosqlite.connect(DATABASE) as db:
-        try:
-            # First check if review exists
-            cursor = await db.execute(
-                "SELECT UserID FROM Ratings WHERE RatingID = ?",
-                (review_id,)
-            )
-            review = await cursor.fetchone()
-            
-            if not review:
-                raise HTTPException(status_code=404, detail="Review not found")
-            
-            # Delete the review
-            await db.execute(
-                "DELETE FROM Ratings WHERE RatingID = ?",
-                (review_id,)
-            )
-            await db.commit()
-            
-            return {"message": "Review deleted successfully"}
-        except Exception as e:
-            await db.rollback()
-            raise HTTPException(status_code=500, detail=str(e))
+import aiosqlite
+import sqlite3
+from fastapi import FastAPI, HTTPException, Depends, Request, Query
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import BaseModel
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Optional
+from database import pool, get_db, get_write_db
+from migrations import apply_migrations, REBUILD_BOOK_RATINGS, REBUILD_BOOK_FACETS
+from pagination import list_response, rows_response, json_list, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from recommendations import recommender
+from cache import response_cache, ResponseCacheMiddleware
+from writequeue import write_queue
+from metrics import MetricsMiddleware, render as render_metrics, register_collector, slow_queries
+from auth import (kdf_pool, sessions, hash_password, verify_password, require_session, require_admin,
+                  authorize_user, cache_authorized, Session, SESSION_TTL)
+from coherence import change_watcher
+from events import event_bus
+from archive import archiver
+from overdue import overdue_scanner, DUE_SOON_DAYS
+from holds import (hold_sweeper, hand_on, queue_position, MAX_OPEN_HOLDS, READY_HOLD_JOIN,
+                   UNAVAILABLE_COLUMN)
+from admission import admission, AdmissionMiddleware
+from snapshot import catalog_snapshot, RATING_COLUMNS
+from compression import CompressionMiddleware
+from static import static_assets
+from lifecycle import lifecycle
+import resources
+import static
+import bulk
+import events
+
+# Startup runs as timed phases (see lifecycle.py); the worker reports ready
+# after the foreground ones and serves while the background ones finish
+async def startup():
+    lifecycle.begin()
+    async with lifecycle.phase("connect"):
+        await pool.open()
+    async with lifecycle.phase("schema"):
+        async with pool.writer() as db:
+            await apply_migrations(db)
+    async with lifecycle.phase("warm_up"):
+        await pool.warm_up()
+        await write_queue.start()
+    async with lifecycle.phase("caches"):
+        static_assets.build()
+        await change_watcher.start()
+    async with lifecycle.phase("workers"):
+        archiver.start()
+        overdue_scanner.start()
+        hold_sweeper.start()
+    lifecycle.mark_ready()
+
+    # Until it is built, recommendations answer 503 with Retry-After; a failed
+    # build is retried rather than leaving them unavailable until a restart
+    lifecycle.background("recommender", build_recommender, retry=True)
+    # Until it is loaded, the catalog is read from SQLite. Kept current by the
+    # change watcher's polls, so only with the watcher running
+    if catalog_snapshot.enabled and change_watcher.running:
+        lifecycle.background("snapshot", catalog_snapshot.start)
+
+async def build_recommender():
+    async with pool.reader() as db:
+        await recommender.build(db)
+        # Books, loans and ratings committed while it was building
+        await recommender.catch_up(db)
+
+async def shutdown():
+    await lifecycle.stop()
+    await hold_sweeper.stop()
+    await overdue_scanner.stop()
+    await archiver.stop()
+    await catalog_snapshot.stop()
+    await change_watcher.stop()
+    await write_queue.stop()
+    await pool.close()
+    kdf_pool.shutdown()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup()
+    yield
+    await shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+# Innermost: cache hits are answered before admission, since they never touch SQLite
+app.add_middleware(AdmissionMiddleware)
+
+# Added before CORS so cached responses still get CORS headers
+app.add_middleware(ResponseCacheMiddleware, authorize=cache_authorized)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+# Compresses what the cache and the static assets have not already encoded
+app.add_middleware(CompressionMiddleware)
+
+# Added last so it is outermost and times everything above
+app.add_middleware(MetricsMiddleware)
+
+app.include_router(resources.router)
+app.include_router(bulk.router)
+app.include_router(events.router)
+app.include_router(static.router)
+
+# -------------------------------
+# Pydantic Models
+# -------------------------------
+
+class BorrowRequest(BaseModel):
+    user_id: int
+    book_id: int
+
+class ReturnRequest(BaseModel):
+    user_id: int
+    book_id: int
+
+class RenewRequest(BaseModel):
+    user_id: int
+    book_id: int
+
+class HoldRequest(BaseModel):
+    user_id: int
+    book_id: int
+
+class LoginRequest(BaseModel):
+    username: str
+    password: str
+    
+class AddBookRequest(BaseModel):
+    book_name: str
+    author: str
+    genre: str
+    year: int
+
+class UserRequest(BaseModel):
+    username: str
+    password: str
+    is_admin: bool = False
+
+class RegisterRequest(BaseModel):
+    username: str
+    password: str
+
+class ReviewResponse(BaseModel):
+    rating_id: int
+    user_id: int
+    username: str
+    book_id: int
+    rating: float
+
+class AddReviewRequest(BaseModel):
+    user_id: int
+    book_id: int
+    rating: float
+
+class RecommendationRequest(BaseModel):
+    user_id: int
+    genre: Optional[str] = None
+    limit: Optional[int] = 5
+    by: Optional[str] = None
+    popular: bool = False
+
+# -------------------------------
+# Queries
+# -------------------------------
+# Lookups the endpoints issue, as constants so tests/test_query_plans.py
+# checks the statements that actually run: each is answered from an index.
+
+# Whole-table lists, read in keyset pages on the primary key
+BOOKS_SELECT = "SELECT BookID, BookName, Author, Genre, Year FROM Books"
+USERS_SELECT = "SELECT UserID, UserName FROM Users"
+
+USER_NAME_TAKEN = "SELECT UserName FROM Users WHERE UserName = ?"
+USER_LOGIN = """
+    SELECT U.UserID, U.Password, A.UserID IS NOT NULL
+    FROM Users U
+    LEFT JOIN Admins A ON A.UserID = U.UserID
+    WHERE U.UserName = ?
+"""
+USER_EXISTS = "SELECT UserID FROM Users WHERE UserID = ?"
+BOOK_EXISTS = "SELECT BookID FROM Books WHERE BookID = ?"
+BOOK_NAME = "SELECT BookName FROM Books WHERE BookID = ?"
+BOOK_BY_NAME = "SELECT * FROM Books WHERE BookName = ?"
+BOOKS_BY_ID = "SELECT BookID, BookName, Author, Genre, Year FROM Books WHERE BookID IN ({placeholders})"
+
+AVAILABILITY_BATCH = f"""
+    SELECT B.BookID, {UNAVAILABLE_COLUMN}
+    FROM Books B
+    LEFT JOIN BorrowingHistory H ON H.BookID = B.BookID AND H.ReturnDate IS NULL
+    {READY_HOLD_JOIN}
+    WHERE B.BookID IN ({{placeholders}})
+"""
+BOOK_ACTIVE_LOANS = "SELECT COUNT(*) FROM BorrowingHistory WHERE BookID = ? AND ReturnDate IS NULL"
+BOOK_READY_HOLDS = "SELECT COUNT(*) FROM Holds WHERE BookID = ? AND Status = 'ready'"
+
+# Book existence, its active loan and its ready hold (if any) in one lookup
+BOOK_LOAN_AND_HOLD = """
+    SELECT B.BookID, H.UserID, X.UserID
+    FROM Books B
+    LEFT JOIN BorrowingHistory H ON H.BookID = B.BookID AND H.ReturnDate IS NULL
+    LEFT JOIN Holds X ON X.BookID = B.BookID AND X.Status = 'ready'
+    WHERE B.BookID = ?
+"""
+FULFIL_HOLD = """
+    UPDATE Holds SET Status = 'fulfilled', ClosedAt = datetime('now')
+    WHERE UserID = ? AND BookID = ? AND Status IN ('waiting', 'ready')
+"""
+RETURN_LOAN = """
+    UPDATE BorrowingHistory SET ReturnDate = ?
+    WHERE UserID = ? AND BookID = ? AND ReturnDate IS NULL
+"""
+ACTIVE_LOAN = """
+    SELECT HistoryID, DueDate FROM BorrowingHistory
+    WHERE UserID = ? AND BookID = ? AND ReturnDate IS NULL
+"""
+RENEW_LOAN = "UPDATE BorrowingHistory SET DueDate = ? WHERE HistoryID = ?"
+
+USER_OPEN_HOLDS = "SELECT COUNT(*) FROM Holds WHERE UserID = ? AND Status IN ('waiting', 'ready')"
+HOLD_BY_ID = "SELECT UserID, BookID, Status FROM Holds WHERE HoldID = ?"
+CANCEL_HOLD = "UPDATE Holds SET Status = 'cancelled', ClosedAt = datetime('now') WHERE HoldID = ?"
+
+USER_BOOKS = """
+    SELECT H.BookID, B.BookName, H.BorrowDate, H.DueDate
+    FROM BorrowingHistory H
+    JOIN Books B ON H.BookID = B.BookID
+    WHERE H.UserID = ? AND H.ReturnDate IS NULL
+"""
+USER_HISTORY = """
+    SELECT H.HistoryID, H.BookID, B.BookName, H.BorrowDate, H.DueDate, H.ReturnDate
+    FROM AllLoans H
+    LEFT JOIN Books B ON H.BookID = B.BookID
+    WHERE H.UserID = ?
+    ORDER BY H.HistoryID DESC LIMIT ?
+"""
+USER_DUE_SOON = """
+    SELECT H.HistoryID, H.BookID, B.BookName, H.BorrowDate, H.DueDate
+    FROM BorrowingHistory H
+    LEFT JOIN Books B ON B.BookID = H.BookID
+    WHERE H.UserID = ? AND H.ReturnDate IS NULL AND H.DueDate < ?
+    ORDER BY H.DueDate
+"""
+USER_HOLDS = """
+    SELECT X.HoldID, X.BookID, B.BookName, X.Status, X.PlacedAt, X.PickupBy,
+           CASE WHEN X.Status = 'waiting' THEN (
+               SELECT COUNT(*) FROM Holds Q
+               WHERE Q.BookID = X.BookID AND Q.Status = 'waiting' AND Q.HoldID <= X.HoldID
+           ) END
+    FROM Holds X
+    LEFT JOIN Books B ON B.BookID = X.BookID
+    WHERE X.UserID = ? AND X.Status IN ('waiting', 'ready')
+    ORDER BY X.HoldID
+"""
+OVERDUE_PAGE = """
+    SELECT H.HistoryID, H.UserID, U.UserName, H.BookID, B.BookName, H.DueDate
+    FROM BorrowingHistory H
+    LEFT JOIN Users U ON U.UserID = H.UserID
+    LEFT JOIN Books B ON B.BookID = H.BookID
+    WHERE H.ReturnDate IS NULL AND H.DueDate < ? AND (H.DueDate, H.HistoryID) > (?, ?)
+    ORDER BY H.DueDate, H.HistoryID LIMIT ?
+"""
+
+REVIEWS_SELECT = """
+    SELECT R.RatingID, R.UserID, U.UserName, R.BookID, R.Rating
+    FROM Ratings R
+    JOIN Users U ON R.UserID = U.UserID
+"""
+BOOK_REVIEWS = f"{REVIEWS_SELECT} WHERE R.BookID = ?"
+USER_BOOK_REVIEW = "SELECT RatingID FROM Ratings WHERE UserID = ? AND BookID = ?"
+REVIEW_BY_ID = "SELECT UserID, BookID, Rating FROM Ratings WHERE RatingID = ?"
+
+
+def top_rated_query(genre: bool, after: bool) -> str:
+    """Keyset page over idx_bookratings_(genre_)score; parameters are (genre), (score, book_id), limit."""
+    where = (["R.Genre = ?"] if genre else []) + (["(R.Score, R.BookID) < (?, ?)"] if after else [])
+    return f"""
+        SELECT B.BookID, B.BookName, B.Author, B.Genre, B.Year, {RATING_COLUMNS}
+        FROM BookRatings R
+        JOIN Books B ON B.BookID = R.BookID
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY R.Score DESC, R.BookID DESC
+        LIMIT ?
+    """
+
+# -------------------------------
+# API Endpoints
+# -------------------------------
+
+@app.post("/register/")
+async def register(request: RegisterRequest):
+    password_hash = await kdf_pool.run(hash_password, request.password)
+
+    def create_user(db):
+        # Check if the user already exists
+        cursor = db.execute(USER_NAME_TAKEN, (request.username,))
+        existing_user = cursor.fetchone()
+        if existing_user:
+            raise HTTPException(status_code=400, detail="Username already exists.")
+
+        # Insert new user into the database
+        db.execute("""
+            INSERT INTO Users (UserName, Password) 
+            VALUES (?, ?)
+        """, (request.username, password_hash))
+
+    await write_queue.submit(create_user)
+    response_cache.invalidate("users")
+
+    return {"message": "User registered successfully", "success": True}
+    
+@app.get("/recommendations/{user_id}")
+async def get_recommendations(request: Request, user_id: int, genre: Optional[str] = None, limit: int = 5,
+                              by: Optional[str] = None, popular: bool = False,
+                              db: aiosqlite.Connection = Depends(get_db),
+                              session: Optional[Session] = Depends(require_session)):
+    """
+    Get book recommendations ranked by co-borrowing and co-rating similarity.
+    by=author limits them to authors the user has read, popular=true ranks by loan count,
+    otherwise they come from the genres the user reads.
+    If genre is provided, it will filter recommendations by that genre.
+    Limit controls the maximum number of recommendations returned.
+    """
+    authorize_user(session, user_id)
+
+    # First check if user exists
+    cursor = await db.execute(USER_EXISTS, (user_id,))
+    user = await cursor.fetchone()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found.")
+
+    if not recommender.ready:
+        # Still building in the background after a restart
+        raise HTTPException(status_code=503, detail="Recommendations are not available yet.",
+                            headers={"Retry-After": "1"})
+
+    mode = "popular" if popular else ("author" if by == "author" else "genre")
+    limit = max(1, min(limit, 100))
+    ranked = recommender.recommend(user_id, mode=mode, genre=genre, limit=limit)
+    if not ranked and genre is None:
+        # Fallback to general recommendations if no matches
+        ranked = recommender.recommend(user_id, mode="popular", limit=limit)
+    if not ranked:
+        return json_list(request, [])
+
+    scores = dict(ranked)
+    placeholders = ','.join(['?' for _ in ranked])
+    cursor = await db.execute(BOOKS_BY_ID.format(placeholders=placeholders), list(scores))
+    books = {row[0]: row for row in await cursor.fetchall()}
+
+    return json_list(request, [{
+        **book_to_dict(books[book_id]),
+        "score": round(score, 6)
+    } for book_id, score in ranked if book_id in books])
+
+# Alternative endpoint that uses POST and the Pydantic model
+@app.post("/recommendations/")
+async def post_recommendations(request: RecommendationRequest, http_request: Request,
+                               db: aiosqlite.Connection = Depends(get_db),
+                               session: Optional[Session] = Depends(require_session)):
+    return await get_recommendations(
+        http_request,
+        user_id=request.user_id,
+        genre=request.genre,
+        limit=request.limit,
+        by=request.by,
+        popular=request.popular,
+        db=db,
+        session=session
+    )
+    
+def book_to_dict(row):
+    return {
+        "book_id": row[0],
+        "book_name": row[1],
+        "author": row[2],
+        "genre": row[3],
+        "year": row[4],
+    }
+
+def rating_to_dict(values):
+    """Aggregates from RATING_COLUMNS; a book with no BookRatings row has no ratings."""
+    count, total, *histogram, score = values
+    if count is None:
+        return {"count": 0, "mean": None, "score": None, "histogram": [0] * 6}
+    return {"count": count, "mean": round(total / count, 3), "score": round(score, 4), "histogram": histogram}
+
+# One probe of idx_history_one_active_loan and one of idx_holds_one_ready per book;
+# at most one active loan and one ready hold can match
+BOOK_INCLUDES = {
+    "availability": (UNAVAILABLE_COLUMN,
+                     "LEFT JOIN BorrowingHistory H ON H.BookID = B.BookID AND H.ReturnDate IS NULL "
+                     + READY_HOLD_JOIN),
+    "ratings": (RATING_COLUMNS, "LEFT JOIN BookRatings R ON R.BookID = B.BookID"),
+}
+
+def books_query(includes: list):
+    """SELECT over Books joined with each requested include, and the row -> dict function for it."""
+    columns = ["B.BookID, B.BookName, B.Author, B.Genre, B.Year"]
+    joins = []
+    for name in includes:
+        columns.append(BOOK_INCLUDES[name][0])
+        joins.append(BOOK_INCLUDES[name][1])
+    select = f"SELECT {', '.join(columns)} FROM Books B {' '.join(joins)}"
+
+    def to_dict(row):
+        book = book_to_dict(row)
+        position = 5
+        for name in includes:
+            if name == "availability":
+                book["available"] = row[position] is None
+                position += 1
+            else:
+                book["rating"] = rating_to_dict(row[position:position + 9])
+                position += 9
+        return book
+
+    return select, to_dict
+
+MAX_AVAILABILITY_IDS = 1000
+
+@app.get("/books/")
+async def get_all_books(request: Request, after: Optional[int] = None, limit: Optional[int] = None,
+                        include: Optional[str] = None, db: aiosqlite.Connection = Depends(get_db)):
+    """
+    Without parameters the whole catalog is streamed as a JSON array.
+    Pass limit/after for keyset pages, or Accept: application/x-ndjson to stream rows.
+    include is a comma-separated list, from the same query:
+    availability adds "available", ratings adds "rating" (count, mean, Bayesian score, 0-5 star histogram).
+    In snapshot read mode the rows come from the catalog snapshot instead of SQLite.
+    """
+    includes = [name for name in BOOK_INCLUDES if name in (include or "").split(",")]
+    if catalog_snapshot.ready:
+        _, to_dict = books_query(includes)
+        return await rows_response(request, partial(catalog_snapshot.book_rows, includes), to_dict,
+                                   after=after, limit=limit)
+    if not includes:
+        return await list_response(request, db, BOOKS_SELECT, "BookID", book_to_dict, after=after, limit=limit)
+    select, to_dict = books_query(includes)
+    return await list_response(request, db, select, "B.BookID", to_dict, after=after, limit=limit)
+
+@app.get("/books/top-rated")
+async def get_top_rated_books(request: Request, genre: Optional[str] = None, after: Optional[str] = None,
+                              limit: int = DEFAULT_PAGE_SIZE, db: aiosqlite.Connection = Depends(get_db)):
+    """
+    Rated books by Bayesian average (ratings plus RatingPrior.Weight phantom
+    ratings at the catalog mean), best first, optionally within one genre.
+    Pages are keyset pages over idx_bookratings_(genre_)score: pass back next_after as after.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    params = []
+    if genre is not None:
+        params.append(genre)
+    if after is not None:
+        try:
+            score, book_id = after.split(",")
+            params += [float(score), int(book_id)]
+        except ValueError:
+            raise HTTPException(status_code=422, detail="after must be a next_after value from a previous page.")
+    cursor = await db.execute(top_rated_query(genre is not None, after is not None), (*params, limit + 1))
+    rows = await cursor.fetchall()
+    items = [{**book_to_dict(row), "rating": rating_to_dict(row[5:])} for row in rows[:limit]]
+    # repr() round-trips the float exactly, so the next page starts right after this row
+    next_after = f"{rows[limit - 1][-1]!r},{rows[limit - 1][0]}" if len(rows) > limit else None
+    return json_list(request, items, next_after=next_after)
+
+@app.get("/available/")
+@app.get("/available", include_in_schema=False)
+async def check_availability_batch(ids: str = Query(..., description="Comma-separated book IDs"),
+                                   db: aiosqlite.Connection = Depends(get_db)):
+    """Availability of many books in one query: {"available": {book_id: bool}, "not_found": [...]}"""
+    try:
+        book_ids = sorted({int(book_id) for book_id in ids.split(",") if book_id.strip()})
+    except ValueError:
+        raise HTTPException(status_code=422, detail="ids must be a comma-separated list of integers.")
+    if not book_ids or len(book_ids) > MAX_AVAILABILITY_IDS:
+        raise HTTPException(status_code=422, detail=f"Pass between 1 and {MAX_AVAILABILITY_IDS} ids.")
+
+    if catalog_snapshot.ready:
+        available = catalog_snapshot.available(book_ids)
+        return {"available": available, "not_found": [book_id for book_id in book_ids if book_id not in available]}
+
+    placeholders = ','.join(['?' for _ in book_ids])
+    cursor = await db.execute(AVAILABILITY_BATCH.format(placeholders=placeholders), book_ids)
+    available = {row[0]: row[1] is None for row in await cursor.fetchall()}
+
+    return {
+        "available": available,
+        "not_found": [book_id for book_id in book_ids if book_id not in available]
+    }
+
+@app.get("/available/{book_id}")
+async def check_availability(book_id: int, db: aiosqlite.Connection = Depends(get_db)):
+    if catalog_snapshot.ready:
+        available = catalog_snapshot.available([book_id])
+        if book_id not in available:
+            raise HTTPException(status_code=404, detail="Book not found.")
+        return {"available": available[book_id]}
+
+    cursor = await db.execute(BOOK_NAME, (book_id,))
+    book = await cursor.fetchone()
+    if not book:
+        raise HTTPException(status_code=404, detail="Book not found.")
+
+    cursor = await db.execute(BOOK_ACTIVE_LOANS, (book_id,))
+    borrowed_count = (await cursor.fetchone())[0]
+    # Returned, but set aside for the next patron in its hold queue
+    cursor = await db.execute(BOOK_READY_HOLDS, (book_id,))
+    held_count = (await cursor.fetchone())[0]
+
+    return {"available": borrowed_count == 0 and held_count == 0}
+
+
+def borrow_refused(status_code: int, reason: str, message: str) -> HTTPException:
+    """Refusals carry a machine-readable reason so clients need no extra lookups."""
+    return HTTPException(status_code=status_code, detail={"reason": reason, "message": message})
+
+
+@app.post("/borrow/")
+async def borrow_book(request: BorrowRequest, session: Optional[Session] = Depends(require_session)):
+    authorize_user(session, request.user_id)
+    borrow_date = datetime.now().date()
+    due_date = borrow_date + timedelta(days=14)
+
+    def borrow(db):
+        cursor = db.execute(BOOK_LOAN_AND_HOLD, (request.book_id,))
+        book = cursor.fetchone()
+        if not book:
+            raise borrow_refused(404, "not_found", "Book not found.")
+
+        holder, held_for = book[1], book[2]
+        if holder == request.user_id:
+            raise borrow_refused(400, "already_borrowed", "You have already borrowed this book.")
+        if holder is not None:
+            raise borrow_refused(409, "unavailable", "Sorry, this book is currently unavailable.")
+        if held_for is not None and held_for != request.user_id:
+            raise borrow_refused(409, "held", "Sorry, this book is being held for another patron.")
+
+        # Picking up a book set aside for this patron, or borrowing one they were queueing for
+        db.execute(FULFIL_HOLD, (request.user_id, request.book_id))
+        try:
+            cursor = db.execute("""
+                INSERT INTO BorrowingHistory (UserID, BookID, BorrowDate, DueDate, ReturnDate) 
+                VALUES (?, ?, ?, ?, NULL)
+            """, (request.user_id, request.book_id, borrow_date, due_date))
+        except sqlite3.IntegrityError:
+            # idx_history_one_active_loan: another connection got there first
+            raise borrow_refused(409, "unavailable", "Sorry, this book is currently unavailable.")
+        return cursor.lastrowid
+
+    history_id = await write_queue.submit(borrow)
+    recommender.record_loan(request.user_id, request.book_id, history_id)
+    response_cache.invalidate("loans")
+
+    return {"message": "Book borrowed successfully.", "due_date": due_date}
+
+
+@app.post("/return/")
+async def return_book(request: ReturnRequest, session: Optional[Session] = Depends(require_session)):
+    authorize_user(session, request.user_id)
+    return_date = datetime.now().date()
+
+    def give_back(db):
+        cursor = db.execute(RETURN_LOAN, (return_date, request.user_id, request.book_id))
+        if cursor.rowcount == 0:
+            raise HTTPException(status_code=400, detail="No active loan found for this book.")
+        # In the same transaction, so nobody else can borrow it in between
+        hand_on(db, request.book_id)
+
+    await write_queue.submit(give_back)
+    response_cache.invalidate("loans")
+
+    return {"message": "Book returned successfully."}
+
+
+@app.post("/renew/")
+async def renew_book(request: RenewRequest, session: Optional[Session] = Depends(require_session)):
+    authorize_user(session, request.user_id)
+    def renew(db):
+        cursor = db.execute(ACTIVE_LOAN, (request.user_id, request.book_id))
+        record = cursor.fetchone()
+        if not record:
+            raise HTTPException(status_code=400, detail="No active loan found for this book.")
+
+        # Convert string to date
+        due_date = datetime.strptime(record[1], "%Y-%m-%d").date()
+        new_due_date = due_date + timedelta(days=7)
+
+        db.execute(RENEW_LOAN, (new_due_date, record[0]))
+        return new_due_date
+
+    new_due_date = await write_queue.submit(renew)
+
+    return {"message": "Book renewed successfully.", "new_due_date": new_due_date}
+
+
+# Join the queue for a book that is out; returning it sets it aside for the head of the queue
+@app.post("/holds/", status_code=201)
+async def place_hold(request: HoldRequest, session: Optional[Session] = Depends(require_session)):
+    authorize_user(session, request.user_id)
+
+    def place(db):
+        cursor = db.execute(BOOK_LOAN_AND_HOLD, (request.book_id,))
+        book = cursor.fetchone()
+        if not book:
+            raise borrow_refused(404, "not_found", "Book not found.")
+        holder, held_for = book[1], book[2]
+        if holder == request.user_id:
+            raise borrow_refused(400, "already_borrowed", "You have already borrowed this book.")
+        if holder is None and held_for is None:
+            raise borrow_refused(409, "available", "This book is available, so you can borrow it now.")
+
+        cursor = db.execute(USER_OPEN_HOLDS, (request.user_id,))
+        if cursor.fetchone()[0] >= MAX_OPEN_HOLDS:
+            raise borrow_refused(409, "too_many_holds", f"You can have at most {MAX_OPEN_HOLDS} holds at once.")
+        try:
+            cursor = db.execute("INSERT INTO Holds (UserID, BookID) VALUES (?, ?)",
+                                (request.user_id, request.book_id))
+        except sqlite3.IntegrityError:
+            # idx_holds_user_open
+            raise borrow_refused(409, "already_held", "You already have a hold on this book.")
+        return cursor.lastrowid, queue_position(db, request.book_id, cursor.lastrowid)
+
+    hold_id, position = await write_queue.submit(place)
+    return {"message": "Hold placed.", "hold_id": hold_id, "book_id": request.book_id, "position": position}
+
+
+@app.delete("/holds/{hold_id}")
+async def cancel_hold(hold_id: int, session: Optional[Session] = Depends(require_session)):
+    def cancel(db):
+        cursor = db.execute(HOLD_BY_ID, (hold_id,))
+        hold = cursor.fetchone()
+        if not hold or hold[2] not in ("waiting", "ready"):
+            raise HTTPException(status_code=404, detail="No open hold found.")
+        authorize_user(session, hold[0])
+        db.execute(CANCEL_HOLD, (hold_id,))
+        if hold[2] == "ready":
+            hand_on(db, hold[1])
+        return hold[2]
+
+    if await write_queue.submit(cancel) == "ready":
+        response_cache.invalidate("loans")
+    return {"message": "Hold cancelled."}
+
+
+@app.get("/mybooks/{user_id}")
+async def get_my_books(request: Request, user_id: int, db: aiosqlite.Connection = Depends(get_db),
+                       session: Optional[Session] = Depends(require_session)):
+    authorize_user(session, user_id)
+    cursor = await db.execute(USER_BOOKS, (user_id,))
+    books = await cursor.fetchall()
+    return json_list(request, [{"book_id": row[0], "book_name": row[1], "borrow_date": row[2], "due_date": row[3]}
+                               for row in books])
+
+# Full loan history, archived loans included, newest first
+@app.get("/history/{user_id}")
+async def get_history(request: Request, user_id: int, limit: int = DEFAULT_PAGE_SIZE, db: aiosqlite.Connection = Depends(get_db),
+                      session: Optional[Session] = Depends(require_session)):
+    authorize_user(session, user_id)
+    cursor = await db.execute(USER_HISTORY, (user_id, max(1, min(limit, MAX_PAGE_SIZE))))
+    return json_list(request, [{"history_id": row[0], "book_id": row[1], "book_name": row[2], "borrow_date": row[3],
+                                "due_date": row[4], "return_date": row[5]} for row in await cursor.fetchall()])
+
+# Active loans due within `days` days, overdue ones first
+@app.get("/users/{user_id}/due-soon")
+async def get_due_soon(request: Request, user_id: int, days: int = DUE_SOON_DAYS, db: aiosqlite.Connection = Depends(get_db),
+                       session: Optional[Session] = Depends(require_session)):
+    authorize_user(session, user_id)
+    today = datetime.now().date()
+    cursor = await db.execute(USER_DUE_SOON, (user_id, today + timedelta(days=max(0, days) + 1)))
+    return json_list(request, [{"history_id": row[0], "book_id": row[1], "book_name": row[2], "borrow_date": row[3],
+                                "due_date": row[4], "overdue": row[4] < today.isoformat()}
+                               for row in await cursor.fetchall()])
+
+# Open holds: place in the queue while waiting, pickup deadline (UTC) once set aside
+@app.get("/users/{user_id}/holds")
+async def get_holds(request: Request, user_id: int, db: aiosqlite.Connection = Depends(get_db),
+                    session: Optional[Session] = Depends(require_session)):
+    authorize_user(session, user_id)
+    cursor = await db.execute(USER_HOLDS, (user_id,))
+    return json_list(request, [{"hold_id": row[0], "book_id": row[1], "book_name": row[2], "status": row[3],
+                                "placed_at": row[4], "pickup_by": row[5], "position": row[6]}
+                               for row in await cursor.fetchall()])
+
+# Overdue loans, longest overdue first, in keyset pages: pass back next_after as after
+@app.get("/admin/overdue", dependencies=[Depends(require_admin)])
+async def get_overdue(request: Request, after: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                      db: aiosqlite.Connection = Depends(get_db)):
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    today = datetime.now().date()
+    due_date, history_id = "", 0
+    if after is not None:
+        try:
+            due_date, history_id = after.split(",")
+            history_id = int(history_id)
+        except ValueError:
+            raise HTTPException(status_code=422, detail="after must be a next_after value from a previous page.")
+    cursor = await db.execute(OVERDUE_PAGE, (today, due_date, history_id, limit + 1))
+    rows = await cursor.fetchall()
+    items = [{"history_id": row[0], "user_id": row[1], "username": row[2], "book_id": row[3],
+              "book_name": row[4], "due_date": row[5],
+              "days_overdue": (today - datetime.strptime(row[5], "%Y-%m-%d").date()).days}
+             for row in rows[:limit]]
+    next_after = f"{rows[limit - 1][5]},{rows[limit - 1][0]}" if len(rows) > limit else None
+    return json_list(request, items, next_after=next_after)
+
+#all users (never their password hashes)
+@app.get("/users/", dependencies=[Depends(require_admin)])
+async def get_all_users(request: Request, db: aiosqlite.Connection = Depends(get_db)):
+    cursor = await db.execute(USERS_SELECT)
+    users = await cursor.fetchall()
+
+    return json_list(request, [{"user_id": user[0], "username": user[1]} for user in users])
+
+#User Login
+@app.post("/login/")
+async def login(request: LoginRequest):
+    kdf_pool.check_capacity()
+    # Only the lookup holds a reader; the KDF runs on its own threads afterwards
+    async with pool.reader() as db:
+        cursor = await db.execute(USER_LOGIN, (request.username,))
+        user = await cursor.fetchone()
+
+    matches, replacement = await kdf_pool.run(verify_password, request.password, user[1] if user else None)
+    if not matches:
+        raise HTTPException(status_code=401, detail="Invalid username or password.")
+
+    if replacement is not None:
+        # Plaintext or outdated hash: store the new one, unless it changed meanwhile
+        def rehash(db):
+            db.execute("UPDATE Users SET Password = ? WHERE UserID = ? AND Password = ?",
+                       (replacement, user[0], user[1]))
+        await write_queue.submit(rehash)
+
+    # Admin rights are stored per account (see the Admins table), not implied by the name
+    is_admin = bool(user[2])
+
+    return {
+        "message": "Login successful",
+        "user_id": user[0],
+        "isAdmin": is_admin,
+        "token": sessions.issue(user[0], is_admin),
+        "expires_in": SESSION_TTL
+    }
+
+#admin functions    
+@app.post("/admin/add_book/", dependencies=[Depends(require_admin)])
+async def add_book(request: AddBookRequest, db: aiosqlite.Connection = Depends(get_write_db)):
+    cursor = await db.execute(BOOK_BY_NAME, (request.book_name,))
+    book = await cursor.fetchone()
+    if book:
+        raise HTTPException(status_code=400, detail="Book already exists.")
+
+    cursor = await db.execute("""
+        INSERT INTO Books (BookName, Author, Genre, Year) 
+        VALUES (?, ?, ?, ?)
+    """, (request.book_name, request.author, request.genre, request.year))
+    await db.commit()
+    recommender.add_book(cursor.lastrowid, request.author, request.genre)
+    response_cache.invalidate("books")
+
+# View all users
+@app.get("/admin/users/", dependencies=[Depends(require_admin)])
+async def get_all_users(request: Request, after: Optional[int] = None, limit: Optional[int] = None,
+                        db: aiosqlite.Connection = Depends(get_db)):
+    return await list_response(request, db, USERS_SELECT, "UserID",
+                               lambda user: {"user_id": user[0], "username": user[1]}, after=after, limit=limit)
+
+# Add a new user
+@app.post("/admin/add_user/", dependencies=[Depends(require_admin)])
+async def add_user(request: UserRequest):
+    password_hash = await kdf_pool.run(hash_password, request.password)
+    # Hash first, so the writer is not held while the KDF runs
+    async with pool.writer() as db:
+        cursor = await db.execute(USER_NAME_TAKEN, (request.username,))
+        if await cursor.fetchone():
+            raise HTTPException(status_code=400, detail="Username already exists.")
+        cursor = await db.execute("INSERT INTO Users (UserName, Password) VALUES (?, ?)",
+                                  (request.username, password_hash))
+        if request.is_admin:
+            await db.execute("INSERT INTO Admins (UserID) VALUES (?)", (cursor.lastrowid,))
+        await db.commit()
+    response_cache.invalidate("users")
+    return {"message": "User added successfully!"}
+
+# Remove a user
+@app.delete("/admin/remove_user/{user_id}", dependencies=[Depends(require_admin)])
+async def remove_user(user_id: int, db: aiosqlite.Connection = Depends(get_write_db)):
+    cursor = await db.execute("SELECT * FROM Users WHERE UserID = ?", (user_id,))
+    user = await cursor.fetchone()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found.")
+
+    await db.execute("DELETE FROM Users WHERE UserID = ?", (user_id,))
+    await db.commit()
+    sessions.revoke_user(user_id)
+    # /reviews/ joins on Users, so the user's reviews drop out of it too
+    response_cache.invalidate("users", "reviews")
+    return {"message": "User removed successfully!"}
+
+# Route to remove a book
+@app.delete("/admin/remove_book/{book_id}", dependencies=[Depends(require_admin)])
+async def remove_book(book_id: int, db: aiosqlite.Connection = Depends(get_write_db)):
+    cursor = await db.execute("SELECT * FROM Books WHERE BookID = ?", (book_id,))
+    book = await cursor.fetchone()
+    if not book:
+        raise HTTPException(status_code=404, detail="Book not found.")
+
+    await db.execute("DELETE FROM Books WHERE BookID = ?", (book_id,))
+    await db.commit()
+    recommender.remove_book(book_id)
+    response_cache.invalidate("books")
+    return {"message": "Book removed successfully!"}
+
+# -------------------------------
+# Health
+# -------------------------------
+
+# Liveness: the process is up and its event loop is answering
+@app.get("/health/live")
+async def health_live():
+    return {"status": "alive"}
+
+# Readiness: startup's foreground phases are done and the worker is not shutting
+# down. Background phases still running, or failed and waiting to be retried,
+# are listed but do not make it unready
+@app.get("/health/ready")
+async def health_ready():
+    stats = lifecycle.stats()
+    body = {"status": stats["state"], "ready_seconds": stats["ready_seconds"],
+            "background_pending": stats["background_pending"], "background_failed": stats["background_failed"]}
+    if not lifecycle.ready:
+        return JSONResponse(body, status_code=503, headers={"Retry-After": "1"})
+    return body
+
+# Time taken by each startup phase
+@app.get("/admin/startup_stats/", dependencies=[Depends(require_admin)])
+async def get_startup_stats():
+    return lifecycle.stats()
+
+# Connection pool usage, for sizing READER_COUNT
+@app.get("/admin/pool_stats/", dependencies=[Depends(require_admin)])
+async def get_pool_stats():
+    return pool.stats()
+
+# Group-commit batch sizes and latency
+@app.get("/admin/write_queue_stats/", dependencies=[Depends(require_admin)])
+async def get_write_queue_stats():
+    return write_queue.stats()
+
+# Password hashing pool load and session cache hit rates
+@app.get("/admin/auth_stats/", dependencies=[Depends(require_admin)])
+async def get_auth_stats():
+    return {"kdf": kdf_pool.stats(), "sessions": sessions.stats()}
+
+# Cross-process change detection
+@app.get("/admin/sync_stats/", dependencies=[Depends(require_admin)])
+async def get_sync_stats():
+    return change_watcher.stats()
+
+# Open /events streams and slow consumers dropped
+@app.get("/admin/event_stats/", dependencies=[Depends(require_admin)])
+async def get_event_stats():
+    return event_bus.stats()
+
+# Loans moved to LoanArchive and pages vacuumed
+@app.get("/admin/archive_stats/", dependencies=[Depends(require_admin)])
+async def get_archive_stats():
+    return archiver.stats()
+
+# Concurrency slots, queues and rate limiting per route class
+@app.get("/admin/admission_stats/", dependencies=[Depends(require_admin)])
+async def get_admission_stats():
+    return admission.stats()
+
+# Catalog snapshot size, load time, catch-up and verification
+@app.get("/admin/snapshot_stats/", dependencies=[Depends(require_admin)])
+async def get_snapshot_stats():
+    return catalog_snapshot.stats()
+
+# Overdue scanner progress
+@app.get("/admin/overdue_stats/", dependencies=[Depends(require_admin)])
+async def get_overdue_stats():
+    return overdue_scanner.stats()
+
+# Hold expiry sweeps
+@app.get("/admin/hold_stats/", dependencies=[Depends(require_admin)])
+async def get_hold_stats():
+    return hold_sweeper.stats()
+
+# Recompute every book's rating aggregates and the prior mean from Ratings
+@app.post("/admin/ratings/rebuild", dependencies=[Depends(require_admin)])
+async def rebuild_rating_aggregates():
+    def rebuild(db):
+        for statement in REBUILD_BOOK_RATINGS:
+            db.execute(statement)
+        return db.execute("SELECT COUNT(*), (SELECT Mean FROM RatingPrior) FROM BookRatings").fetchone()
+
+    books, mean = await write_queue.submit(rebuild)
+    # The rebuild writes no Events, so the snapshot cannot follow it
+    await catalog_snapshot.reload()
+    response_cache.invalidate("reviews")
+    return {"message": "Rating aggregates rebuilt.", "rated_books": books, "prior_mean": round(mean, 4)}
+
+# Recompute the genre, author and decade counts behind /api/books/facets from Books
+@app.post("/admin/facets/rebuild", dependencies=[Depends(require_admin)])
+async def rebuild_facet_counts():
+    def rebuild(db):
+        for statement in REBUILD_BOOK_FACETS:
+            db.execute(statement)
+        return db.execute("SELECT COUNT(*) FROM BookFacets").fetchone()[0]
+
+    values = await write_queue.submit(rebuild)
+    return {"message": "Facet counts rebuilt.", "facet_values": values}
+
+# Response cache hit rates and memory use
+@app.get("/admin/cache_stats/", dependencies=[Depends(require_admin)])
+async def get_cache_stats():
+    return response_cache.stats()
+
+# Pages and assets served, with each file's size per encoding
+@app.get("/admin/static_stats/", dependencies=[Depends(require_admin)])
+async def get_static_stats():
+    return static_assets.stats()
+
+
+@app.get("/admin/slow_queries/", dependencies=[Depends(require_admin)])
+async def get_slow_queries():
+    """Most recent statements over the slow-query threshold, newest first, with their plans."""
+    return list(reversed(slow_queries.recent))
+
+
+def component_metrics() -> dict:
+    pool_stats = pool.stats()
+    queue = write_queue.stats()
+    cache = response_cache.stats()
+    kdf = kdf_pool.stats()
+    sync = change_watcher.stats()
+    stream = event_bus.stats()
+    archived = archiver.stats()
+    overdue = overdue_scanner.stats()
+    holds = hold_sweeper.stats()
+    admitted = admission.stats()
+    classes = admitted["classes"]
+    snapshot = catalog_snapshot.stats()
+    served = static_assets.stats()
+    started = lifecycle.stats()
+    return {
+        "library_db_readers_idle": ("gauge", "Idle reader connections.", pool_stats["readers"]["idle"]),
+        "library_db_readers_waiting": ("gauge", "Requests waiting for a reader.", pool_stats["readers"]["waiting"]),
+        "library_write_queue_depth": ("gauge", "Operations waiting in the write queue.", queue["queue_depth"]),
+        "library_write_queue_batches_total": ("counter", "Batches committed.", queue["batches"]),
+        "library_write_queue_operations_total": ("counter", "Operations applied.", queue["operations"]),
+        "library_write_queue_failed_operations_total": ("counter", "Operations that raised.", queue["failed_operations"]),
+        "library_cache_bytes": ("gauge", "Bytes held by the response cache.", cache["bytes"]),
+        "library_cache_requests_total": ("counter", "Response cache lookups by result.", {
+            (("result", "hit"),): cache["hits"],
+            (("result", "miss"),): cache["misses"],
+            (("result", "not_modified"),): cache["not_modified"],
+        }),
+        "library_kdf_pending": ("gauge", "Password hashes running or queued.", kdf["pending"]),
+        "library_kdf_calls_total": ("counter", "Password hashes computed.", kdf["calls"]),
+        "library_kdf_rejected_total": ("counter", "Sign-ins refused because the KDF queue was full.", kdf["rejected"]),
+        "library_sessions_cached": ("gauge", "Verified session tokens in the LRU.", sessions.stats()["cached"]),
+        "library_sync_changes_total": ("counter", "Polls that found newly committed writes.", sync["changes"]),
+        "library_sync_errors_total": ("counter", "Change watcher polls that failed.", sync["errors"]),
+        "library_event_streams": ("gauge", "Open /events streams.", stream["subscribers"]),
+        "library_events_published_total": ("counter", "Events fanned out to streams.", stream["published"]),
+        "library_event_streams_dropped_total": ("counter", "Streams closed for falling behind.", stream["dropped"]),
+        "library_loans_archived_total": ("counter", "Returned loans moved to LoanArchive.", archived["moved"]),
+        "library_vacuumed_pages_total": ("counter", "Free pages released by incremental vacuum.",
+                                         archived["vacuumed_pages"]),
+        "library_loans_noticed_overdue_total": ("counter", "Loans that became overdue while out.",
+                                                overdue["noticed"]),
+        "library_holds_expired_total": ("counter", "Holds not picked up before their deadline.", holds["expired"]),
+        "library_admission_in_flight": ("gauge", "Requests holding a concurrency slot, by route class.", {
+            (("class", name),): limit["active"] for name, limit in classes.items()
+        }),
+        "library_admission_queued": ("gauge", "Requests waiting for a concurrency slot, by route class.", {
+            (("class", name),): limit["waiting"] for name, limit in classes.items()
+        }),
+        "library_admission_rejected_total": ("counter", "Requests refused with 503, by route class and reason.", {
+            (("class", name), ("reason", reason)): limit[reason]
+            for name, limit in classes.items() for reason in ("queue_full", "deadline")
+        }),
+        "library_rate_limited_total": ("counter", "Requests refused with 429 by the per-client rate limit.",
+                                       admitted["rate_limit"]["limited"]),
+        "library_snapshot_books": ("gauge", "Books held by the catalog snapshot.", snapshot["books"]),
+        "library_snapshot_bytes": ("gauge", "Memory held by the catalog snapshot.", snapshot["bytes"]),
+        "library_snapshot_events_total": ("counter", "Change events applied to the catalog snapshot.",
+                                          snapshot["events"]),
+        "library_snapshot_mismatches_total": ("counter", "Verifications that found the snapshot out of date.",
+                                              snapshot["mismatches"]),
+        "library_static_bytes_sent_total": ("counter", "Page and asset bytes sent, by content encoding.", {
+            (("encoding", coding),): sent for coding, sent in served["bytes_sent"].items()
+        }),
+        "library_cache_compressions_total": ("counter", "Cached bodies gzipped.", cache["compressions"]),
+        "library_ready": ("gauge", "1 once startup's foreground phases are done, 0 while starting or stopping.",
+                          int(lifecycle.ready)),
+        "library_startup_phase_seconds": ("gauge", "Seconds each startup phase took, 0 while it runs.", {
+            (("phase", name),): phase["seconds"] or 0.0 for name, phase in started["phases"].items()
+        }),
+    }
+
+register_collector(component_metrics)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus text exposition format."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+#see all reviews
+def review_to_dict(row):
+    return {
+        "rating_id": row[0],
+        "user_id": row[1],
+        "username": row[2],
+        "book_id": row[3],
+        "rating": row[4]
+    }
+
+@app.get("/reviews/")
+async def get_all_reviews(request: Request, after: Optional[int] = None, limit: Optional[int] = None,
+                          db: aiosqlite.Connection = Depends(get_db)):
+    return await list_response(request, db, REVIEWS_SELECT, "R.RatingID", review_to_dict, after=after, limit=limit)
+
+#see specific reviews
+@app.get("/reviews/{book_id}")
+async def get_book_reviews(request: Request, book_id: int, db: aiosqlite.Connection = Depends(get_db)):
+    # First check if book exists
+    if catalog_snapshot.ready:
+        exists = catalog_snapshot.has_book(book_id)
+    else:
+        cursor = await db.execute(BOOK_EXISTS, (book_id,))
+        exists = await cursor.fetchone() is not None
+    if not exists:
+        raise HTTPException(status_code=404, detail="Book not found")
+        
+    cursor = await db.execute(BOOK_REVIEWS, (book_id,))
+    reviews = await cursor.fetchall()
+    
+    return json_list(request, [review_to_dict(row) for row in reviews])
+    
+#add reviews
+@app.post("/reviews/add/")
+async def add_review(request: AddReviewRequest, session: Optional[Session] = Depends(require_session)):
+    authorize_user(session, request.user_id)
+    # Validate rating is between 0 and 5 (or whatever your scale is)
+    if not (0 <= request.rating <= 5):
+        raise HTTPException(status_code=400, detail="Rating must be between 0 and 5")
+    
+    def create_review(db):
+        # Check if user exists
+        cursor = db.execute(USER_EXISTS, (request.user_id,))
+        if not cursor.fetchone():
+            raise HTTPException(status_code=404, detail="User not found")
+        
+        # Check if book exists
+        cursor = db.execute(BOOK_EXISTS, (request.book_id,))
+        if not cursor.fetchone():
+            raise HTTPException(status_code=404, detail="Book not found")
+        
+        # Check if user already reviewed this book
+        cursor = db.execute(USER_BOOK_REVIEW, (request.user_id, request.book_id))
+        if cursor.fetchone():
+            raise HTTPException(status_code=400, detail="You have already reviewed this book")
+        
+        cursor = db.execute("""
+            INSERT INTO Ratings (UserID, BookID, Rating)
+            VALUES (?, ?, ?)
+        """, (request.user_id, request.book_id, request.rating))
+        return cursor.lastrowid
+
+    rating_id = await write_queue.submit(create_review)
+    recommender.record_rating(request.user_id, request.book_id, request.rating, rating_id)
+    response_cache.invalidate("reviews")
+    
+    return {"message": "Review added successfully"}
+    
+@app.delete("/reviews/{review_id}")
+async def delete_review(review_id: int, db: aiosqlite.Connection = Depends(get_write_db),
+                        session: Optional[Session] = Depends(require_session)):
+    try:
+        # First check if review exists
+        cursor = await db.execute(REVIEW_BY_ID, (review_id,))
+        review = await cursor.fetchone()
+        
+        if not review:
+            raise HTTPException(status_code=404, detail="Review not found")
+        # Reviewers may delete their own reviews; admins any
+        authorize_user(session, review[0])
+        
+        # Delete the review
+        await db.execute(
+            "DELETE FROM Ratings WHERE RatingID = ?",
+            (review_id,)
+        )
+        await db.commit()
+        recommender.remove_rating(*review)
+        response_cache.invalidate("reviews")
+        
+        return {"message": "Review deleted successfully"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,130 +1,299 @@
-from fastapi import APIRouter, HTTPException, status, Query
-from pydantic import BaseModel
-from enum import Enum
-from datetime import datetime
-import aiosqlite
-
-DATABASE = "Library.db"
-
-# -------------------------------
-# Pydantic Model for Book
-# -------------------------------
-class Book(BaseModel):
-    title: str
-    author: str
-    genre: str
-    year: int 
-
-# Create the FastAPI router
-router = APIRouter(
-    prefix="/api/books",
-    tags=["Books"],
-    responses={404: {"description": "Resource not found"}}
-)
-
-# -------------------------------
-# Helper Functions to Interact with SQLite
-# -------------------------------
-async def get_db_connection():
-    db = await aiosqlite.connect(DATABASE)
-    return db
-
-# -------------------------------
-# API Endpoints
-# -------------------------------
-
-@router.post("/", 
-            status_code=status.HTTP_201_CREATED,
-            summary="Add new resource",
-            response_description="Details of added/updated resource")
-async def add_book(book: Book):
-    """
-    Handles resource creation/updates:
-    - Checks for existing book by title and author.
-    - If the book already exists, it does nothing since only one copy per book.
-    - Inserts new book record.
-    """
-    try:
-        # Connect to database
-        async with await get_db_connection() as db:
-            cursor = await db.execute("SELECT * FROM Books WHERE BookName = ? AND Author = ?", 
-                                       (book.title, book.author))
-            existing = await cursor.fetchone()
-
-            if existing:
-                return {
-                    "id": existing[0],
-                    "message": "Book already exists with the same title and author",
-                    "book_name": existing[1],
-                    "author": existing[2],
-                    "genre": existing[3],
-                    "year": existing[4]
-                }
-
-            # New resource: insert into database
-            await db.execute(""" 
-                INSERT INTO Books (BookName, Author, Genre, Year) 
-                VALUES (?, ?, ?, ?) 
-            """, (book.title, book.author, book.genre, book.year))
-            await db.commit()
-
-            return {
-                "id": cursor.lastrowid,
-                "message": "New book added successfully",
-                "book_name": book.title,
-                "author": book.author,
-                "genre": book.genre,
-                "year": book.year
-            }
-
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Database operation failed: {str(e)}"
-        )
-
-
-@router.get("/",
-           summary="Search resources",
-           response_description="List of matching resources")
-async def search_books(
-    title: str = Query(None, description="Partial title match"),
-    author: str = Query(None, description="Partial author match"),
-    genre: str = Query(None, description="Exact genre match"),
-    sort_by: str = Query("title", enum=["title", "author", "year"]),
-    sort_order: str = Query("asc", enum=["asc", "desc"])
-):
-    """Search endpoint with filters and sorting"""
-    try:
-        query = []
-        params = []
-
-        if title:
-            query.append("BookName LIKE ?")
-            params.append(f"%{title}%")
-        if author:
-            query.append("Author LIKE ?")
-            params.append(f"%{author}%")
-        if genre:
-            query.append("Genre = ?")
-            params.append(genre)
-
-        where_clause = " AND ".join(query) if query else "1=1"
-        order_by = f"ORDER BY {sort_by} {sort_order.upper()}"
-
-        async with await get_db_connection() as db:
-            cursor = await db.execute(f"SELECT * FROM Books WHERE {where_clause} {order_by}", tuple(params))
-            resources = await cursor.fetchall()
-            return [{
-                "id": row[0], 
-                "book_name": row[1],
-                "author": row[2],
-                "genre": row[3],
-                "year": row[4]
-            } for row in resources]
-
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Search failed: {str(e)}"
-        )
+from fastapi import APIRouter, HTTPException, status, Query, Depends, Request
+from pydantic import BaseModel
+from enum import Enum
+from datetime import datetime
+from collections import Counter
+import re
+import aiosqlite
+from database import get_db, get_write_db
+from recommendations import recommender
+from cache import response_cache
+from pagination import json_list
+from auth import require_admin
+
+# -------------------------------
+# Pydantic Model for Book
+# -------------------------------
+class Book(BaseModel):
+    title: str
+    author: str
+    genre: str
+    year: int 
+
+# Create the FastAPI router
+router = APIRouter(
+    prefix="/api/books",
+    tags=["Books"],
+    responses={404: {"description": "Resource not found"}}
+)
+
+# -------------------------------
+# Search Helpers
+# -------------------------------
+MAX_SEARCH_RESULTS = 500
+
+SORT_COLUMNS = {
+    "title": "B.BookName",
+    "author": "B.Author",
+    "year": "B.Year",
+}
+
+# Facet values returned per facet, and books counted per request when a text filter is set
+MAX_FACET_VALUES = 200
+MAX_FACET_MATCHES = 20_000
+FACETS = ("genre", "author", "decade")
+
+def _prefix_terms(text: str) -> str:
+    # Quote every word so user input can never be parsed as FTS5 syntax
+    words = re.findall(r"\w+", text or "")
+    return " ".join(f'"{word}"*' for word in words)
+
+def build_match_expression(q: str = None, title: str = None, author: str = None) -> str:
+    """Turn the search parameters into an FTS5 MATCH expression, or "" if there is no text filter."""
+    parts = []
+    if _prefix_terms(q):
+        parts.append(_prefix_terms(q))
+    if _prefix_terms(title):
+        parts.append(f"BookName : ({_prefix_terms(title)})")
+    if _prefix_terms(author):
+        parts.append(f"Author : ({_prefix_terms(author)})")
+    return " AND ".join(parts)
+
+def decade(year: int) -> int:
+    """(Year / 10) * 10 as SQLite computes it for the stored facets: truncated towards zero, so -1999 -> -1990."""
+    return -(-year // 10) * 10 if year < 0 else year // 10 * 10
+
+# -------------------------------
+# Queries
+# -------------------------------
+# As constants so tests/test_query_plans.py checks the statements that run
+
+BOOK_BY_TITLE_AUTHOR = "SELECT * FROM Books WHERE BookName = ? AND Author = ?"
+
+SEARCH_MATCH_SELECT = """
+    SELECT B.BookID, B.BookName, B.Author, B.Genre, B.Year,
+           snippet(BooksSearch, -1, '<mark>', '</mark>', '...', 16),
+           BooksSearch.rank
+    FROM BooksSearch
+    JOIN Books B ON B.BookID = BooksSearch.rowid
+    WHERE BooksSearch MATCH ?
+"""
+
+FACET_VALUES = """
+    SELECT Value, Books, Available FROM BookFacets
+    WHERE Scope = ? AND Facet = ? AND Books > 0
+    ORDER BY Books DESC, Value LIMIT ?
+"""
+GENRE_FACET = "SELECT Value, Books, Available FROM BookFacets WHERE Scope = '*' AND Facet = 'genre' AND Value = ? AND Books > 0"
+FACET_TOTALS = """
+    SELECT IFNULL(SUM(Books), 0), IFNULL(SUM(Available), 0) FROM BookFacets
+    WHERE Scope = '*' AND Facet = 'genre'
+"""
+# CROSS JOIN keeps the match as the outer loop; given a genre, the planner
+# would otherwise walk every book of that genre and probe the index per book
+MATCHED_FACETS_SELECT = """
+    SELECT B.Genre, B.Author, B.Year, H.HistoryID IS NULL
+    FROM BooksSearch
+    CROSS JOIN Books B ON B.BookID = BooksSearch.rowid
+    LEFT JOIN BorrowingHistory H ON H.BookID = B.BookID AND H.ReturnDate IS NULL
+    WHERE BooksSearch MATCH ?
+"""
+
+
+def search_query(match: bool, genre: bool, sort_by: str = "relevance", sort_order: str = "asc") -> str:
+    """The search statement; its parameters are the MATCH expression (if any), the genre (if any) and the limit."""
+    if match:
+        sql = SEARCH_MATCH_SELECT + (" AND B.Genre = ?" if genre else "")
+    else:
+        sql = "SELECT B.BookID, B.BookName, B.Author, B.Genre, B.Year FROM Books B"
+        sql += " WHERE B.Genre = ?" if genre else ""
+    if sort_by == "relevance" and match:
+        sql += " ORDER BY BooksSearch.rank"
+    else:
+        column = SORT_COLUMNS.get(sort_by, "B.BookName")
+        sql += f" ORDER BY {column} {sort_order.upper()}"
+    return sql + " LIMIT ?"
+
+
+def matched_facets_query(genre: bool) -> str:
+    """Facet rows of the books matching an FTS5 expression; parameters are the match, (genre), the limit."""
+    return MATCHED_FACETS_SELECT + (" AND B.Genre = ?" if genre else "") + " LIMIT ?"
+
+# -------------------------------
+# API Endpoints
+# -------------------------------
+
+@router.post("/", 
+            status_code=status.HTTP_201_CREATED,
+            dependencies=[Depends(require_admin)],
+            summary="Add new resource",
+            response_description="Details of added/updated resource")
+async def add_book(book: Book, db: aiosqlite.Connection = Depends(get_write_db)):
+    """
+    Handles resource creation/updates:
+    - Checks for existing book by title and author.
+    - If the book already exists, it does nothing since only one copy per book.
+    - Inserts new book record.
+    """
+    try:
+        cursor = await db.execute(BOOK_BY_TITLE_AUTHOR, (book.title, book.author))
+        existing = await cursor.fetchone()
+
+        if existing:
+            return {
+                "id": existing[0],
+                "message": "Book already exists with the same title and author",
+                "book_name": existing[1],
+                "author": existing[2],
+                "genre": existing[3],
+                "year": existing[4]
+            }
+
+        # New resource: insert into database
+        cursor = await db.execute(""" 
+            INSERT INTO Books (BookName, Author, Genre, Year) 
+            VALUES (?, ?, ?, ?) 
+        """, (book.title, book.author, book.genre, book.year))
+        await db.commit()
+        recommender.add_book(cursor.lastrowid, book.author, book.genre)
+        response_cache.invalidate("books")
+
+        return {
+            "id": cursor.lastrowid,
+            "message": "New book added successfully",
+            "book_name": book.title,
+            "author": book.author,
+            "genre": book.genre,
+            "year": book.year
+        }
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Database operation failed: {str(e)}"
+        )
+
+
+@router.get("/",
+           summary="Search resources",
+           response_description="List of matching resources")
+async def search_books(
+    request: Request,
+    q: str = Query(None, description="Full-text match on title, author and genre"),
+    title: str = Query(None, description="Title words (prefix match)"),
+    author: str = Query(None, description="Author words (prefix match)"),
+    genre: str = Query(None, description="Exact genre match"),
+    sort_by: str = Query("relevance", enum=["relevance", "title", "author", "year"]),
+    sort_order: str = Query("asc", enum=["asc", "desc"]),
+    limit: int = Query(50, ge=1, le=MAX_SEARCH_RESULTS),
+    db: aiosqlite.Connection = Depends(get_db)
+):
+    """
+    Search endpoint with filters and sorting.
+    Text filters go through the BooksSearch FTS5 index and are ranked by bm25;
+    matching words are wrapped in <mark> tags in the snippet field.
+    """
+    try:
+        match = build_match_expression(q=q, title=title, author=author)
+        params = [value for value in (match, genre) if value] + [limit]
+        sql = search_query(bool(match), bool(genre), sort_by, sort_order)
+
+        cursor = await db.execute(sql, tuple(params))
+        resources = await cursor.fetchall()
+
+        results = []
+        for row in resources:
+            result = {
+                "id": row[0],
+                "book_name": row[1],
+                "author": row[2],
+                "genre": row[3],
+                "year": row[4]
+            }
+            if match:
+                result["snippet"] = row[5]
+                result["score"] = row[6]
+            results.append(result)
+        return json_list(request, results)
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Search failed: {str(e)}"
+        )
+
+
+@router.get("/facets",
+           summary="Facet counts",
+           response_description="Books and available books per genre, author and decade")
+async def book_facets(
+    q: str = Query(None, description="Full-text match on title, author and genre"),
+    title: str = Query(None, description="Title words (prefix match)"),
+    author: str = Query(None, description="Author words (prefix match)"),
+    genre: str = Query(None, description="Exact genre match"),
+    limit: int = Query(20, ge=1, le=MAX_FACET_VALUES, description="Values per facet, most common first"),
+    db: aiosqlite.Connection = Depends(get_db)
+):
+    """
+    How many books, and how many of them are not on loan, there are per
+    genre, author and publication decade, narrowed by the same filters as the
+    search endpoint.
+
+    Without a text filter the counts are read from BookFacets, which triggers
+    keep current as books are added, changed or removed and loans open and
+    close, so the cost does not grow with the catalog. With a text filter the
+    matching books are counted directly, up to MAX_FACET_MATCHES of them;
+    "exact" is false when there were more.
+    """
+    try:
+        match = build_match_expression(q=q, title=title, author=author)
+        if match:
+            return await _matched_facets(db, match, genre, limit)
+
+        # Whole catalog, or one genre's author and decade counts
+        scope = genre if genre else "*"
+        facets = {}
+        for facet in FACETS:
+            if facet == "genre" and genre:
+                sql, params = GENRE_FACET, (genre,)
+            else:
+                sql, params = FACET_VALUES, (scope, facet, limit)
+            cursor = await db.execute(sql, params)
+            facets[facet] = [{"value": value, "books": books, "available": available}
+                             for value, books, available in await cursor.fetchall()]
+
+        if genre:
+            total = facets["genre"][0] if facets["genre"] else {"books": 0, "available": 0}
+        else:
+            cursor = await db.execute(FACET_TOTALS)
+            books, available = await cursor.fetchone()
+            total = {"books": books, "available": available}
+        return {"books": total["books"], "available": total["available"], "exact": True, "facets": facets}
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Facet lookup failed: {str(e)}"
+        )
+
+
+async def _matched_facets(db: aiosqlite.Connection, match: str, genre: str, limit: int) -> dict:
+    """Facet counts over the books matching an FTS5 expression (and genre), counted here."""
+    params = [match] + ([genre] if genre else []) + [MAX_FACET_MATCHES + 1]
+    cursor = await db.execute(matched_facets_query(bool(genre)), tuple(params))
+    rows = await cursor.fetchall()
+    exact = len(rows) <= MAX_FACET_MATCHES
+    rows = rows[:MAX_FACET_MATCHES]
+
+    books = {facet: Counter() for facet in FACETS}
+    available = {facet: Counter() for facet in FACETS}
+    for book_genre, book_author, year, free in rows:
+        for facet, value in zip(FACETS, (book_genre, book_author, decade(year))):
+            books[facet][value] += 1
+            available[facet][value] += free
+    facets = {
+        facet: [{"value": value, "books": count, "available": available[facet][value]}
+                for value, count in sorted(books[facet].items(), key=lambda item: (-item[1], item[0]))[:limit]]
+        for facet in FACETS
+    }
+    return {"books": len(rows), "available": sum(free for *_, free in rows), "exact": exact, "facets": facets}
@@ -1,4 +1,6 @@
-import uvicorn
-
-if __name__ == "__main__":
-    uvicorn.run("reservations:app", host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
+import uvicorn
+
+if __name__ == "__main__":
+    uvicorn.run("reservations:app", host="127.0.0.1", port=8000, reload=True,
+                # Open /events streams would otherwise hold up every reload
+                timeout_graceful_shutdown=5)
\ No newline at end of file
@@ -0,0 +1,128 @@
+"""
+Production entry point: several uvicorn worker processes sharing one Library.db.
+
+    python serve.py
+
+Settings are read from the environment, or from a .env file (see python-dotenv):
+
+    LIBRARY_HOST               address to bind (default 127.0.0.1)
+    LIBRARY_PORT               port (default 8000)
+    LIBRARY_WORKERS            worker processes (default: one per CPU core)
+    LIBRARY_DATABASE           SQLite file (default Library.db)
+    LIBRARY_SECRET_KEY         session signing key, shared by all workers
+    LIBRARY_LOG_LEVEL          uvicorn log level (default info)
+    LIBRARY_GRACEFUL_TIMEOUT   seconds to let open requests finish on shutdown (default 10)
+
+plus the per-worker knobs read by the modules themselves (LIBRARY_READERS,
+LIBRARY_SYNC_INTERVAL, LIBRARY_KDF_WORKERS, LIBRARY_RATE_LIMIT, ...), among them
+the write queue's group commit: LIBRARY_WRITE_BATCH_SIZE operations per
+transaction at most (default 64), flushed once the oldest has waited
+LIBRARY_WRITE_BATCH_DELAY_MS (default 2.0).
+LIBRARY_READ_MODE=snapshot makes each worker serve catalog reads from an
+in-memory copy of the catalog (about 110 MB per million books, see snapshot.py).
+
+Before starting the workers the database is switched to WAL (so readers in
+every process run alongside the one writer) and to incremental auto-vacuum
+(a full VACUUM, the first time only), and migrated once, instead of
+every worker racing to do it. Each worker keeps its caches coherent with the
+others through coherence.ChangeWatcher. A worker answers /health/ready once
+its startup's foreground phases are done, and builds the recommender and
+the catalog snapshot in the background after that (see lifecycle.py), so a
+rolling restart can send it traffic as soon as that endpoint returns 200;
+/health/live only says the process is up. On SIGINT/SIGTERM uvicorn stops the
+workers, each ends its /events streams and drains its write queue, and the WAL is checkpointed back into
+the database file. For development use run.py, which reloads on code changes.
+"""
+import asyncio
+import logging
+import os
+import secrets
+import sqlite3
+from dotenv import load_dotenv
+
+# Before the app modules are imported: they read their settings at import time
+load_dotenv()
+
+import aiosqlite
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+from database import DATABASE
+from migrations import apply_migrations
+from events import event_bus
+from archive import enable_incremental_vacuum
+
+log = logging.getLogger("library.serve")
+
+
+def prepare_database(database: str):
+    """Switch to WAL and incremental auto-vacuum and apply pending migrations, once, before any worker starts."""
+    conn = sqlite3.connect(database)
+    try:
+        mode = conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+    finally:
+        conn.close()
+    if mode.lower() != "wal":
+        raise SystemExit(f"{database}: could not enable WAL (journal_mode is {mode})")
+    # Once per database: lets the loan archiver hand freed pages back to the filesystem
+    if enable_incremental_vacuum(database):
+        log.info("switched %s to incremental auto-vacuum", database)
+
+    async def migrate():
+        async with aiosqlite.connect(database) as db:
+            return await apply_migrations(db)
+
+    applied = asyncio.run(migrate())
+    if applied:
+        log.info("applied migrations %s", applied)
+
+
+def checkpoint(database: str):
+    """Fold the WAL back into the database file after the workers have exited."""
+    conn = sqlite3.connect(database)
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+
+
+class Server(uvicorn.Server):
+    """uvicorn.Server that ends open /events streams as soon as shutdown begins."""
+
+    def handle_exit(self, sig, frame):
+        # Otherwise uvicorn waits the whole graceful timeout for the streams
+        # to finish, in every worker, one after the other
+        event_bus.close()
+        super().handle_exit(sig, frame)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s:     %(message)s")
+    workers = int(os.environ.get("LIBRARY_WORKERS", os.cpu_count() or 1))
+
+    if not os.environ.get("LIBRARY_SECRET_KEY"):
+        # Every worker has to sign and check tokens with the same key
+        os.environ["LIBRARY_SECRET_KEY"] = secrets.token_hex(32)
+        log.warning("LIBRARY_SECRET_KEY is not set; using a random key, so sessions end on restart")
+
+    prepare_database(DATABASE)
+    config = uvicorn.Config(
+        "reservations:app",
+        host=os.environ.get("LIBRARY_HOST", "127.0.0.1"),
+        port=int(os.environ.get("LIBRARY_PORT", "8000")),
+        workers=workers,
+        log_level=os.environ.get("LIBRARY_LOG_LEVEL", "info"),
+        timeout_graceful_shutdown=int(os.environ.get("LIBRARY_GRACEFUL_TIMEOUT", "10")),
+    )
+    server = Server(config)
+    try:
+        # What uvicorn.run() does, with our Server
+        if config.workers > 1:
+            Multiprocess(config, target=server.run, sockets=[config.bind_socket()]).run()
+        else:
+            server.run()
+    finally:
+        checkpoint(DATABASE)
+
+
+if __name__ == "__main__":
+    main()
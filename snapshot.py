@@ -0,0 +1,483 @@
+import asyncio
+import logging
+import os
+import sys
+import time
+import numpy as np
+import orjson
+import aiosqlite
+from database import pool
+from events import EVENTS_AFTER
+from holds import READY_HOLD_JOIN, UNAVAILABLE_COLUMN
+from pagination import keyset_rows
+
+# "snapshot" answers catalog reads from CatalogSnapshot; "sqlite" reads Library.db as before
+READ_MODE = os.environ.get("LIBRARY_READ_MODE", "sqlite")
+# Seconds between checks of the snapshot against SQLite; 0 disables them
+VERIFY_INTERVAL = float(os.environ.get("LIBRARY_SNAPSHOT_VERIFY_INTERVAL", "300"))
+# Books compared row by row per check; successive checks walk the catalog window by window
+VERIFY_ROWS = 20_000
+# Rows read per query while loading, and rows converted per step while serving
+LOAD_CHUNK = 10_000
+SERVE_CHUNK = 500
+# SQLite host parameter limit is much higher, but keep IN lists modest
+LOOKUP_BATCH = 500
+
+# BookRatings columns, in the order reservations.rating_to_dict expects them
+RATING_COLUMNS = "R.RatingCount, R.RatingSum, " + ", ".join(f"R.Stars{k}" for k in range(6)) + ", R.Score"
+
+# One row per book, in the shape of GET /books/?include=availability,ratings
+SNAPSHOT_SELECT = f"""
+    SELECT B.BookID, B.BookName, B.Author, B.Genre, B.Year, {UNAVAILABLE_COLUMN}, {RATING_COLUMNS}
+    FROM Books B
+    LEFT JOIN BorrowingHistory H ON H.BookID = B.BookID AND H.ReturnDate IS NULL
+    {READY_HOLD_JOIN}
+    LEFT JOIN BookRatings R ON R.BookID = B.BookID
+"""
+
+# Events that change what the snapshot holds. on_loan means "not available":
+# a book set aside for a hold is off the shelf too. A book goes straight from
+# one state to the other (returned then readied, released then borrowed),
+# with the events in that order, so the last one applied is the current state.
+LOAN_EVENTS = {"loan_opened": True, "loan_closed": False, "hold_ready": True, "hold_released": False}
+REVIEW_EVENTS = {"review_added", "review_deleted"}
+# RATING_COLUMNS of a book without a BookRatings row
+NO_RATING = (None,) * 9
+
+log = logging.getLogger("library.snapshot")
+
+# -------------------------------
+# Columnar Book Store
+# -------------------------------
+
+class OutOfOrder(Exception):
+    """A change the columns cannot apply in place; the snapshot is reloaded instead."""
+
+
+class BookColumns:
+    """
+    One generation of the snapshot: a NumPy array per field, indexed by row,
+    rows in BookID order. BookIDs only grow, so new books are appended and
+    book_id stays sorted: searchsorted on it is the ID -> row map, with no
+    per-book dict. Removed books stay as dead rows until the next load.
+
+    Titles are one UTF-8 bytearray with a start and length per row; authors
+    and genres are small integer codes into lists of distinct names.
+
+    Per book that is 8 (id) + 8 + 4 (title offset, length) + 4 (author) +
+    2 (genre) + 2 (year) + 2 (flags) + 4 + 8 + 24 + 8 (ratings) = 74 bytes,
+    plus the title text, plus each distinct author name once. On the
+    synthetic catalog (about 20-byte titles, one author per 8 books) that
+    comes to roughly 110 MB per million books including growth headroom;
+    benchmarks/snapshot.py measures it.
+    """
+
+    __slots__ = ("size", "live_count", "book_id", "title_start", "title_length", "titles", "author", "genre",
+                 "year", "live", "on_loan", "rating_count", "rating_sum", "stars", "score",
+                 "author_names", "author_codes", "genre_names", "genre_codes", "name_bytes")
+
+    ARRAYS = (("book_id", np.int64), ("title_start", np.int64), ("title_length", np.int32),
+              ("author", np.int32), ("genre", np.int16), ("year", np.int16), ("live", np.bool_),
+              ("on_loan", np.bool_), ("rating_count", np.int32), ("rating_sum", np.float64),
+              ("stars", np.int32), ("score", np.float64))
+
+    def __init__(self):
+        self.size = 0
+        self.live_count = 0
+        for name, dtype in self.ARRAYS:
+            setattr(self, name, np.zeros((0, 6) if name == "stars" else 0, dtype=dtype))
+        self.titles = bytearray()
+        self.author_names, self.author_codes = [], {}
+        self.genre_names, self.genre_codes = [], {}
+        # Distinct author and genre strings, counted as they are added
+        self.name_bytes = 0
+
+    @property
+    def last_id(self) -> int:
+        return int(self.book_id[self.size - 1]) if self.size else 0
+
+    def _reserve(self, count: int):
+        needed = self.size + count
+        capacity = len(self.book_id)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity + capacity // 8, 1024)
+        for name, dtype in self.ARRAYS:
+            old = getattr(self, name)
+            grown = np.zeros((capacity,) + old.shape[1:], dtype=dtype)
+            grown[:self.size] = old[:self.size]
+            setattr(self, name, grown)
+
+    def _code(self, names: list, codes: dict, value: str) -> int:
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(names)
+            names.append(value)
+            self.name_bytes += sys.getsizeof(value)
+        return code
+
+    def find(self, book_id: int, include_removed: bool = False) -> int:
+        """Row of a book, or -1."""
+        row = int(np.searchsorted(self.book_id[:self.size], book_id))
+        if row < self.size and self.book_id[row] == book_id and (include_removed or self.live[row]):
+            return row
+        return -1
+
+    def append(self, rows: list):
+        """Add SNAPSHOT_SELECT rows, in BookID order, all above the last BookID held."""
+        if not rows:
+            return
+        if rows[0][0] <= self.last_id:
+            raise OutOfOrder(rows[0][0])
+        count = len(rows)
+        self._reserve(count)
+        start, end = self.size, self.size + count
+        ids, titles, authors, genres, years, loans, counts, sums, *stars, scores = zip(*rows)
+        encoded = [title.encode() for title in titles]
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=count)
+        self.book_id[start:end] = ids
+        self.title_start[start:end] = len(self.titles) + np.cumsum(lengths) - lengths
+        self.title_length[start:end] = lengths
+        self.titles += b"".join(encoded)
+        self.author[start:end] = [self._code(self.author_names, self.author_codes, a) for a in authors]
+        self.genre[start:end] = [self._code(self.genre_names, self.genre_codes, g) for g in genres]
+        self.year[start:end] = years
+        self.live[start:end] = True
+        self.on_loan[start:end] = [loan is not None for loan in loans]
+        self.rating_count[start:end] = [n or 0 for n in counts]
+        self.rating_sum[start:end] = [total or 0.0 for total in sums]
+        self.stars[start:end] = np.array([[n or 0 for n in column] for column in stars], dtype=np.int32).T
+        self.score[start:end] = [np.nan if score is None else score for score in scores]
+        self.size = end
+        self.live_count += count
+
+    def put_book(self, book_id: int, title: str, author: str, genre: str, year: int):
+        """A book_added or book_updated event: append it, or update its row in place."""
+        if book_id > self.last_id:
+            self.append([(book_id, title, author, genre, year, None) + NO_RATING])
+            return
+        row = self.find(book_id, include_removed=True)
+        if row < 0:
+            raise OutOfOrder(book_id)
+        if not self.live[row]:
+            return
+        encoded = title.encode()
+        if encoded != self.titles[self.title_start[row]:self.title_start[row] + self.title_length[row]]:
+            # The old text stays in the buffer until the next load
+            self.title_start[row], self.title_length[row] = len(self.titles), len(encoded)
+            self.titles += encoded
+        self.author[row] = self._code(self.author_names, self.author_codes, author)
+        self.genre[row] = self._code(self.genre_names, self.genre_codes, genre)
+        self.year[row] = year
+
+    def remove(self, book_id: int):
+        row = self.find(book_id)
+        if row >= 0:
+            self.live[row] = False
+            self.on_loan[row] = False
+            self.live_count -= 1
+
+    def set_on_loan(self, book_id: int, on_loan: bool):
+        row = self.find(book_id)
+        if row >= 0:
+            self.on_loan[row] = on_loan
+
+    def set_rating(self, book_id: int, values: tuple):
+        """RATING_COLUMNS values for a book, or None if it has no BookRatings row."""
+        row = self.find(book_id)
+        if row < 0:
+            return
+        count, total, *stars, score = values or (0, 0.0) + (0,) * 6 + (np.nan,)
+        self.rating_count[row], self.rating_sum[row], self.stars[row], self.score[row] = count, total, stars, score
+
+    def rows(self, index: np.ndarray, includes: list) -> list:
+        """The rows at `index` as tuples in the shape of reservations.books_query(includes)."""
+        starts = self.title_start[index].tolist()
+        lengths = self.title_length[index].tolist()
+        titles = [self.titles[s:s + n].decode() for s, n in zip(starts, lengths)]
+        authors = [self.author_names[code] for code in self.author[index].tolist()]
+        genres = [self.genre_names[code] for code in self.genre[index].tolist()]
+        fields = [self.book_id[index].tolist(), titles, authors, genres, self.year[index].tolist()]
+        for name in includes:
+            if name == "availability":
+                # Stands in for H.HistoryID: only whether it is NULL matters
+                fields.append([1 if on_loan else None for on_loan in self.on_loan[index].tolist()])
+            else:
+                ratings = [
+                    (count, total, *stars, score) if count else NO_RATING
+                    for count, total, stars, score in zip(self.rating_count[index].tolist(),
+                                                          self.rating_sum[index].tolist(),
+                                                          self.stars[index].tolist(),
+                                                          self.score[index].tolist())
+                ]
+                fields.extend(zip(*ratings))
+        return list(zip(*fields))
+
+    def memory_bytes(self) -> int:
+        arrays = sum(getattr(self, name).nbytes for name, _ in self.ARRAYS)
+        lookups = sum(sys.getsizeof(table) for table in
+                      (self.author_names, self.author_codes, self.genre_names, self.genre_codes))
+        return arrays + sys.getsizeof(self.titles) + lookups + self.name_bytes
+
+# -------------------------------
+# Catalog Snapshot
+# -------------------------------
+
+class CatalogSnapshot:
+    """
+    Optional in-memory copy of the catalog (books, which are out or held, rating
+    aggregates) that GET /books/, /available/ and the book check in
+    /reviews/{id} read instead of SQLite, so catalog reads no longer
+    compete with writes for Library.db. Off unless LIBRARY_READ_MODE=snapshot.
+
+    It is loaded in one read transaction together with the newest Events
+    sequence number, then kept current from the Events table: the change log
+    the triggers write in the same transaction as every book, loan and
+    review change, from any worker. The change watcher calls catch_up()
+    whenever another connection has committed, before it invalidates the
+    response cache, so reads lag writes by at most LIBRARY_SYNC_INTERVAL.
+    If the Events it needs were already pruned, it reloads.
+
+    Every VERIFY_INTERVAL it compares the book and active-loan totals and
+    one window of VERIFY_ROWS books, row by row, with SQLite, in the same
+    read transaction as a catch-up, and reloads on any difference.
+    Until a load finishes `ready` is False and the endpoints read SQLite.
+    """
+
+    def __init__(self, mode: str = READ_MODE, verify_interval: float = VERIFY_INTERVAL):
+        self.enabled = mode == "snapshot"
+        self.verify_interval = verify_interval
+        self.columns: BookColumns = None
+        self._seq = 0
+        self._db: aiosqlite.Connection = None
+        self._lock: asyncio.Lock = None
+        self._task: asyncio.Task = None
+        # The next verification window starts after this BookID
+        self._verify_after = 0
+        self._stats = {"loads": 0, "last_load_seconds": None, "events": 0, "fell_behind": 0,
+                       "verifications": 0, "mismatches": 0, "errors": 0}
+
+    @property
+    def ready(self) -> bool:
+        return self.columns is not None
+
+    async def start(self):
+        if not self.enabled or self._db is not None:
+            return
+        self._db = await pool.dedicated_reader()
+        self._lock = asyncio.Lock()
+        await self.reload()
+        if self.verify_interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.columns = None
+        # The connection belongs to the pool, which closes it
+        self._db = None
+
+    async def reload(self):
+        """Load everything again, e.g. after a change that writes no Events (POST /admin/ratings/rebuild)."""
+        if self._db is None:
+            return
+        async with self._lock:
+            await self._load()
+
+    async def _load(self):
+        started = time.perf_counter()
+        columns = BookColumns()
+        # verify() may already hold a read transaction, which the load then shares
+        began = not self._db.in_transaction
+        if began:
+            await self._db.execute("BEGIN")
+        try:
+            cursor = await self._db.execute("SELECT IFNULL(MAX(Seq), 0) FROM Events")
+            seq = (await cursor.fetchone())[0]
+            chunk = []
+            async for row in keyset_rows(self._db, SNAPSHOT_SELECT, "B.BookID", chunk_size=LOAD_CHUNK):
+                chunk.append(row)
+                if len(chunk) == LOAD_CHUNK:
+                    columns.append(chunk)
+                    chunk = []
+            columns.append(chunk)
+        finally:
+            if began:
+                await self._db.execute("COMMIT")
+        self.columns, self._seq = columns, seq
+        self._stats["loads"] += 1
+        self._stats["last_load_seconds"] = round(time.perf_counter() - started, 3)
+        log.info("catalog snapshot loaded: %d books in %.2fs", columns.live_count, self._stats["last_load_seconds"])
+
+    async def catch_up(self) -> int:
+        """Apply the Events committed since the last load or catch-up. Returns the number read."""
+        if not self.ready:
+            return 0
+        async with self._lock:
+            return await self._catch_up()
+
+    async def _catch_up(self) -> int:
+        cursor = await self._db.execute(EVENTS_AFTER, (self._seq,))
+        events = await cursor.fetchall()
+        if not events:
+            return 0
+        if events[0][0] != self._seq + 1:
+            # Pruned before this worker read them
+            self._stats["fell_behind"] += 1
+            await self._load()
+            return 0
+        try:
+            await self._apply(events)
+        except OutOfOrder:
+            await self._load()
+            return 0
+        self._seq = events[-1][0]
+        self._stats["events"] += len(events)
+        return len(events)
+
+    async def _apply(self, events: list):
+        columns = self.columns
+        reviewed = set()
+        for _, kind, data in events:
+            if kind in LOAN_EVENTS:
+                columns.set_on_loan(orjson.loads(data)["book_id"], LOAN_EVENTS[kind])
+            elif kind in REVIEW_EVENTS:
+                reviewed.add(orjson.loads(data)["book_id"])
+            elif kind in ("book_added", "book_updated"):
+                book = orjson.loads(data)
+                columns.put_book(book["book_id"], book["book_name"], book["author"], book["genre"], book["year"])
+            elif kind == "book_removed":
+                columns.remove(orjson.loads(data)["book_id"])
+            elif kind == "books_imported":
+                # One event per import chunk; the rows are read back in full. Later
+                # events about the same books apply again on top, which is harmless.
+                imported = orjson.loads(data)
+                cursor = await self._db.execute(
+                    f"{SNAPSHOT_SELECT} WHERE B.BookID BETWEEN ? AND ? ORDER BY B.BookID",
+                    (imported["first_book_id"], imported["last_book_id"])
+                )
+                columns.append([row for row in await cursor.fetchall() if row[0] > columns.last_id])
+        # Aggregates are read back once per book, whatever the number of reviews
+        reviewed = sorted(reviewed)
+        for start in range(0, len(reviewed), LOOKUP_BATCH):
+            batch = reviewed[start:start + LOOKUP_BATCH]
+            cursor = await self._db.execute(
+                f"SELECT R.BookID, {RATING_COLUMNS} FROM BookRatings R "
+                f"WHERE R.BookID IN ({','.join('?' * len(batch))})", batch
+            )
+            found = {row[0]: row[1:] for row in await cursor.fetchall()}
+            for book_id in batch:
+                columns.set_rating(book_id, found.get(book_id))
+
+    # ---- verification ----
+
+    async def verify(self) -> bool:
+        """Compare totals and the next window of books with SQLite; reload on a difference. True if they matched."""
+        if not self.ready:
+            return True
+        async with self._lock:
+            await self._db.execute("BEGIN")
+            try:
+                await self._catch_up()
+                problems = await self._compare()
+            finally:
+                await self._db.execute("COMMIT")
+            self._stats["verifications"] += 1
+            if problems:
+                self._stats["mismatches"] += 1
+                log.warning("catalog snapshot differs from SQLite (%s); reloading", "; ".join(problems))
+                await self._load()
+        return not problems
+
+    async def _compare(self) -> list:
+        columns = self.columns
+        problems = []
+        cursor = await self._db.execute("""
+            SELECT (SELECT COUNT(*) FROM Books),
+                   (SELECT COUNT(*) FROM BorrowingHistory H JOIN Books B ON B.BookID = H.BookID
+                    WHERE H.ReturnDate IS NULL)
+                 + (SELECT COUNT(*) FROM Holds X JOIN Books B ON B.BookID = X.BookID
+                    WHERE X.Status = 'ready')
+        """)
+        books, on_loan = await cursor.fetchone()
+        held_on_loan = int(np.count_nonzero(columns.on_loan[:columns.size]))
+        if (books, on_loan) != (columns.live_count, held_on_loan):
+            problems.append(f"{columns.live_count} books, {held_on_loan} unavailable; SQLite has {books}, {on_loan}")
+
+        expected = [row async for row in keyset_rows(self._db, SNAPSHOT_SELECT, "B.BookID",
+                                                     after=self._verify_after, limit=VERIFY_ROWS)]
+        start = int(np.searchsorted(columns.book_id[:columns.size], self._verify_after, side="right"))
+        index = np.flatnonzero(columns.live[start:columns.size])[:VERIFY_ROWS] + start
+        held = columns.rows(index, ["availability", "ratings"])
+        expected = [row[:5] + (None if row[5] is None else 1,) + row[6:] for row in expected]
+        if held != expected:
+            differing = next((e[0] for h, e in zip(held, expected) if h != e), None)
+            problems.append(f"books after {self._verify_after} differ"
+                            + (f", first at BookID {differing}" if differing is not None else " in number"))
+        # Wrap around once the window reaches the end of the catalog
+        self._verify_after = expected[-1][0] if len(expected) == VERIFY_ROWS else 0
+        return problems
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.verify_interval)
+            try:
+                await self.verify()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._stats["errors"] += 1
+                log.exception("catalog snapshot verification failed")
+
+    # ---- reads ----
+
+    async def book_rows(self, includes: list, after: int = None, limit: int = None):
+        """Live rows in BookID order after `after`, shaped for books_query(includes); a keyset_rows stand-in."""
+        columns = self.columns
+        position = 0
+        if after is not None:
+            position = int(np.searchsorted(columns.book_id[:columns.size], after, side="right"))
+        remaining = limit
+        while position < columns.size and (remaining is None or remaining > 0):
+            end = min(position + SERVE_CHUNK, columns.size)
+            index = np.flatnonzero(columns.live[position:end]) + position
+            if remaining is not None:
+                index = index[:remaining]
+                remaining -= len(index)
+            for row in columns.rows(index, includes):
+                yield row
+            position = end
+            if position < columns.size:
+                # Let other requests in between chunks of a long stream
+                await asyncio.sleep(0)
+
+    def available(self, book_ids: list) -> dict:
+        """{book_id: neither on loan nor set aside for a hold} for the books that exist."""
+        columns = self.columns
+        found = {}
+        for book_id in book_ids:
+            row = columns.find(book_id)
+            if row >= 0:
+                found[book_id] = not columns.on_loan[row]
+        return found
+
+    def has_book(self, book_id: int) -> bool:
+        return self.columns.find(book_id) >= 0
+
+    def stats(self) -> dict:
+        columns = self.columns
+        held = {"books": 0, "rows": 0, "bytes": 0, "bytes_per_book": None}
+        if columns is not None:
+            memory = columns.memory_bytes()
+            held = {"books": columns.live_count, "rows": columns.size, "bytes": memory,
+                    "bytes_per_book": round(memory / columns.live_count, 1) if columns.live_count else None}
+        return {**self._stats, **held, "enabled": self.enabled, "ready": self.ready, "seq": self._seq,
+                "verify_interval": self.verify_interval, "running": self._task is not None and not self._task.done()}
+
+
+catalog_snapshot = CatalogSnapshot()
@@ -0,0 +1,136 @@
+import hashlib
+import os
+import time
+from fastapi import APIRouter, HTTPException, Request, status
+from fastapi.responses import Response
+from compression import accepted_encodings, precompress
+from cache import etag_matches
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Pages, served at their own names (and index.html at /) so links between them keep working
+PAGES = ("index.html", "register.html", "adminDashboard.html", "userDashboard.html")
+# Files the pages refer to, served under /static/ with a content hash in the name
+ASSETS = ("resources/login.jpg",)
+# The pages call the API here when opened from disk; served by the app they use their own origin
+API_ORIGIN = "http://127.0.0.1:8000"
+
+MEDIA_TYPES = {
+    ".html": "text/html",
+    ".jpg": "image/jpeg",
+    ".css": "text/css",
+    ".js": "text/javascript",
+}
+# Preferred first when a client accepts several
+ENCODINGS = ("br", "gzip")
+
+# A hashed name changes whenever the content does, so it can be kept for a year
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Pages keep their names, so browsers revalidate them (a 304 when unchanged)
+PAGE_CACHE_CONTROL = "no-cache"
+
+router = APIRouter(tags=["Pages"], include_in_schema=False)
+
+# -------------------------------
+# Static Assets
+# -------------------------------
+
+class StaticFile:
+    __slots__ = ("url", "media_type", "cache_control", "etag", "encodings")
+
+    def __init__(self, url: str, media_type: str, cache_control: str, body: bytes):
+        self.url = url
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self.etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        self.encodings = precompress(body, media_type)
+
+
+class StaticAssets:
+    """
+    The pages and the files they use, read, rewritten and compressed once at
+    startup and served from memory. Assets get a content hash in their name
+    (resources/login.jpg -> /static/login.<hash>.jpg) and a year-long
+    immutable Cache-Control; the pages are rewritten to point at those names
+    and at the app's own origin, while the files on disk stay as they are.
+    """
+
+    def __init__(self, root: str = ROOT, pages: tuple = PAGES, assets: tuple = ASSETS):
+        self.root = root
+        self.pages = pages
+        self.assets = assets
+        self._files = {}
+        self._stats = {"requests": 0, "not_modified": 0, "bytes_sent": {}, "build_seconds": None}
+
+    def build(self):
+        started = time.perf_counter()
+        files = {}
+        renames = {}
+        for path in self.assets:
+            with open(os.path.join(self.root, path), "rb") as f:
+                body = f.read()
+            stem, ext = os.path.splitext(os.path.basename(path))
+            url = f"/static/{stem}.{hashlib.blake2b(body, digest_size=8).hexdigest()}{ext}"
+            files[url] = StaticFile(url, MEDIA_TYPES.get(ext, "application/octet-stream"), ASSET_CACHE_CONTROL, body)
+            renames[path] = url
+
+        for page in self.pages:
+            with open(os.path.join(self.root, page), encoding="utf-8") as f:
+                text = f.read()
+            text = text.replace(API_ORIGIN, "")
+            for path, url in renames.items():
+                text = text.replace(path, url)
+            files["/" + page] = StaticFile("/" + page, MEDIA_TYPES[".html"], PAGE_CACHE_CONTROL, text.encode())
+
+        self._files = files
+        self._stats["build_seconds"] = round(time.perf_counter() - started, 3)
+
+    def response(self, request: Request, url: str) -> Response:
+        file = self._files.get(url)
+        if file is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
+
+        self._stats["requests"] += 1
+        headers = {"cache-control": file.cache_control, "etag": file.etag, "vary": "Accept-Encoding"}
+        if etag_matches(request.headers.get("if-none-match"), file.etag):
+            self._stats["not_modified"] += 1
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        accepted = accepted_encodings(request.headers.get("accept-encoding"))
+        coding = next((c for c in ENCODINGS if c in accepted and c in file.encodings), "identity")
+        body = file.encodings[coding]
+        if coding != "identity":
+            headers["content-encoding"] = coding
+        sent = self._stats["bytes_sent"]
+        sent[coding] = sent.get(coding, 0) + len(body)
+        return Response(body, media_type=file.media_type, headers=headers)
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "files": {
+                url: {coding: len(body) for coding, body in file.encodings.items()}
+                for url, file in sorted(self._files.items())
+            },
+        }
+
+
+static_assets = StaticAssets()
+
+# -------------------------------
+# Routes
+# -------------------------------
+
+@router.get("/")
+async def index_page(request: Request):
+    return static_assets.response(request, "/index.html")
+
+
+@router.get("/{page}.html")
+async def page(request: Request, page: str):
+    return static_assets.response(request, f"/{page}.html")
+
+
+@router.get("/static/{name}")
+async def asset(request: Request, name: str):
+    return static_assets.response(request, f"/static/{name}")
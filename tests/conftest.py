@@ -0,0 +1,73 @@
+import asyncio
+import os
+import sys
+
+import aiosqlite
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Before the app modules are imported: they read their settings at import time
+os.environ.setdefault("LIBRARY_RATE_LIMIT", "0")
+
+import database
+import reservations
+from auth import sessions
+from migrations import apply_migrations
+
+# The tables Library.db ships with; everything else is created by migrations.py
+BASE_SCHEMA = """
+CREATE TABLE Users (
+    UserID INTEGER PRIMARY KEY AUTOINCREMENT,
+    UserName TEXT NOT NULL,
+    Password TEXT NOT NULL
+);
+CREATE TABLE Books (
+    BookID INTEGER PRIMARY KEY AUTOINCREMENT,
+    BookName TEXT NOT NULL,
+    Author TEXT NOT NULL,
+    Genre TEXT NOT NULL,
+    Year INTEGER NOT NULL
+);
+CREATE TABLE Ratings (
+    RatingID INTEGER PRIMARY KEY AUTOINCREMENT,
+    UserID INTEGER REFERENCES Users (UserID),
+    BookID INTEGER REFERENCES Books (BookID),
+    Rating REAL
+);
+CREATE TABLE BorrowingHistory (
+    HistoryID INTEGER PRIMARY KEY AUTOINCREMENT,
+    UserID INTEGER REFERENCES Users (UserID),
+    BookID INTEGER REFERENCES Books (BookID),
+    BorrowDate DATE,
+    DueDate DATE,
+    ReturnDate DATE
+);
+"""
+
+
+@pytest.fixture(scope="module")
+def migrated_database(tmp_path_factory) -> str:
+    """A scratch database with the shipped tables, migrated to the current schema."""
+    path = str(tmp_path_factory.mktemp("db") / "Library.db")
+
+    async def migrate():
+        async with aiosqlite.connect(path) as db:
+            await db.executescript(BASE_SCHEMA)
+            await apply_migrations(db)
+
+    asyncio.run(migrate())
+    return path
+
+
+@pytest.fixture(scope="module")
+def client(migrated_database):
+    """The app, started on the scratch database."""
+    database.pool.database = migrated_database
+    with TestClient(reservations.app) as client:
+        yield client
+
+
+@pytest.fixture
+def admin():
+    return {"Authorization": f"Bearer {sessions.issue(1, is_admin=True)}"}
@@ -0,0 +1,7 @@
+def test_add_user_rejects_a_taken_username(client, admin):
+    user = {"username": "duplicate", "password": "secret"}
+    assert client.post("/admin/add_user/", json=user, headers=admin).status_code == 200
+
+    response = client.post("/admin/add_user/", json=user, headers=admin)
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Username already exists."}
@@ -0,0 +1,31 @@
+def test_import_reports_lines_that_are_not_utf8(client, admin):
+    upload = (
+        "title,author,genre,year\n"
+        "Good Omens,Terry Pratchett,Fantasy,1990\n"
+        "Caf\xe9 Society,Ann Author,Drama,1999\n"
+        "Dune,Frank Herbert,Science Fiction,1965\n"
+    ).encode("latin-1")
+    response = client.post("/admin/books/import", content=upload,
+                           headers={**admin, "Content-Type": "text/csv"})
+
+    assert response.status_code == 200
+    report = response.json()
+    assert report["inserted"] == 2
+    assert report["errors"] == [{"line": 3, "error": "Not valid UTF-8"}]
+
+
+def test_import_decodes_characters_split_across_chunks(client, admin):
+    line = '{"title": "Café à Paris", "author": "Émile", "genre": "Drama", "year": 2001}\n'
+    data = "\ufeff".encode() + line.encode()
+
+    def chunks():
+        # One byte at a time, so the BOM and every two-byte character are split
+        for i in range(len(data)):
+            yield data[i:i + 1]
+
+    response = client.post("/admin/books/import", content=chunks(),
+                           headers={**admin, "Content-Type": "application/x-ndjson"})
+
+    assert response.status_code == 200
+    assert response.json()["inserted"] == 1
+    assert client.get("/api/books/", params={"title": "Paris"}).json()[0]["book_name"] == "Café à Paris"
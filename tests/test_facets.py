@@ -0,0 +1,11 @@
+import sqlite3
+
+from resources import decade
+
+
+def test_decade_matches_the_stored_facets():
+    # The matched facets are counted in Python, the catalog's by migrations.py in SQL
+    years = [-2001, -1999, -10, -9, -1, 0, 1, 9, 10, 1999, 2024]
+    conn = sqlite3.connect(":memory:")
+    expected = [conn.execute("SELECT (? / 10) * 10", (year,)).fetchone()[0] for year in years]
+    assert [decade(year) for year in years] == expected
@@ -0,0 +1,50 @@
+import asyncio
+
+import lifecycle as lifecycle_module
+from lifecycle import Lifecycle
+
+
+def test_failed_background_phase_is_reported_and_retried(monkeypatch):
+    monkeypatch.setattr(lifecycle_module, "BACKGROUND_RETRY_DELAY", 0.01)
+    attempts = []
+
+    async def flaky_build():
+        attempts.append(len(attempts))
+        if len(attempts) < 3:
+            raise RuntimeError("database is locked")
+
+    async def run():
+        lifecycle = Lifecycle()
+        lifecycle.begin()
+        lifecycle.mark_ready()
+        lifecycle.background("recommender", flaky_build, retry=True)
+        while not attempts:
+            await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        failed = lifecycle.stats()
+        await lifecycle.wait_background()
+        return failed, lifecycle.stats()
+
+    failed, done = asyncio.run(run())
+    assert failed["background_failed"] == ["recommender"]
+    assert failed["background_pending"] == ["recommender"]
+    assert len(attempts) == 3
+    assert done["background_failed"] == [] and done["background_pending"] == []
+    assert done["phases"]["recommender"]["status"] == "done"
+    assert done["background_failures"] == 2
+
+
+def test_background_phase_without_retry_fails_once():
+    async def broken():
+        raise RuntimeError("boom")
+
+    async def run():
+        lifecycle = Lifecycle()
+        lifecycle.begin()
+        lifecycle.background("snapshot", broken)
+        await lifecycle.wait_background()
+        return lifecycle.stats()
+
+    stats = asyncio.run(run())
+    assert stats["background_failed"] == ["snapshot"]
+    assert stats["background_failures"] == 1
@@ -0,0 +1,101 @@
+"""
+Every lookup the endpoints and background tasks issue must be answered from
+an index: on a freshly migrated database, EXPLAIN QUERY PLAN may not SCAN a
+table without one. The statements are imported from the modules that run
+them, so a query changed there is checked here as it is.
+
+    python -m pytest tests/
+
+Whole-table reads that are meant to be (GET /books/ without keyset
+parameters, the rebuild statements) are not listed.
+"""
+import sqlite3
+
+import pytest
+
+import archive
+import bulk
+import holds
+import overdue
+import reservations
+import resources
+from events import EVENTS_AFTER
+from pagination import keyset_query
+from recommendations import CATCH_UP_QUERIES
+from snapshot import SNAPSHOT_SELECT
+
+IN_LIST = "?, ?, ?"
+
+
+def _statements() -> dict:
+    statements = {name: getattr(reservations, name) for name in (
+        "USER_NAME_TAKEN", "USER_LOGIN", "USER_EXISTS", "BOOK_EXISTS", "BOOK_NAME", "BOOK_BY_NAME",
+        "BOOK_ACTIVE_LOANS", "BOOK_READY_HOLDS", "BOOK_LOAN_AND_HOLD", "FULFIL_HOLD", "RETURN_LOAN",
+        "ACTIVE_LOAN", "RENEW_LOAN", "USER_OPEN_HOLDS", "HOLD_BY_ID", "CANCEL_HOLD", "USER_BOOKS",
+        "USER_HISTORY", "USER_DUE_SOON", "USER_HOLDS", "OVERDUE_PAGE", "BOOK_REVIEWS", "USER_BOOK_REVIEW",
+        "REVIEW_BY_ID",
+    )}
+    statements["BOOKS_BY_ID"] = reservations.BOOKS_BY_ID.format(placeholders=IN_LIST)
+    statements["AVAILABILITY_BATCH"] = reservations.AVAILABILITY_BATCH.format(placeholders=IN_LIST)
+    for genre in (False, True):
+        for after in (False, True):
+            statements[f"top_rated(genre={genre}, after={after})"] = reservations.top_rated_query(genre, after)
+
+    # Keyset pages of the list endpoints and the snapshot load
+    statements["books page"] = keyset_query(reservations.BOOKS_SELECT, "BookID")
+    for includes in (["availability"], ["ratings"], ["availability", "ratings"]):
+        select, _ = reservations.books_query(includes)
+        statements[f"books page include={','.join(includes)}"] = keyset_query(select, "B.BookID")
+    statements["users page"] = keyset_query(reservations.USERS_SELECT, "UserID")
+    statements["reviews page"] = keyset_query(reservations.REVIEWS_SELECT, "R.RatingID")
+    statements["snapshot page"] = keyset_query(SNAPSHOT_SELECT, "B.BookID")
+    statements["export page"] = keyset_query(bulk.EXPORT_SELECT, "BookID")
+
+    statements["BOOK_BY_TITLE_AUTHOR"] = resources.BOOK_BY_TITLE_AUTHOR
+    for sort_by in ("relevance", "title", "author", "year"):
+        statements[f"search(match, sort_by={sort_by})"] = resources.search_query(True, False, sort_by)
+        statements[f"search(match, genre, sort_by={sort_by})"] = resources.search_query(True, True, sort_by)
+        statements[f"search(genre, sort_by={sort_by})"] = resources.search_query(False, True, sort_by)
+        for sort_order in ("asc", "desc"):
+            statements[f"search(sort_by={sort_by}, {sort_order})"] = resources.search_query(False, False, sort_by,
+                                                                                          sort_order)
+    statements["FACET_VALUES"] = resources.FACET_VALUES
+    statements["GENRE_FACET"] = resources.GENRE_FACET
+    statements["FACET_TOTALS"] = resources.FACET_TOTALS
+    statements["matched_facets"] = resources.matched_facets_query(False)
+    statements["matched_facets(genre)"] = resources.matched_facets_query(True)
+
+    statements["EXISTING_KEYS"] = bulk.EXISTING_KEYS.format(placeholders=IN_LIST)
+    statements["QUEUE_HEAD"] = holds.QUEUE_HEAD
+    statements["QUEUE_POSITION"] = holds.QUEUE_POSITION
+    statements["EXPIRED_HOLDS"] = holds.EXPIRED_HOLDS
+    statements["OVERDUE_AFTER"] = overdue.OVERDUE_AFTER
+    statements["ARCHIVABLE_LOANS"] = archive.ARCHIVABLE_LOANS
+    statements["EVENTS_AFTER"] = EVENTS_AFTER
+    for kind, sql in CATCH_UP_QUERIES.items():
+        statements[f"catch_up {kind}"] = sql
+    return statements
+
+
+STATEMENTS = _statements()
+
+
+def full_scans(conn: sqlite3.Connection, sql: str) -> list:
+    """Plan lines that read a whole table rather than an index."""
+    # The planner does not look at bound values, so NULLs stand in for them
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", (None,) * sql.count("?")).fetchall()
+    return [detail for *_, detail in plan
+            if detail.startswith("SCAN ") and "INDEX" not in detail and not detail.startswith("SCAN CONSTANT")]
+
+
+@pytest.fixture(scope="module")
+def conn(migrated_database):
+    conn = sqlite3.connect(migrated_database)
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize("name", list(STATEMENTS))
+def test_statement_uses_an_index(conn, name):
+    sql = STATEMENTS[name]
+    assert full_scans(conn, sql) == [], " ".join(sql.split())
@@ -0,0 +1,195 @@
+import asyncio
+import os
+import random
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from database import pool, CONNECTION_PRAGMAS, TRANSACTION_RETRIES, TRANSACTION_BACKOFF, is_busy_error
+from metrics import TimedConnection
+
+# Flush a batch after this many operations...
+WRITE_BATCH_SIZE = int(os.environ.get("LIBRARY_WRITE_BATCH_SIZE", "64"))
+# ...or once the oldest queued operation has waited this long
+WRITE_BATCH_DELAY_MS = float(os.environ.get("LIBRARY_WRITE_BATCH_DELAY_MS", "2.0"))
+
+# -------------------------------
+# Group-Commit Write Queue
+# -------------------------------
+
+class _Operation:
+    __slots__ = ("work", "future", "queued_at", "outcome")
+
+    def __init__(self, work, future):
+        self.work = work
+        self.future = future
+        self.queued_at = time.perf_counter()
+        self.outcome = None
+
+
+class WriteQueue:
+    """
+    Funnels small write transactions through one task that commits them in batches.
+
+    Callers submit a plain `work(conn)` function taking a sqlite3 connection and
+    await its result. The writer task collects up to batch_size operations (or
+    whatever arrived within batch_delay_ms of the first one) and hands the whole
+    batch to a dedicated thread with its own connection, so a batch costs one
+    thread hop instead of one per statement. There each operation runs inside
+    its own SAVEPOINT in a single BEGIN IMMEDIATE transaction, which is
+    committed once. An operation that raises is rolled back to its savepoint and
+    gets its own exception; the rest of the batch still commits. Results are
+    only handed out after the commit succeeds.
+    """
+
+    def __init__(self, batch_size: int = WRITE_BATCH_SIZE, batch_delay_ms: float = WRITE_BATCH_DELAY_MS):
+        self.batch_size = batch_size
+        self.batch_delay_ms = batch_delay_ms
+        self._queue: asyncio.Queue = None
+        self._task: asyncio.Task = None
+        self._executor: ThreadPoolExecutor = None
+        self._conn: sqlite3.Connection = None
+        self._stats = {"batches": 0, "operations": 0, "failed_operations": 0,
+                       "max_batch": 0, "commit_seconds": 0.0, "wait_seconds": 0.0}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def _connect(self):
+        # Autocommit mode: transactions are managed explicitly in _apply_batch
+        conn = sqlite3.connect(pool.database, isolation_level=None, check_same_thread=False,
+                               factory=TimedConnection)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    async def start(self):
+        if self.running:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="write-queue")
+        loop = asyncio.get_running_loop()
+        self._conn = await loop.run_in_executor(self._executor, self._connect)
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Finish everything already queued, then stop the writer task."""
+        if not self.running:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._conn.close)
+        self._executor.shutdown()
+        self._conn = None
+        self._executor = None
+
+    async def submit(self, work):
+        if not self.running:
+            raise RuntimeError("Write queue is not running")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_Operation(work, future))
+        return await future
+
+    async def _collect(self, first):
+        batch = [first]
+        deadline = time.perf_counter() + self.batch_delay_ms / 1000
+        while len(batch) < self.batch_size:
+            try:
+                operation = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    operation = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            if operation is None:
+                # Stop marker: put it back so the loop exits after this batch
+                self._queue.put_nowait(None)
+                break
+            batch.append(operation)
+        return batch
+
+    async def _run(self):
+        while True:
+            first = await self._queue.get()
+            if first is None:
+                return
+            batch = await self._collect(first)
+            await self._apply(batch)
+
+    def _apply_batch(self, batch):
+        """Runs on the writer thread."""
+        conn = self._conn
+        delay = TRANSACTION_BACKOFF
+        for attempt in range(TRANSACTION_RETRIES + 1):
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for index, operation in enumerate(batch):
+                    savepoint = f"op{index}"
+                    conn.execute(f"SAVEPOINT {savepoint}")
+                    try:
+                        operation.outcome = (True, operation.work(conn))
+                        conn.execute(f"RELEASE {savepoint}")
+                    except Exception as e:
+                        if is_busy_error(e):
+                            raise
+                        conn.execute(f"ROLLBACK TO {savepoint}")
+                        conn.execute(f"RELEASE {savepoint}")
+                        operation.outcome = (False, e)
+                conn.execute("COMMIT")
+                return
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                if not is_busy_error(e) or attempt == TRANSACTION_RETRIES:
+                    raise
+            time.sleep(delay * (0.5 + random.random()))
+            delay *= 2
+
+    async def _apply(self, batch):
+        started = time.perf_counter()
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._apply_batch, batch)
+        except Exception as e:
+            for operation in batch:
+                operation.outcome = (False, e)
+        finished = time.perf_counter()
+
+        stats = self._stats
+        stats["batches"] += 1
+        stats["operations"] += len(batch)
+        stats["max_batch"] = max(stats["max_batch"], len(batch))
+        stats["commit_seconds"] += finished - started
+        for operation in batch:
+            stats["wait_seconds"] += finished - operation.queued_at
+            ok, value = operation.outcome
+            if operation.future.done():
+                continue
+            if ok:
+                operation.future.set_result(value)
+            else:
+                stats["failed_operations"] += 1
+                operation.future.set_exception(value)
+
+    def stats(self) -> dict:
+        stats = self._stats
+        batches = stats["batches"] or 1
+        operations = stats["operations"] or 1
+        return {
+            "batch_size": self.batch_size,
+            "batch_delay_ms": self.batch_delay_ms,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "batches": stats["batches"],
+            "operations": stats["operations"],
+            "failed_operations": stats["failed_operations"],
+            "avg_batch": round(stats["operations"] / batches, 2),
+            "max_batch": stats["max_batch"],
+            "avg_commit_ms": round(stats["commit_seconds"] * 1000 / batches, 3),
+            "avg_latency_ms": round(stats["wait_seconds"] * 1000 / operations, 3),
+        }
+
+
+write_queue = WriteQueue()